@@ -0,0 +1,143 @@
+"""
+Compare the per-page cost of pulling article links out of search result pages
+with a full BeautifulSoup tree (how the scrapers used to do it) against the
+lxml parse and compiled selectors they use now.
+
+    python benchmarks/bench_link_parsing.py [--fixtures DIR] [--repeat N]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from bs4 import BeautifulSoup
+
+import nyt
+import npr
+import wapo
+import buzzfeed
+from metrics import Metrics
+from parsing import parse_html
+from profiling import Profiler
+from fixtures import load_fixtures
+
+QUERY = 'election'
+
+
+def soup_nyt(html_source):
+    soup = BeautifulSoup(html_source)
+    hits = soup.findAll("ol", class_="searchResultsList flush")
+    return [hit.attrs["href"] for hit in hits[0].findAll("a")]
+
+
+def soup_wapo(html_source):
+    soup = BeautifulSoup(html_source)
+    hits = soup.findAll("div", class_="pb-feed-item ng-scope")
+    return [hit.findAll("a")[0].attrs['href'] for hit in hits]
+
+
+def soup_npr(html_source):
+    soup = BeautifulSoup(html_source)
+    hits = soup.findAll("article", class_="item")
+    return [hit.findAll("a")[0].attrs["href"] for hit in hits]
+
+
+def soup_buzzfeed_tag(html_source):
+    soup = BeautifulSoup(html_source)
+    hits = soup.findAll("article")
+    return ["https://www.buzzfeed.com" + hit.findAll("a")[0].attrs['href']
+            for hit in hits]
+
+
+def soup_buzzfeed_archive(html_source):
+    soup = BeautifulSoup(html_source)
+    hits = soup.findAll("ul", class_="flow")
+    return ["https://www.buzzfeed.com" + a.attrs['href']
+            for a in hits[0].findAll("a")
+            if QUERY in a.attrs['title'].lower() or
+            QUERY in a.contents[0].lower()]
+
+
+BEFORE = {'nyt_search': soup_nyt,
+          'wapo_search': soup_wapo,
+          'npr_search': soup_npr,
+          'buzzfeed_tag': soup_buzzfeed_tag,
+          'buzzfeed_archive': soup_buzzfeed_archive}
+
+AFTER = {'nyt_search': lambda page: nyt.get_article_links(parse_html(page)),
+         'wapo_search': lambda page: wapo.get_article_links(parse_html(page)),
+         'npr_search': lambda page: npr.get_article_links(parse_html(page)),
+         'buzzfeed_tag':
+             lambda page: buzzfeed.get_article_links(parse_html(page)),
+         'buzzfeed_archive':
+             lambda page: buzzfeed.get_archive_links(parse_html(page))}
+
+
+def time_per_page(extract, pages, repeat):
+    """Best-of-`repeat` mean time (in seconds) to extract links from a page."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            extract(page)
+        best = min(best, (time.perf_counter() - start) / len(pages))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark search result link extraction.')
+    parser.add_argument('--fixtures', type=str, default="",
+                        help="Directory of saved pages named <kind>_*.html. "
+                             "Stand-in pages are generated for missing kinds")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Number of timed passes over the fixture pages")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON")
+    args = parser.parse_args()
+
+    # BeautifulSoup warns when no parser is named, which is what we measure
+    warnings.simplefilter('ignore')
+    buzzfeed.QUERY = QUERY
+    # the state configure() would set up for the link extraction: metrics
+    # (timed, as in a real run) and a profiler that does nothing
+    for module in [nyt, npr, wapo, buzzfeed]:
+        module.METRICS = Metrics()
+        module.PROFILER = Profiler()
+
+    results = {}
+    for kind, pages in sorted(load_fixtures(args.fixtures or None).items()):
+        before, after = BEFORE[kind], AFTER[kind]
+        if [sorted(before(p)) for p in pages] != \
+                [sorted(after(p)) for p in pages]:
+            raise ValueError('Link extraction differs for {}'.format(kind))
+
+        t_before = time_per_page(before, pages, args.repeat)
+        t_after = time_per_page(after, pages, args.repeat)
+        results[kind] = {'pages': len(pages),
+                         'kb_per_page': sum(len(p) for p in pages) /
+                         1024. / len(pages),
+                         'before_ms': t_before * 1000.,
+                         'after_ms': t_after * 1000.,
+                         'speedup': t_before / t_after}
+
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+        return
+
+    print('{:<18}{:>7}{:>10}{:>12}{:>12}{:>10}'
+          .format('kind', 'pages', 'KB/page', 'before ms', 'after ms',
+                  'speedup'))
+    for kind, res in sorted(results.items()):
+        print('{:<18}{:>7}{:>10.1f}{:>12.2f}{:>12.2f}{:>9.1f}x'
+              .format(kind, res['pages'], res['kb_per_page'],
+                      res['before_ms'], res['after_ms'], res['speedup']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+End-to-end throughput of the scrapers against `news_server.py`, a local
+stand-in for the news sites with configurable latency, jitter and error
+rate, so changes can be measured (and compared between releases) without
+touching the live sites.
+
+Each source runs through its real code paths: `configure()` with the shared
+objects `scrape.py` would pass in, `discover_links()` (the search phase) and
+then `scrape_articles()` (the extraction phase) over the links it found.
+Plain HTTP requests are routed to the server by a transport adapter mounted
+on the fetcher's session, and the browser pool hands out stand-in browsers
+that load pages from the server, so rate limiting, concurrency limits and
+parsing all run as in a real scrape. The page cache, URL index and
+near-duplicate index are disabled so every run does the same work.
+
+For each source and phase, reports pages per second, articles per second,
+the p50/p99 latency of the requests, the CPU time of this process, and its
+peak RSS during the phase along with how far that peak rose above the RSS
+the phase started with. RSS is sampled from /proc, so it is only reported
+on Linux.
+
+    python benchmarks/bench_scrape.py [--sources S ...] [--latency MS]
+                                      [--jitter MS] [--error_rate P]
+                                      [--retries N] [--json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+import requests
+from selenium.common.exceptions import TimeoutException
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from browser_pool import BrowserPool, _Session
+from fetch import Fetcher, is_overloaded, is_retryable
+from http_cache import HTTPCache
+from metrics import Metrics
+from near_dup import DuplicateIndex
+from output import JSONLWriter
+from parse_pool import ParserPool
+from retry import RetryPolicy, CircuitBreaker
+from scrape import load_scraper
+from throttle import RateLimiter, AdaptiveConcurrency
+from url_index import URLIndex
+
+from news_server import local_url
+
+SERVER_FP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'news_server.py')
+
+# time (in seconds) between two samples of the RSS during a phase
+RSS_INTERVAL = 0.01
+
+# source name -> scraper module and the arguments of its run
+SOURCES = {'nyt': ('nyt', []),
+           'npr': ('npr', []),
+           'wapo': ('wapo', []),
+           'buzzfeed': ('buzzfeed', []),
+           'buzzfeed_archive': ('buzzfeed', ['-r', '11/01/2016 11/02/2016'])}
+
+
+class Recorder(object):
+    """Collects the latency of every request to the stand-in server."""
+    def __init__(self):
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def take(self):
+        with self._lock:
+            latencies, self.latencies = self.latencies, []
+        return latencies
+
+
+class LocalAdapter(requests.adapters.HTTPAdapter):
+    """Sends the fetcher's requests to the stand-in server instead."""
+    def __init__(self, server_url, recorder):
+        requests.adapters.HTTPAdapter.__init__(self, pool_maxsize=64)
+        self.server_url = server_url
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        request.url = local_url(self.server_url, request.url)
+        start = time.perf_counter()
+        try:
+            return requests.adapters.HTTPAdapter.send(self, request, **kwargs)
+        finally:
+            self.recorder.add(time.perf_counter() - start)
+
+
+class LocalBrowser(object):
+    """Stands in for a PhantomJS session by loading pages over HTTP."""
+    def __init__(self, server_url, recorder, timeout):
+        self.session = requests.Session()
+        self.server_url = server_url
+        self.recorder = recorder
+        self.timeout = timeout
+        self.page_source = None
+
+    def get(self, url):
+        start = time.perf_counter()
+        try:
+            resp = self.session.get(local_url(self.server_url, url),
+                                    timeout=self.timeout)
+        finally:
+            self.recorder.add(time.perf_counter() - start)
+        # a browser shows an error page rather than raising; the nearest
+        # thing to a real browser giving up on an overloaded site is a
+        # timeout
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise TimeoutException('{} loading {}'
+                                   .format(resp.status_code, url))
+        self.page_source = resp.text
+
+    def quit(self):
+        self.session.close()
+
+
+class LocalBrowserPool(BrowserPool):
+    def __init__(self, server_url, recorder, **kwargs):
+        BrowserPool.__init__(self, **kwargs)
+        self.server_url = server_url
+        self.recorder = recorder
+
+    def _launch(self):
+        self._incr('misses')
+        return _Session(LocalBrowser(self.server_url, self.recorder,
+                                     self.page_load_timeout))
+
+
+@contextlib.contextmanager
+def news_server(args):
+    """Start `news_server.py` on a free port and yield its address."""
+    proc = subprocess.Popen(
+        [sys.executable, SERVER_FP, '--port', '0',
+         '--latency', str(args.latency), '--jitter', str(args.jitter),
+         '--error_rate', str(args.error_rate), '--pages', str(args.pages),
+         '--seed', str(args.seed)],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        yield proc.stdout.readline().split()[-1]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def make_shared(args, server_url, recorder):
+    limiter = RateLimiter(args.rate, 1)
+    concurrency = AdaptiveConcurrency(maximum=args.max_concurrency,
+                                      overloaded=is_overloaded)
+    retry = RetryPolicy(args.retries, args.backoff, retryable=is_retryable,
+                        breaker=CircuitBreaker(args.breaker_threshold,
+                                               args.breaker_cooldown))
+    fetcher = Fetcher(limiter, concurrency, HTTPCache(''), timeout=30,
+                      retry=retry)
+    adapter = LocalAdapter(server_url, recorder)
+    fetcher.session.mount('http://', adapter)
+    fetcher.session.mount('https://', adapter)
+    return {'LIMITER': limiter, 'CONCURRENCY': concurrency,
+            'CACHE': fetcher.cache, 'FETCHER': fetcher,
+            'BROWSERS': LocalBrowserPool(server_url, recorder,
+                                         size=args.browsers),
+            'PARSER': ParserPool(args.parsers), 'INDEX': URLIndex(''),
+            'DEDUP': DuplicateIndex(''), 'METRICS': Metrics()}
+
+
+def close_shared(shared):
+    shared['BROWSERS'].close()
+    shared['PARSER'].close()
+    shared['FETCHER'].close()
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def current_rss():
+    """The resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open('/proc/self/statm', 'r') as handle:
+            return int(handle.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        return None
+
+
+@contextlib.contextmanager
+def measure(stats, recorder):
+    """Time a phase and fill `stats` with its request and resource use."""
+    recorder.take()
+
+    # ru_maxrss is the peak of the whole process so far, so later phases
+    # would inherit the peak of earlier ones; the RSS is sampled instead
+    rss = [current_rss()]
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(RSS_INTERVAL):
+            rss.append(current_rss())
+
+    sampler = threading.Thread(target=sample_rss)
+    sampler.daemon = True
+    sampler.start()
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        rss.append(current_rss())
+        peak_rss = max(rss) if None not in rss else None
+        latencies = recorder.take()
+        stats.update({
+            'seconds': wall,
+            'cpu_seconds': time.process_time() - cpu_start,
+            'requests': len(latencies),
+            'pages_per_sec': len(latencies) / wall if wall > 0 else None,
+            'p50_ms': percentile(latencies, 0.5) * 1000.
+            if latencies else None,
+            'p99_ms': percentile(latencies, 0.99) * 1000.
+            if latencies else None,
+            'peak_rss_mb': peak_rss / 1024. ** 2
+            if peak_rss is not None else None,
+            'rss_growth_mb': (peak_rss - rss[0]) / 1024. ** 2
+            if peak_rss is not None else None})
+
+
+def bench_source(source, args, server_url):
+    module, extra_args = SOURCES[source]
+    recorder = Recorder()
+    shared = make_shared(args, server_url, recorder)
+    result = {'collect': {}, 'scrape': {}, 'status': 'ok'}
+
+    # the scrapers write their links, checkpoints and output under ./
+    workdir = tempfile.mkdtemp(prefix='bench_scrape_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    quiet = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    try:
+        scraper = load_scraper(module, 'bench_{}'.format(source))
+        scraper.configure(['-q', args.query, '--workers', str(args.workers),
+                           '--prefetch', str(args.prefetch),
+                           '--url_index', '', '--dedup_index', '',
+                           '--cache_dir', ''] + extra_args, shared)
+        jsonl_fp = './scraped_json/{}.jsonl'.format(source)
+        scraper.CHECKPOINT.start(jsonl_fp)
+
+        links = []
+        with contextlib.redirect_stdout(quiet):
+            with measure(result['collect'], recorder):
+                scraper.discover_links(links.extend)
+            result['collect']['links'] = len(set(links))
+
+            with measure(result['scrape'], recorder):
+                with JSONLWriter(jsonl_fp) as writer:
+                    scraper.scrape_articles(writer)
+            result['scrape']['articles'] = writer.count
+            result['scrape']['articles_per_sec'] = \
+                writer.count / result['scrape']['seconds']
+    except Exception as exc:
+        result['status'] = 'failed: {!r}'.format(exc)
+    finally:
+        if quiet is not sys.stdout:
+            quiet.close()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        close_shared(shared)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scrapers against a local stand-in server.')
+    parser.add_argument('--sources', type=str, nargs='+',
+                        default=sorted(SOURCES), choices=sorted(SOURCES),
+                        help="Sources to benchmark")
+    parser.add_argument('--query', type=str, default='election',
+                        help="Query to search for. The Buzzfeed archive mode "
+                             "only keeps links whose titles contain it")
+    parser.add_argument('--pages', type=int, default=5,
+                        help="Number of result pages of every search")
+    parser.add_argument('--latency', type=float, default=50.,
+                        help="Time (in ms) every response is delayed by")
+    parser.add_argument('--jitter', type=float, default=20.,
+                        help="Maximum random extra delay (in ms)")
+    parser.add_argument('--error_rate', type=float, default=0.,
+                        help="Fraction of requests answered with a 503")
+    parser.add_argument('--retries', type=int, default=3,
+                        help="Number of times a failed request is retried")
+    parser.add_argument('--backoff', type=float, default=0.1,
+                        help="Base delay (in seconds) between retries")
+    parser.add_argument('--breaker_threshold', type=int, default=5,
+                        help="Number of failed requests in a row after which "
+                             "requests to a host are paused")
+    parser.add_argument('--breaker_cooldown', type=float, default=1.,
+                        help="Time (in seconds) requests to a failing host "
+                             "are paused for")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the stand-in pages and delays")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="Requests per second per host (no limit by "
+                             "default)")
+    parser.add_argument('--max_concurrency', type=int, default=8,
+                        help="Upper bound on the requests in flight per host")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="Number of articles downloaded in parallel")
+    parser.add_argument('--parsers', type=int, default=0,
+                        help="Number of article parsing processes")
+    parser.add_argument('--prefetch', type=int, default=1,
+                        help="Number of search pages rendered at once")
+    parser.add_argument('--browsers', type=int, default=1,
+                        help="Number of stand-in browser sessions")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Show the scrapers' own output")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON")
+    args = parser.parse_args()
+
+    with news_server(args) as server_url:
+        results = dict((source, bench_source(source, args, server_url))
+                       for source in args.sources)
+
+    if args.json:
+        config = dict((k, v) for k, v in vars(args).items()
+                      if k not in ['json', 'verbose'])
+        print(json.dumps({'config': config, 'results': results}, indent=4,
+                         sort_keys=True))
+        return
+
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else '-'
+
+    print('{:<18}{:<9}{:>7}{:>8}{:>9}{:>10}{:>10}{:>9}{:>9}{:>9}{:>9}'
+          .format('source', 'phase', 'items', 'reqs', 'req/s', 'items/s',
+                  'p50 ms', 'p99 ms', 'CPU s', 'RSS MB', '+RSS MB'))
+    for source, res in sorted(results.items()):
+        if res['status'] != 'ok':
+            print('{:<18}{}'.format(source, res['status']))
+            continue
+        for phase, items in [('collect', 'links'), ('scrape', 'articles')]:
+            stats = res[phase]
+            print('{:<18}{:<9}{:>7}{:>8}{:>9}{:>10}{:>10}{:>9}{:>9}{:>9}{:>9}'
+                  .format(source, phase, stats[items], stats['requests'],
+                          fmt(stats['pages_per_sec'], '.1f'),
+                          fmt(stats[items] / stats['seconds'], '.1f'),
+                          fmt(stats['p50_ms'], '.1f'),
+                          fmt(stats['p99_ms'], '.1f'),
+                          fmt(stats['cpu_seconds'], '.2f'),
+                          fmt(stats['peak_rss_mb'], '.0f'),
+                          fmt(stats['rss_growth_mb'], '.0f')))
+
+
+if __name__ == "__main__":
+    main()
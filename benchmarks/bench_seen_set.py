@@ -0,0 +1,119 @@
+"""
+Memory per link of the two seen sets the scrapers can track their link
+frontier with: a Python set of canonical URLs, and the Bloom filter backed
+`SeenSet`. Also measures the false-positive rate of the filter on links it
+has not seen, and how long adding and checking a link takes. Memory is
+what tracemalloc sees; SQLite's page cache for the on-disk half of
+`SeenSet` is bounded (2 MB by default) and not included.
+
+    python benchmarks/bench_seen_set.py [--links N ...] [--error RATE]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from seen_set import SeenSet
+from url_index import canonicalize_url
+
+
+def gen_links(n, offset=0):
+    for i in range(offset, offset + n):
+        yield canonicalize_url(
+            'https://www.nytimes.com/2016/{:02}/{:02}/us/politics/'
+            'article-{}-about-the-campaign.html'
+            .format(i % 12 + 1, i % 28 + 1, i))
+
+
+def add_all(seen, links):
+    for link in links:
+        if link not in seen:
+            seen.add(link)
+    return seen
+
+
+def traced_bytes(make, n):
+    """Bytes held by a seen set made by `make()` once `n` links are added."""
+    tracemalloc.start()
+    seen = add_all(make(), gen_links(n))
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seen, traced
+
+
+def us_per_link(make, links):
+    start = time.perf_counter()
+    seen = add_all(make(), links)
+    elapsed = time.perf_counter() - start
+    return seen, elapsed / len(links) * 1e6
+
+
+def bench(n_links, error_rate):
+    _, set_bytes = traced_bytes(set, n_links)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        disk_fp = os.path.join(tmp, 'seen.sqlite')
+        seen, bloom_bytes = traced_bytes(
+            lambda: SeenSet(error_rate, fp=disk_fp), n_links)
+
+        # the links below were never added, so every hit is a false positive
+        n_probes = min(n_links, 100000)
+        hits = sum(1 for link in gen_links(n_probes, offset=n_links)
+                   if link in seen.filter)
+        filter_bytes = seen.filter.nbytes
+        seen.close()
+        disk_bytes = os.path.getsize(disk_fp)
+
+    links = list(gen_links(n_links))
+    _, set_us = us_per_link(set, links)
+    seen, bloom_us = us_per_link(lambda: SeenSet(error_rate), links)
+    seen.close()
+
+    return {'links': n_links,
+            'set_bytes_per_link': set_bytes / float(n_links),
+            'set_us_per_link': set_us,
+            'bloom_bytes_per_link': bloom_bytes / float(n_links),
+            'filter_bytes_per_link': filter_bytes / float(n_links),
+            'disk_bytes_per_link': disk_bytes / float(n_links),
+            'bloom_us_per_link': bloom_us,
+            'false_positive_rate': hits / float(n_probes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the memory use of the seen-link sets.')
+    parser.add_argument('--links', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help="Frontier sizes to measure")
+    parser.add_argument('--error', type=float, default=0.001,
+                        help="False-positive rate of the Bloom filter")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = [bench(n, args.error) for n in args.links]
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+        return
+
+    print('{:>10}{:>14}{:>14}{:>14}{:>12}{:>10}{:>10}{:>10}'
+          .format('links', 'set B/link', 'bloom B/link', 'filter B/link',
+                  'disk B/link', 'set us', 'bloom us', 'FP rate'))
+    for res in results:
+        print('{:>10}{:>14.1f}{:>14.1f}{:>14.2f}{:>12.1f}{:>10.2f}{:>10.2f}'
+              '{:>10.5f}'
+              .format(res['links'], res['set_bytes_per_link'],
+                      res['bloom_bytes_per_link'],
+                      res['filter_bytes_per_link'],
+                      res['disk_bytes_per_link'], res['set_us_per_link'],
+                      res['bloom_us_per_link'], res['false_positive_rate']))
+
+
+if __name__ == "__main__":
+    main()
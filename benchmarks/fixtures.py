@@ -0,0 +1,124 @@
+"""
+Stand-in pages for the four sources, shaped like the markup the scrapers
+select on. Real pages saved from a run (e.g. copied out of the page cache)
+can be used instead by putting them in a directory as `<kind>_*.html`, where
+`<kind>` is one of the keys of `GENERATORS`. `article()` makes the article
+page a search result links to.
+"""
+import os
+import glob
+import random
+
+WORDS = ("election campaign senate vote poll debate policy state city "
+         "court budget report health market trade climate school").split()
+
+
+def _words(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def _chrome(rng, body, n_nav=300):
+    """Wrap `body` in the navigation, ads and scripts of a real page."""
+    nav = '\n'.join(
+        '<li class="nav-item"><a href="/section/{0}">{1}</a>'
+        '<div class="promo"><span>{2}</span></div></li>'
+        .format(i, _words(rng, 2), _words(rng, 8)) for i in range(n_nav))
+    script = '<script>var data = {};</script>'.format(
+        '[' + ','.join(str(rng.random()) for _ in range(2000)) + ']')
+    return ('<!DOCTYPE html><html><head><title>{}</title>{}</head><body>'
+            '<header><ul class="nav">{}</ul></header><main>{}</main>'
+            '<footer><ul class="nav">{}</ul></footer></body></html>'
+            .format(_words(rng, 4), script, nav, body, nav))
+
+
+def nyt_search(rng, n_results=10):
+    items = ''.join(
+        '<li class="story"><div class="element2"><h3>'
+        '<a href="http://www.nytimes.com/2016/11/{0:02}/us/{1}.html">{2}</a>'
+        '</h3><p class="summary">{3}</p></div></li>'
+        .format(rng.randint(1, 28), rng.getrandbits(40), _words(rng, 6),
+                _words(rng, 30)) for _ in range(n_results))
+    return _chrome(rng, '<ol class="searchResultsList flush">{}</ol>'
+                   .format(items))
+
+
+def wapo_search(rng, n_results=20):
+    items = ''.join(
+        '<div class="pb-feed-item ng-scope"><div class="pb-feed-headline">'
+        '<a href="https://www.washingtonpost.com/news/the-fix/wp/2016/11/'
+        '{0:02}/{1}/">{2}</a></div><div class="pb-feed-description">{3}'
+        '</div></div>'
+        .format(rng.randint(1, 28), rng.getrandbits(40), _words(rng, 6),
+                _words(rng, 30)) for _ in range(n_results))
+    return _chrome(rng, '<div class="pb-feed">{}</div>'.format(items))
+
+
+def npr_search(rng, n_results=10):
+    items = ''.join(
+        '<article class="item has-image"><div class="item-info">'
+        '<h2 class="title"><a href="http://www.npr.org/2016/11/{0:02}/{1}/'
+        'story">{2}</a></h2><p class="teaser">{3}</p></div></article>'
+        .format(rng.randint(1, 28), rng.getrandbits(30), _words(rng, 6),
+                _words(rng, 30)) for _ in range(n_results))
+    return _chrome(rng, '<div id="main-section">{}</div>'.format(items))
+
+
+def buzzfeed_tag(rng, n_results=20):
+    items = ''.join(
+        '<article class="story"><a href="/author/{0}">{1}</a>'
+        '<p>{2}</p></article>'
+        .format(rng.getrandbits(40), _words(rng, 6), _words(rng, 20))
+        for _ in range(n_results))
+    return _chrome(rng, items)
+
+
+def buzzfeed_archive(rng, n_results=200):
+    items = ''.join(
+        '<li><a href="/author/{0}" title="{1}">{2}</a></li>'
+        .format(rng.getrandbits(40), _words(rng, 12), _words(rng, 6))
+        for _ in range(n_results))
+    return _chrome(rng, '<ul class="flow">{}</ul>'.format(items))
+
+
+def article(rng, n_paragraphs=12):
+    title = _words(rng, 8).capitalize()
+    paragraphs = ''.join('<p>{}.</p>'.format(_words(rng, 60).capitalize())
+                         for _ in range(n_paragraphs))
+    head = ('<meta property="og:title" content="{0}">'
+            '<meta name="author" content="{1}">'
+            '<meta property="article:published_time" '
+            'content="2016-{2:02}-{3:02}T12:00:00">'
+            '<meta name="description" content="{4}">'
+            .format(title, _words(rng, 2).title(), rng.randint(1, 12),
+                    rng.randint(1, 28), _words(rng, 20)))
+    body = ('<article><h1>{}</h1><div class="byline">By {}</div>{}'
+            '</article>'.format(title, _words(rng, 2).title(), paragraphs))
+    page = _chrome(rng, body, n_nav=100)
+    return page.replace('</head>', head + '</head>', 1)
+
+
+GENERATORS = {'nyt_search': nyt_search,
+              'wapo_search': wapo_search,
+              'npr_search': npr_search,
+              'buzzfeed_tag': buzzfeed_tag,
+              'buzzfeed_archive': buzzfeed_archive}
+
+
+def load_fixtures(fixture_dir=None, n_pages=5, seed=0):
+    """
+    Return a dict mapping each fixture kind to a list of pages, read from
+    `fixture_dir` if it has any, and generated otherwise.
+    """
+    rng = random.Random(seed)
+    fixtures = {}
+    for kind, generate in sorted(GENERATORS.items()):
+        pages = []
+        if fixture_dir:
+            for fp in sorted(glob.glob(os.path.join(fixture_dir,
+                                                    kind + '_*.html'))):
+                with open(fp, 'r') as handle:
+                    pages.append(handle.read())
+        if len(pages) == 0:
+            pages = [generate(rng) for _ in range(n_pages)]
+        fixtures[kind] = pages
+    return fixtures
@@ -0,0 +1,144 @@
+"""
+A local stand-in for the four news sites, so the scrapers can be driven end
+to end without touching the network. Requests are expected in the form
+`/<host><path>?<query>`, with the fragment of the original URL (which NYT
+and WaPo search pages paginate with) passed as a `_fragment` parameter; see
+`local_url()`. Search pages and article pages are generated from
+`fixtures.py`, seeded by their URL so a page is the same every time it is
+requested.
+
+    python benchmarks/news_server.py [--port N] [--latency MS] [--jitter MS]
+                                     [--error_rate P] [--pages N]
+"""
+import os
+import sys
+import time
+import zlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, quote
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import GENERATORS, article
+
+
+def local_url(server_url, url):
+    """Rewrite `url` to the address the stand-in server serves it at."""
+    parts = urlsplit(url)
+    query = parts.query
+    if parts.fragment:
+        query += ('&' if query else '') + \
+            '_fragment=' + quote(parts.fragment, safe='')
+    return '{}/{}{}{}'.format(server_url, parts.netloc, parts.path or '/',
+                              '?' + query if query else '')
+
+
+def route(host, path, params):
+    """Return the fixture kind of a page and its search result page number."""
+    fragment = params.get('_fragment', [''])[0]
+    if host == 'query.nytimes.com':
+        # #/<query>/<from_last>/<doc_type>/<page>/allauthors/<sort_by>
+        return 'nyt_search', int(fragment.strip('/').split('/')[3])
+    if host.endswith('washingtonpost.com') and path.startswith('/newssearch'):
+        return 'wapo_search', int(fragment.rpartition('-')[2] or 1)
+    if host.endswith('npr.org') and path.startswith('/search'):
+        return 'npr_search', int(params.get('start', ['0'])[0]) // 10 + 1
+    if host.endswith('buzzfeed.com') and path.startswith('/tag/'):
+        return 'buzzfeed_tag', int(params.get('p', ['1'])[0])
+    if host.endswith('buzzfeed.com') and path.startswith('/archive/'):
+        return 'buzzfeed_archive', 1
+    return 'article', None
+
+
+class NewsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0., jitter=0., error_rate=0.,
+                 pages=5, seed=0):
+        ThreadingHTTPServer.__init__(self, address, NewsHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.pages = pages
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def page(self, path_qs):
+        """Return the page at `path_qs`."""
+        parts = urlsplit(path_qs)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        params = parse_qs(parts.query)
+        kind, page_num = route(host, '/' + path, params)
+
+        rng = random.Random(zlib.crc32(path_qs.encode('utf-8')) + self.seed)
+        if kind == 'article':
+            return article(rng)
+        if page_num > self.pages:
+            # past the last page of results
+            return GENERATORS[kind](rng, n_results=0)
+        return GENERATORS[kind](rng)
+
+
+class NewsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            delay = server.latency + server.rng.uniform(0, server.jitter)
+            failed = server.rng.random() < server.error_rate
+        time.sleep(delay)
+
+        if failed:
+            status, body = 503, 'Service Unavailable'
+        else:
+            status, body = 200, server.page(self.path)
+
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve stand-in news site pages for benchmarks.')
+    parser.add_argument('--port', type=int, default=8000,
+                        help="Port to listen on. 0 picks a free one")
+    parser.add_argument('--latency', type=float, default=0.,
+                        help="Time (in ms) every response is delayed by")
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help="Maximum random extra delay (in ms)")
+    parser.add_argument('--error_rate', type=float, default=0.,
+                        help="Fraction of requests answered with a 503")
+    parser.add_argument('--pages', type=int, default=5,
+                        help="Number of result pages of every search")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the generated pages and of the delays")
+    args = parser.parse_args()
+
+    server = NewsServer(('127.0.0.1', args.port), args.latency / 1000.,
+                        args.jitter / 1000., args.error_rate, args.pages,
+                        args.seed)
+    # the benchmark reads the address off the first line
+    print('Serving on http://127.0.0.1:{}'.format(server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import time
+import queue
+import threading
+import contextlib
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+
+class _Session(object):
+    def __init__(self, browser):
+        self.browser = browser
+        self.pages = 0
+
+
+class BrowserPool(object):
+    """
+    A bounded pool of long-lived PhantomJS sessions. Sessions are checked out
+    with `session()` and handed back when the caller is done, so the cost of
+    starting a browser is only paid once every `max_pages` page loads (or
+    after a crash) rather than on every page. Startup times also go to
+    `metrics` if one is given.
+    """
+    def __init__(self, size=1, page_load_timeout=30, max_pages=100,
+                 window_size=(1120, 550), metrics=None):
+        self.size = size
+        self.metrics = metrics
+        self.max_pages = max_pages
+        self.window_size = window_size
+        self.page_load_timeout = page_load_timeout
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.stats = {'hits': 0, 'misses': 0, 'recycled': 0, 'crashed': 0,
+                      'pages': 0, 'startup_time': 0.}
+
+    def _incr(self, key, val=1):
+        with self._lock:
+            self.stats[key] += val
+
+    def _launch(self):
+        start = time.time()
+        browser = webdriver.PhantomJS()
+        browser.implicitly_wait(self.page_load_timeout)
+        browser.set_page_load_timeout(self.page_load_timeout)
+        browser.set_window_size(*self.window_size)
+
+        self._incr('misses')
+        self._incr('startup_time', time.time() - start)
+        if self.metrics is not None:
+            self.metrics.observe('browser_startup', '', time.time() - start)
+        return _Session(browser)
+
+    def _discard(self, sess, reason):
+        self._incr(reason)
+        try:
+            sess.browser.quit()
+        except Exception:
+            pass
+
+    @contextlib.contextmanager
+    def session(self):
+        if self._closed:
+            raise RuntimeError('Browser pool has been closed')
+
+        self._slots.acquire()
+        try:
+            try:
+                sess = self._idle.get_nowait()
+                self._incr('hits')
+            except queue.Empty:
+                sess = self._launch()
+
+            try:
+                yield sess.browser
+            except TimeoutException:
+                # a slow page does not mean the browser is broken
+                self._release(sess)
+                raise
+            except WebDriverException:
+                self._discard(sess, 'crashed')
+                raise
+            except BaseException:
+                self._release(sess)
+                raise
+            else:
+                self._release(sess)
+        finally:
+            self._slots.release()
+
+    def _release(self, sess):
+        sess.pages += 1
+        self._incr('pages')
+        if self._closed or sess.pages >= self.max_pages:
+            self._discard(sess, 'recycled')
+        else:
+            self._idle.put(sess)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                sess = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                sess.browser.quit()
+            except Exception:
+                pass
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        n_checkouts = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / float(n_checkouts) if n_checkouts else 0.
+        avg_startup = stats['startup_time'] / stats['misses'] \
+            if stats['misses'] else 0.
+        return ('Browser pool: {} pages, {} hits / {} misses ({:.1%} hit rate), '
+                '{} recycled, {} crashed, {:.2f}s avg startup ({:.1f}s total)'
+                .format(stats['pages'], stats['hits'], stats['misses'],
+                        hit_rate, stats['recycled'], stats['crashed'],
+                        avg_startup, stats['startup_time']))
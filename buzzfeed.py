@@ -1,24 +1,50 @@
 import os
+import re
 import json
 import datetime
-import time
 import argparse
+import collections
+import contextlib
 
 import pytz
-from bs4 import BeautifulSoup
-from newspaper import Article
 
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
+from browser_pool import BrowserPool
+from checkpoint import Checkpoint
+from fetch import Fetcher, is_overloaded, is_retryable
+from http_cache import HTTPCache
+from metrics import Metrics
+from multi_match import QueryMatcher
+from near_dup import DuplicateIndex
+from output import JSONLWriter, new_output_fp, jsonl_to_envelope, \
+    write_query_outputs
+from parse_pool import ParserPool
+from parsing import parse_html, css, first_hrefs
+from pipeline import pipeline, prefetch
+from profiling import Profiler
+from retry import RetryPolicy, CircuitBreaker, DeadLetters, read_links
+from seen_set import make_seen_set
+from throttle import RateLimiter, AdaptiveConcurrency, parse_host_rates
+from url_index import URLIndex, canonicalize_url
+
+
+ARCHIVE_RE = re.compile(r'<ul[^>]*\sclass="[^"]*\bflow\b')
+RESULT_ITEMS = css('article')
+ARCHIVE_LISTS = css('ul.flow')
 
 
 parser = argparse.ArgumentParser(
     description='A web scraper for Buzzfeed articles.')
 
-requiredNamed = parser.add_argument_group('required arguments')
-requiredNamed.add_argument('-q', '--query', type=str, required=True,
-                           help="Query string")
-
+parser.add_argument('-q', '--query', type=str, default="",
+                    help="Query string. Required unless --query_file is "
+                         "given")
+parser.add_argument('--query_file', type=str, default="",
+                    help="Path to a newline-delimited file of queries to run "
+                         "in one batch, along with or instead of -q. Articles "
+                         "found by several queries are scraped once, and a "
+                         "JSONL file per query references those it found. "
+                         "With --date_range, all the queries are matched in "
+                         "a single pass over the archives")
 parser.add_argument('-l', '--link_file', type=str, default="",
                     help="Path to a newline-delimited file of article links "
                          "to scrape")
@@ -28,19 +54,199 @@ parser.add_argument('-r', '--date_range', type=str, default="",
                          "supplied, the scraper will default to searching "
                          "Buzzfeed's recently tagged articles.")
 
+parser.add_argument('--resume', action='store_true',
+                    help="Continue the last interrupted run with the same "
+                         "arguments from its checkpoint instead of starting over")
+parser.add_argument('--envelope', action='store_true',
+                    help="In addition to the streamed JSONL file, save the "
+                         "articles in a single JSON document once the run "
+                         "finishes")
+
 parser.add_argument('--sleep_time', type=int, default=5,
-                    help="Time (in seconds) to wait between queries")
+                    help="Time (in seconds) to wait between queries to the "
+                         "same host. Ignored if --rate is given")
+parser.add_argument('--rate', type=float, default=None,
+                    help="Maximum number of requests per second to any single "
+                         "host. Defaults to 1 / sleep_time (no limit if "
+                         "sleep_time is 0)")
+parser.add_argument('--burst', type=int, default=1,
+                    help="Number of requests to a host that may be sent "
+                         "back-to-back before --rate applies")
+parser.add_argument('--host_rates', type=str, default="",
+                    help="A space separated string of per-host overrides of "
+                         "the form 'host=rate[:burst]', e.g. "
+                         "'query.nytimes.com=0.2 www.nytimes.com=2:5'")
+parser.add_argument('--max_concurrency', type=int, default=8,
+                    help="Upper bound on the number of requests in flight to a "
+                         "single host. The actual limit adapts to each host's "
+                         "latency and error rate")
+parser.add_argument('--cache_dir', type=str, default="./cache",
+                    help="Directory of the on-disk page cache. Pass an empty "
+                         "string to disable caching")
+parser.add_argument('--archive_dir', type=str, default="./archive_listings",
+                    help="Directory where the links listed on past archive "
+                         "days are kept for good, apart from the page cache, "
+                         "so later searches of those days (for any query) "
+                         "need no network at all")
+parser.add_argument('--cache_size', type=int, default=1024,
+                    help="Disk budget (in MB) of the page cache. The least "
+                         "recently used pages are evicted beyond it")
+parser.add_argument('--search_ttl', type=int, default=60 * 60,
+                    help="Time (in seconds) a cached search page stays fresh")
+parser.add_argument('--article_ttl', type=int, default=30 * 24 * 60 * 60,
+                    help="Time (in seconds) a cached article page stays fresh")
+parser.add_argument('--url_index', type=str, default="./url_index.sqlite",
+                    help="Path of the index of articles scraped on earlier "
+                         "runs, which are skipped. Pass an empty string to "
+                         "disable it")
+parser.add_argument('--rescrape', action='store_true',
+                    help="Scrape articles again even if the URL index says "
+                         "they were scraped on an earlier run")
+parser.add_argument('--seen_set', type=str, default="set",
+                    choices=['set', 'bloom'],
+                    help="How to remember the links already queued. 'bloom' "
+                         "keeps a Bloom filter in memory and confirms its hits "
+                         "against a temporary on-disk set, so memory stays "
+                         "small on very large link frontiers")
+parser.add_argument('--seen_error', type=float, default=0.001,
+                    help="False-positive rate of the 'bloom' seen set. Each "
+                         "false positive costs one lookup on disk")
+parser.add_argument('--dedup_index', type=str, default="./near_dups.sqlite",
+                    help="Path of the index of article text signatures used "
+                         "to find near duplicates (e.g. the same wire story "
+                         "on several sites). Pass an empty string to disable "
+                         "it")
+parser.add_argument('--dup_threshold', type=float, default=0.8,
+                    help="Estimated Jaccard similarity of the word 5-grams of "
+                         "two articles above which they count as duplicates")
+parser.add_argument('--drop_duplicates', action='store_true',
+                    help="Leave near duplicates of earlier articles out of "
+                         "the output instead of saving them with a "
+                         "'duplicate_of' pointer")
+parser.add_argument('--metrics_file', type=str, default="",
+                    help="Path of a file kept up to date during the run with "
+                         "timings of each stage (page loads, link extraction, "
+                         "downloads, parsing, output) and event counts, by "
+                         "host. Written in the Prometheus text format if it "
+                         "ends in .prom and as JSON otherwise")
+parser.add_argument('--metrics_interval', type=float, default=10.,
+                    help="Time (in seconds) between updates of "
+                         "--metrics_file")
+parser.add_argument('--profile', type=str, default=None,
+                    choices=['cpu', 'mem'],
+                    help="Profile a sample of the search pages (link "
+                         "collection), of the articles (extraction) and of "
+                         "their output, each phase separately. 'cpu' dumps "
+                         "cProfile stats, 'mem' traces allocations with "
+                         "tracemalloc and reports the top allocation sites. "
+                         "Pages parsed by --parsers processes are not "
+                         "profiled")
+parser.add_argument('--profile_sample', type=float, default=0.05,
+                    help="Fraction of search pages and articles profiled "
+                         "with --profile. Only one is profiled at a time. "
+                         "Tracing allocations slows the whole process down "
+                         "while it runs, so keep this small with 'mem'")
+parser.add_argument('--profile_dir', type=str, default="./profiles",
+                    help="Directory the --profile output is written to")
 parser.add_argument('--page_timeout', type=int, default=30,
                     help="Time (in seconds) after which we stop trying to load "
                          "a page and retry")
-
-def parse_args(parser):
-    args = parser.parse_args()
-    QUERY = args.query
-    QUERY = QUERY.replace(' ', '+')
-
+parser.add_argument('--retries', type=int, default=3,
+                    help="Number of times a page that timed out or was "
+                         "refused as overloaded is retried before it is "
+                         "given up on")
+parser.add_argument('--backoff', type=float, default=1.,
+                    help="Base delay (in seconds) between retries. The n-th "
+                         "retry waits a random time of up to backoff * 2^n "
+                         "seconds")
+parser.add_argument('--max_backoff', type=float, default=60.,
+                    help="Upper bound (in seconds) on the delay between "
+                         "retries")
+parser.add_argument('--breaker_threshold', type=int, default=5,
+                    help="Number of failed requests in a row after which "
+                         "requests to a host are paused. 0 never pauses")
+parser.add_argument('--breaker_cooldown', type=float, default=60.,
+                    help="Time (in seconds) requests to a failing host are "
+                         "paused for. Doubles while the host keeps failing")
+parser.add_argument('--dead_letter_dir', type=str, default="./dead_letters",
+                    help="Directory of the files listing the pages given up "
+                         "on, which can be passed to --link_file to retry "
+                         "their articles")
+parser.add_argument('--workers', type=int, default=1,
+                    help="Number of articles to download in parallel. "
+                         "Requests to the same host are still rate limited")
+parser.add_argument('--parsers', type=int, default=0,
+                    help="Number of processes that parse downloaded articles. "
+                         "Parsing is CPU-bound, so use up to one per core. "
+                         "0 parses in the download threads")
+parser.add_argument('--prefetch', type=int, default=1,
+                    help="Number of search result pages to render at once. "
+                         "Pages past the last result are cancelled. Needs as "
+                         "many --browsers to be effective")
+parser.add_argument('--archive_workers', type=int, default=8,
+                    help="Number of archive days fetched at once when "
+                         "searching the archives with --date_range. Days "
+                         "fetched before are read from the cache")
+parser.add_argument('--browsers', type=int, default=1,
+                    help="Maximum number of headless browser sessions to keep "
+                         "open at once")
+parser.add_argument('--pages_per_browser', type=int, default=100,
+                    help="Number of pages a browser session renders before it "
+                         "is restarted")
+
+def parse_args(parser, argv=None):
+    args = parser.parse_args(argv)
+    QUERIES = []
+    if len(args.query) > 0:
+        QUERIES.append(args.query.replace(' ', '+'))
+    if len(args.query_file) > 0:
+        with open(args.query_file, 'r') as handle:
+            for line in handle:
+                query = line.strip().replace(' ', '+')
+                if len(query) > 0 and query not in QUERIES:
+                    QUERIES.append(query)
+    if len(QUERIES) == 0:
+        parser.error('one of -q/--query or --query_file is required')
+    QUERY = QUERIES[0]
+
+    RESUME = args.resume
+    ENVELOPE = args.envelope
     SLEEP_TIME = args.sleep_time
+    RATE = args.rate
+    if RATE is None and SLEEP_TIME > 0:
+        RATE = 1. / SLEEP_TIME
+    BURST = args.burst
+    HOST_RATES = parse_host_rates(args.host_rates)
     PAGE_LOAD_TIMEOUT = args.page_timeout
+    CACHE_DIR = args.cache_dir
+    ARCHIVE_DIR = args.archive_dir
+    CACHE_SIZE = args.cache_size * 1024 ** 2
+    CACHE_TTLS = {'search': args.search_ttl, 'article': args.article_ttl}
+    URL_INDEX = args.url_index
+    RESCRAPE = args.rescrape
+    SEEN_SET = args.seen_set
+    SEEN_ERROR = args.seen_error
+    DEDUP_INDEX = args.dedup_index
+    DUP_THRESHOLD = args.dup_threshold
+    DROP_DUPLICATES = args.drop_duplicates
+    METRICS_FILE = args.metrics_file
+    METRICS_INTERVAL = args.metrics_interval
+    PROFILE = args.profile
+    PROFILE_SAMPLE = args.profile_sample
+    PROFILE_DIR = args.profile_dir
+    RETRIES = args.retries
+    BACKOFF = args.backoff
+    MAX_BACKOFF = args.max_backoff
+    BREAKER_THRESHOLD = args.breaker_threshold
+    BREAKER_COOLDOWN = args.breaker_cooldown
+    DEAD_LETTER_DIR = args.dead_letter_dir
+    MAX_CONCURRENCY = args.max_concurrency
+    WORKERS = args.workers
+    PARSERS = args.parsers
+    PREFETCH = args.prefetch
+    ARCHIVE_WORKERS = args.archive_workers
+    POOL_SIZE = args.browsers
+    PAGES_PER_BROWSER = args.pages_per_browser
 
     LINKS_FROM_FILE = False
     if len(args.link_file) > 0:
@@ -51,65 +257,99 @@ def parse_args(parser):
         FROM_LAST = dr.split(' ')
     else:
         FROM_LAST = None
-    return QUERY, SLEEP_TIME, PAGE_LOAD_TIMEOUT, LINKS_FROM_FILE, FROM_LAST
+    return QUERY, QUERIES, SLEEP_TIME, PAGE_LOAD_TIMEOUT, LINKS_FROM_FILE, \
+        FROM_LAST, RATE, BURST, HOST_RATES, MAX_CONCURRENCY, WORKERS, \
+        PARSERS, PREFETCH, ARCHIVE_WORKERS, POOL_SIZE, PAGES_PER_BROWSER, \
+        CACHE_DIR, ARCHIVE_DIR, CACHE_SIZE, CACHE_TTLS, URL_INDEX, RESCRAPE, \
+        SEEN_SET, SEEN_ERROR, DEDUP_INDEX, DUP_THRESHOLD, DROP_DUPLICATES, \
+        METRICS_FILE, METRICS_INTERVAL, PROFILE, PROFILE_SAMPLE, PROFILE_DIR, \
+        RETRIES, BACKOFF, MAX_BACKOFF, BREAKER_THRESHOLD, BREAKER_COOLDOWN, \
+        DEAD_LETTER_DIR, RESUME, ENVELOPE
 
 
 def render(query_url):
-    browser = webdriver.PhantomJS()
-    browser.set_window_size(1120, 550)
+    html_source = CACHE.get(query_url, 'search')
+    if html_source is not None:
+        return html_source
 
-    browser.implicitly_wait(PAGE_LOAD_TIMEOUT)
-    browser.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    # timeouts are retried with backoff, see --retries
+    html_source = FETCHER.retry.call(query_url, load_page, query_url)
+
+    CACHE.put(query_url, 'search', html_source)
+    return html_source
 
-    try:
-        browser.get(query_url)
-        html_source = browser.page_source
-        browser.quit()
-        return html_source
 
-    except TimeoutException:
-        print("\t\tRetrying page load after {}s timeout".format(PAGE_LOAD_TIMEOUT))
-        return render(query_url)
+def load_page(query_url):
+    # the host's concurrency slot only times the page load, not launching a
+    # browser or waiting for a free one
+    with BROWSERS.session() as browser:
+        with FETCHER.throttled(query_url), \
+                METRICS.time('page_load', 'buzzfeed', query_url):
+            browser.get(query_url)
+        return browser.page_source
 
 
-def gen_query_url(page_num=1):
+def gen_query_url(query, page_num=1):
     base_url = "https://www.buzzfeed.com/tag"
-    content = "{}?p={}".format(QUERY, page_num)
+    content = "{}?p={}".format(query, page_num)
     query_url = os.path.join(base_url, content)
     return query_url
 
 
 def search_buzzfeed(query_url):
-    result = render(query_url)
-    soup = BeautifulSoup(result)
-    return soup
+    with PROFILER.profile('collect'):
+        try:
+            result = render(query_url)
+        except Exception as exc:
+            # skipped rather than ending the run, and not mistaken for a
+            # page without results either
+            print('\t\tGiving up on search page {}: {!r}'
+                  .format(query_url, exc))
+            DEAD_LETTERS.add(query_url, 'search', exc)
+            return None
+        with METRICS.time('search_parse', 'buzzfeed', query_url):
+            tree = parse_html(result)
+    return tree
+
+
+def get_article_links(tree):
+    with PROFILER.profile('collect'):
+        with METRICS.time('link_extract', 'buzzfeed'):
+            base = "https://www.buzzfeed.com"
+            article_links = first_hrefs(RESULT_ITEMS(tree))
+            article_links = [base + link for link in article_links]
+        METRICS.incr('links', 'buzzfeed', n=len(article_links))
+    return article_links
 
 
-def get_article_links(soup):
-    base = "https://www.buzzfeed.com"
-    hits = soup.findAll("article")
-    article_links = [hit.findAll("a")[0].attrs['href'] for hit in hits]
-    article_links = [base + link for link in article_links]
-    return article_links
+def get_archive_listing(tree):
+    """The (title attribute, text, href) of every link on an archive page."""
+    hits = ARCHIVE_LISTS(tree)
+    if len(hits) == 0:
+        return []
+    return [(a.get('title', ''), a.text or '', a.get('href'))
+            for a in hits[0].iter('a') if a.get('href')]
 
 
-def get_archive_links(soup):
+def match_archive_links(listing, matcher):
+    """
+    Map each link of an archive listing whose title or text contains any of
+    the matcher's queries to the set of queries it matched, in page order.
+    """
     base = "https://www.buzzfeed.com"
-    hits = soup.findAll("ul", class_="flow")
-    link_data = [(a.attrs['title'], a.contents[0], a.attrs['href']) for a in
-                 hits[0].findAll("a")]
-
-    links = []
-    for lede, title, link in link_data:
-        if QUERY.replace("+", " ").lower() in lede.lower():
-            links.append(link)
-        elif QUERY.replace("+", " ").lower() in title.lower():
-            links.append(link)
-
-    archive_links = [base + link for link in links]
+    archive_links = collections.OrderedDict()
+    for lede, title, link in listing:
+        queries = matcher.find(lede, title)
+        if len(queries) > 0:
+            archive_links.setdefault(base + link, set()).update(queries)
     return archive_links
 
 
+def get_archive_links(tree):
+    return list(match_archive_links(get_archive_listing(tree),
+                                    QueryMatcher([QUERY])))
+
+
 def date_range(start_date, end_date):
     for n in range(int((end_date - start_date).days) + 1):
         yield start_date + datetime.timedelta(n)
@@ -122,132 +362,354 @@ def gen_archive_url(yy, mm, dd):
     return query_url
 
 
-def search_buzzfeed_archive():
+def has_archive_results(html_source):
+    return ARCHIVE_RE.search(html_source) is not None
+
+
+def archive_listing(date):
+    """
+    Return the listing of the archive page of `date`, whichever query it is
+    for. Past days never change, so their listings are kept for good in
+    --archive_dir, which is never evicted, and searching them again (for any
+    query) needs no network at all; the last couple of days, which may still
+    be filling up, are refreshed after --search_ttl like any search page.
+    """
+    archive_url = gen_archive_url(date.year, date.month, date.day)
+
+    # a day of margin for the time zone difference with Buzzfeed
+    if date < datetime.date.today() - datetime.timedelta(days=1):
+        listing_key, kind = archive_url + '#links', 'archive'
+    else:
+        listing_key, kind = archive_url + '#partial-links', 'search'
+
+    listing = ARCHIVE.get(listing_key, kind)
+    if listing is not None:
+        return json.loads(listing)
+
+    # archive pages are rendered server-side, so the browser is only a
+    # fallback
+    with PROFILER.profile('collect'):
+        try:
+            # only the listing is kept, not the page it came from
+            result = FETCHER.get_or_render(archive_url, has_archive_results,
+                                           load_archive_page, store=False)
+        except Exception as exc:
+            # not cached, so the day is searched again on --resume
+            print('\t\tGiving up on archive page {}: {!r}'
+                  .format(archive_url, exc))
+            DEAD_LETTERS.add(archive_url, 'search', exc)
+            return None
+        listing = get_archive_listing(parse_html(result))
+    ARCHIVE.put(listing_key, kind, json.dumps(listing))
+    return listing
+
+
+def load_archive_page(archive_url):
+    return FETCHER.retry.call(archive_url, load_page, archive_url)
+
+
+def archive_dates():
     from_month, from_day, from_year = [int(i) for i in FROM_LAST[0].split('/')]
     to_month, to_day, to_year = [int(i) for i in FROM_LAST[1].split('/')]
 
     start_date = datetime.date(from_year, from_month, from_day)
     end_date = datetime.date(to_year, to_month, to_day)
+    return start_date, end_date
 
-    dates = []
-    for date in date_range(start_date, end_date):
-        dates.append([int(i) for i in date.strftime("%Y-%m-%d").split('-')])
-
-    links = []
-    links_fp = './links/buzzfeed_links_{}_{}-{}.txt'\
-        .format(QUERY,
-                datetime.datetime.strftime(start_date, "%m%d%y"),
-                datetime.datetime.strftime(end_date, "%m%d%y"))
-
-    for year, month, day in dates:
-        archive_url = gen_archive_url(year, month, day)
-
-        time.sleep(SLEEP_TIME)
-        soup = search_buzzfeed(archive_url)
-        new_links = get_archive_links(soup)
-
-        print("\tFound {} article links for archive date {}"
-              .format(len(new_links), "{}/{}/{}".format(month, day, year)))
-        links += new_links
-
-        with open(links_fp, 'a') as handle:
-            handle.write('\n'.join(new_links) + "\n")
-    return set(links)
-
-
-def collect_links():
-    links = []
-    links_fp = './links/buzzfeed_links_{}.txt'.format(QUERY)
 
+def gen_links_fp(query):
+    if isinstance(FROM_LAST, list):
+        start_date, end_date = archive_dates()
+        return './links/buzzfeed_links_{}_{}-{}.txt'\
+            .format(query, datetime.datetime.strftime(start_date, "%m%d%y"),
+                    datetime.datetime.strftime(end_date, "%m%d%y"))
+    return './links/buzzfeed_links_{}.txt'.format(query)
+
+
+def add_archive_links(listing, matcher, date, emit=None):
+    """Match the queries in an archive listing and emit the links found."""
+    with PROFILER.profile('collect'), \
+            METRICS.time('link_extract', 'buzzfeed'):
+        matches = match_archive_links(listing, matcher)
+    new_links = list(matches)
+    METRICS.incr('links', 'buzzfeed', n=len(new_links))
+
+    print("\tFound {} article links for archive date {}"
+          .format(len(new_links),
+                  "{}/{}/{}".format(date.month, date.day, date.year)))
+    if emit is not None:
+        emit(new_links)
+
+    for query in QUERIES:
+        query_links = [link for link in new_links if query in matches[link]]
+        with open(gen_links_fp(query), 'a') as handle:
+            handle.write('\n'.join(query_links) + "\n")
+    return new_links, matches if len(QUERIES) > 1 else None
+
+
+def search_buzzfeed_archive(emit=None):
+    start_date, end_date = archive_dates()
+    dates = list(date_range(start_date, end_date))
+
+    # every query is matched in the same pass over each listing
+    matcher = QueryMatcher(QUERIES)
+
+    # on resume, next_page is the index of the first unfinished date. Up to
+    # --archive_workers days are fetched at once, but handled in order so
+    # that next_page stays meaningful
+    first = CHECKPOINT.state['next_page'] or 0
+    listings = prefetch(lambda idx: archive_listing(dates[idx]),
+                        range(first, len(dates)), window=ARCHIVE_WORKERS)
+
+    with contextlib.closing(listings):
+        for idx, listing in listings:
+            # a day given up on is searched again on --resume
+            if listing is None:
+                CHECKPOINT.page_failed(dates[idx].isoformat())
+                CHECKPOINT.add_links([], idx + 1, False)
+                continue
+            new_links, queries = add_archive_links(listing, matcher,
+                                                   dates[idx], emit)
+            CHECKPOINT.add_links(new_links, idx + 1, False, queries)
+
+
+def collect_links(emit=None):
     if not os.path.exists("./links"):
         os.makedirs("./links")
 
     # if user passes a date range, we have to search the buzzfeed
     # archives rather than running a search query
     if isinstance(FROM_LAST, list):
-        return search_buzzfeed_archive()
-
-    prev_page_empty = False
-    for idx in range(*PAGE_RANGE):
-        query_url = gen_query_url(idx)
-
-        time.sleep(SLEEP_TIME)
-        soup = search_buzzfeed(query_url)
-        new_links = get_article_links(soup)
-
-        print("\tFound {} article links on page {} of query results"
-              .format(len(new_links), idx))
-        links += new_links
-
-        # the most recent 2 pages are empty, we have run out of query pages!
-        if len(new_links) == 0:
-            if prev_page_empty:
-                return set(links)
+        search_buzzfeed_archive(emit)
+        return
+
+    # the search phase of each query in turn, into one link frontier
+    for query in QUERIES[CHECKPOINT.state['next_query']:]:
+        collect_tag_links(query, emit)
+        CHECKPOINT.finish_query()
+
+
+def collect_tag_links(query, emit=None):
+    links_fp = gen_links_fp(query)
+
+    prev_page_empty = CHECKPOINT.state['prev_page_empty']
+    first_page = CHECKPOINT.state['next_page'] or PAGE_RANGE[0]
+    pages = prefetch(lambda idx: search_buzzfeed(gen_query_url(query, idx)),
+                     range(first_page, PAGE_RANGE[1]), window=PREFETCH)
+
+    # leaving the loop cancels the pages still being prefetched
+    with contextlib.closing(pages):
+        for idx, tree in pages:
+            # a page given up on says nothing about whether the results have
+            # run out. It is searched again on --resume
+            if tree is None:
+                CHECKPOINT.page_failed(gen_query_url(query, idx), query)
+                CHECKPOINT.add_links([], idx + 1, prev_page_empty)
+                continue
+            new_links = get_article_links(tree)
+
+            print("\tFound {} article links on page {} of query results"
+                  .format(len(new_links), idx))
+            if emit is not None:
+                emit(new_links)
+
+            # the most recent 2 pages are empty, we have run out of query pages!
+            if len(new_links) == 0:
+                if prev_page_empty:
+                    return
+                else:
+                    prev_page_empty = True
             else:
-                prev_page_empty = True
-        else:
-            prev_page_empty = False
-            with open(links_fp, 'a') as handle:
+                prev_page_empty = False
+                with open(links_fp, 'a') as handle:
+                    handle.write('\n'.join(new_links) + "\n")
+            CHECKPOINT.add_links(new_links, idx + 1, prev_page_empty,
+                                 query_tags(query, new_links))
+
+
+def retry_failed_pages(emit=None):
+    """
+    Search the tag pages or archive days that the run being resumed gave up
+    on again. Those that fail again stay in the checkpoint for the next
+    --resume.
+    """
+    failed_pages = CHECKPOINT.failed_pages
+    if len(failed_pages) > 0:
+        print('\tSearching {} failed pages again'.format(len(failed_pages)))
+
+    matcher = QueryMatcher(QUERIES)
+    # tag pages are failed in order, so once two of a query come back empty
+    # its results have run out, and its later failed pages are past their end
+    empty_pages = {}
+    for page, query in failed_pages:
+        if isinstance(FROM_LAST, list):
+            date = datetime.datetime.strptime(page, '%Y-%m-%d').date()
+            listing = archive_listing(date)
+            if listing is None:
+                continue
+            new_links, queries = add_archive_links(listing, matcher, date,
+                                                   emit)
+            CHECKPOINT.page_retried(page, query, new_links, queries)
+            continue
+
+        if empty_pages.get(query, 0) >= 2:
+            CHECKPOINT.page_retried(page, query)
+            continue
+        tree = search_buzzfeed(page)
+        if tree is None:
+            continue
+        new_links = get_article_links(tree)
+        if len(new_links) == 0:
+            empty_pages[query] = empty_pages.get(query, 0) + 1
+
+        print("\tFound {} article links searching {} again"
+              .format(len(new_links), page))
+        if emit is not None:
+            emit(new_links)
+        if len(new_links) > 0:
+            with open(gen_links_fp(query), 'a') as handle:
                 handle.write('\n'.join(new_links) + "\n")
+        CHECKPOINT.page_retried(page, query, new_links,
+                                query_tags(query, new_links))
 
-    return set(links)
+
+def query_tags(query, links):
+    """The queries to record for `links` on a run of several queries."""
+    if len(QUERIES) == 1:
+        return None
+    return dict((link, [query]) for link in links)
 
 
 def construct_article(link):
+    with METRICS.time('download', 'buzzfeed', link):
+        page = FETCHER.fetch(link)
+
+    # an unchanged page has already been parsed on a previous run
+    article = CACHE.get_extraction(link, page.digest)
+    if article is not None:
+        METRICS.incr('extraction_cache_hits', 'buzzfeed', link)
+        return article
+
     article = {"url": link}
 
-    article_obj = Article(url=link, language='en')
-    article_obj.download()
-    article_obj.parse()
+    # parsed in a separate process when --parsers is set
+    with METRICS.time('parse', 'buzzfeed', link):
+        fields = PARSER.parse(link, page.text)
 
-    authors = article_obj.authors
-    article['text'] = article_obj.text
-    article['title'] = article_obj.title
+    authors = fields['authors']
+    article['text'] = fields['text']
+    article['title'] = fields['title']
     article['author'] = authors if len(authors) != 0 else None
     article['urlToImage'] = None
-    article['description'] = article_obj.summary
+    article['description'] = fields['summary']
 
     article['publishedAt'] = None
     article['before_election'] = None
 
-    if article_obj.publish_date:
-        date = tz.localize(article_obj.publish_date)
+    if fields['publish_date']:
+        date = tz.localize(fields['publish_date'])
         article['publishedAt'] = date.isoformat()
         article['before_election'] = True if date < ELECTION_DATE else False
-    return article
 
+    CACHE.put_extraction(link, page.digest, article)
+    return article
 
-def scrape_articles():
-    articles, links = [], []
 
-    print('\n####### Buzzfeed Scraper #######')
-    print('Running query:')
-    if not FROM_LAST:
-        print('Scraping recent pages with the tag "{}"\n'.format(QUERY))
-    else:
-        print('Scraping pages which contain "{}" from archives between '
-              '{} and {}\n'.format(QUERY, *args.date_range.split(' ')))
+def discover_links(emit):
+    # links found before an interrupted run stopped
+    emit(CHECKPOINT.links)
+    if CHECKPOINT.state['links_done']:
+        return
 
     if not LINKS_FROM_FILE:
-        links = collect_links()
+        retry_failed_pages(emit)
+        collect_links(emit)
     else:
-        with open(LINKS_FROM_FILE, 'r') as handle:
-            for line in handle:
-                links.append(line.strip())
+        # a dead letter file can be passed to retry its articles
+        links = read_links(LINKS_FROM_FILE)
+        CHECKPOINT.add_links(links, None, False)
+        emit(links)
 
-    links = [i.strip() for i in set(links) if i.strip() != '']
-    print('\nCollected {} links'.format(len(links)))
+    if len(CHECKPOINT.failed_pages) > 0:
+        print('\nCollected all links but those on {} failed search pages'
+              .format(len(CHECKPOINT.failed_pages)))
+        return
+    print('\nCollected all links')
+    CHECKPOINT.finish_links()
 
-    for idx, link in enumerate(links):
-        print('\t{}. Scraping {}'.format(idx + 1, link))
-        time.sleep(SLEEP_TIME)  # for throttling
-        article = construct_article(link)
-        articles.append(article)
 
-    data = {'articles': articles,
-            'source': 'buzzfeed',
+def scrape_link(idx, link):
+    print('\t{}. Scraping {}'.format(idx + 1, link))
+    try:
+        with PROFILER.profile('extract'):
+            article = construct_article(link)
+    except Exception as exc:
+        # set aside for a later --link_file run rather than ending this one
+        print('\t\tGiving up on {}: {!r}'.format(link, exc))
+        DEAD_LETTERS.add(link, 'article', exc)
+        return None, None
+    # signatures are computed here, on the worker threads, and only looked
+    # up in order in scrape_articles()
+    return article, DEDUP.signature(article['text'])
+
+
+def scrape_articles(writer):
+    print('\n####### Buzzfeed Scraper #######')
+    print('Running query:')
+    if not FROM_LAST:
+        print('Scraping recent pages with the tag "{}"\n'
+              .format('", "'.join(QUERIES)))
+    else:
+        print('Scraping pages which contain "{}" from archives between '
+              '{} and {}\n'.format('", "'.join(QUERIES), *FROM_LAST))
+
+    completed = CHECKPOINT.completed_urls()
+    if len(completed) > 0:
+        print('Skipping {} links scraped before the run was interrupted'
+              .format(len(completed)))
+
+    # articles are scraped while later search pages are still being
+    # rendered. Those scraped on earlier runs are left out unless --rescrape
+    known = INDEX.known if not RESCRAPE else None
+    seen = make_seen_set(SEEN_SET, SEEN_ERROR)
+    articles = pipeline(discover_links, scrape_link, workers=WORKERS,
+                        skip=completed, key=canonicalize_url, known=known,
+                        seen=seen)
+    for article, signature in articles:
+        if article is None:
+            continue
+
+        # the output, index and deduplication work of each article
+        with PROFILER.profile('accumulate'):
+            # wire stories run almost word for word on several sites
+            article['duplicate_of'] = DEDUP.check(article['url'], signature)
+            # archive links are matched against every query at once, so their
+            # queries are all known by the time they are scraped
+            if FROM_LAST and len(QUERIES) > 1:
+                article['queries'] = sorted(
+                    CHECKPOINT.link_queries.get(article['url'], ()))
+            if article['duplicate_of'] is not None:
+                METRICS.incr('duplicates', 'buzzfeed', article['url'])
+                if DROP_DUPLICATES:
+                    INDEX.add(article['url'], None, None)
+                    continue
+
+            offset = writer.offset
+            with METRICS.time('write', 'buzzfeed', article['url']):
+                writer.write(article)
+            METRICS.incr('articles', 'buzzfeed', article['url'])
+            # checkpointed first: a resumed run truncates the output back to
+            # the checkpoint, and must not find the article in the index
+            CHECKPOINT.article_done(writer.offset)
+            INDEX.add(article['url'], writer.fp, offset)
+
+    if SEEN_SET == 'bloom':
+        print(seen.report())
+        seen.close()
+
+    data = {'source': 'buzzfeed',
             'status': "ok",
-            'query': QUERY,
+            'query': QUERY if len(QUERIES) == 1 else QUERIES,
             'from_last': None,
             'pagerange': PAGE_RANGE}
     return data
@@ -268,19 +730,149 @@ def save_json(data, save_fp):
 
 def main():
     date = today()
-    data = scrape_articles()
-    n = len(data['articles'])
-
-    save_fp = "./scraped_json/{}_{}_{}.json".format('buzzfeed', date, n)
-    print('Saving scraped articles to {}'.format(save_fp))
-    save_json(data, save_fp)
+    offset = None
 
+    if RESUME and CHECKPOINT.load():
+        jsonl_fp = CHECKPOINT.state['jsonl_fp']
+        offset = CHECKPOINT.state['offset']
+        print('Resuming interrupted run from {}'.format(CHECKPOINT.dir))
+    else:
+        # every run gets a file of its own, even for the same source and day
+        jsonl_fp = new_output_fp('./scraped_json/{}_{}'
+                                 .format('buzzfeed', date))
+        CHECKPOINT.start(jsonl_fp)
+    print('Streaming scraped articles to {}'.format(jsonl_fp))
+
+    # the metrics of jobs run by scrape.py are exported by scrape.py
+    metrics_fp = METRICS_FILE if not SHARED else ''
+    with METRICS.exporting(metrics_fp, METRICS_INTERVAL):
+        try:
+            with JSONLWriter(jsonl_fp, offset=offset) as writer:
+                data = scrape_articles(writer)
+                writer.write_metadata(data)
+            if len(QUERIES) > 1:
+                query_fps = write_query_outputs(jsonl_fp, QUERIES,
+                                                CHECKPOINT.link_queries, INDEX,
+                                                data)
+                for query, query_fp in zip(QUERIES, query_fps):
+                    print('Saved the articles found by "{}" to {}'
+                          .format(query, query_fp))
+            # kept for --resume to search the failed pages again
+            n_failed = len(CHECKPOINT.failed_pages)
+            if n_failed > 0:
+                print('{} search pages failed, run again with --resume to '
+                      'search them again'.format(n_failed))
+            else:
+                CHECKPOINT.remove()
+        finally:
+            # shared pools are closed by scrape.py once every job is done
+            if not SHARED:
+                BROWSERS.close()
+                PARSER.close()
+                FETCHER.close()
+                INDEX.close()
+                DEDUP.close()
+                print(BROWSERS.report())
+                print(PARSER.report())
+                print(CONCURRENCY.report())
+                print(CACHE.report())
+                print(INDEX.report())
+                print(DEDUP.report())
+                print(FETCHER.report())
+                print(FETCHER.retry.report())
+                print(METRICS.report())
+            # the archive listings and profiles are per job, even when the
+            # pools are shared
+            ARCHIVE.close()
+            for profile_fp in PROFILER.dump():
+                print('Saved profile to {}'.format(profile_fp))
+            print(DEAD_LETTERS.report())
+        n = writer.count
+        print('Scraped {} articles'.format(n))
+
+        if ENVELOPE:
+            save_fp = '{}_{}.json'.format(os.path.splitext(jsonl_fp)[0], n)
+            print('Saving scraped articles to {}'.format(save_fp))
+            with METRICS.time('save_json', 'buzzfeed'):
+                save_json(jsonl_to_envelope(jsonl_fp), save_fp)
+
+
+def configure(argv=None, shared=None):
+    """
+    Parse `argv` (the command line by default) and set up the module state
+    of a run. `shared` maps the names of the rate limiter, concurrency
+    limiter, cache, fetcher, browser pool, parser pool, URL index and
+    near-duplicate index to objects owned by the caller (see scrape.py),
+    which are used instead of creating new ones and left open when the run
+    ends.
+    """
+    global tz, PAGE_RANGE, ELECTION_DATE, QUERY, QUERIES, SLEEP_TIME, \
+        PAGE_LOAD_TIMEOUT, LINKS_FROM_FILE, FROM_LAST, RATE, BURST, \
+        HOST_RATES, MAX_CONCURRENCY, WORKERS, PARSERS, PREFETCH, \
+        ARCHIVE_WORKERS, POOL_SIZE, PAGES_PER_BROWSER, CACHE_DIR, \
+        ARCHIVE_DIR, CACHE_SIZE, CACHE_TTLS, URL_INDEX, RESCRAPE, SEEN_SET, \
+        SEEN_ERROR, DEDUP_INDEX, DUP_THRESHOLD, DROP_DUPLICATES, \
+        METRICS_FILE, METRICS_INTERVAL, PROFILE, PROFILE_SAMPLE, PROFILE_DIR, \
+        RETRIES, BACKOFF, MAX_BACKOFF, BREAKER_THRESHOLD, BREAKER_COOLDOWN, \
+        DEAD_LETTER_DIR, RESUME, ENVELOPE, SHARED, LIMITER, CONCURRENCY, \
+        CACHE, FETCHER, BROWSERS, PARSER, INDEX, DEDUP, ARCHIVE, METRICS, \
+        PROFILER, DEAD_LETTERS, CHECKPOINT
 
-if __name__ == "__main__":
     tz = pytz.utc
     PAGE_RANGE = [1, 1000]
     ELECTION_DATE = datetime.datetime(2016, 11, 9, 11, tzinfo=tz)
-    QUERY, SLEEP_TIME, PAGE_LOAD_TIMEOUT, LINKS_FROM_FILE, \
-        FROM_LAST = parse_args(parser)
+    QUERY, QUERIES, SLEEP_TIME, PAGE_LOAD_TIMEOUT, LINKS_FROM_FILE, \
+        FROM_LAST, RATE, BURST, HOST_RATES, MAX_CONCURRENCY, WORKERS, \
+        PARSERS, PREFETCH, ARCHIVE_WORKERS, POOL_SIZE, PAGES_PER_BROWSER, \
+        CACHE_DIR, ARCHIVE_DIR, CACHE_SIZE, CACHE_TTLS, URL_INDEX, RESCRAPE, \
+        SEEN_SET, SEEN_ERROR, DEDUP_INDEX, DUP_THRESHOLD, DROP_DUPLICATES, \
+        METRICS_FILE, METRICS_INTERVAL, PROFILE, PROFILE_SAMPLE, PROFILE_DIR, \
+        RETRIES, BACKOFF, MAX_BACKOFF, BREAKER_THRESHOLD, BREAKER_COOLDOWN, \
+        DEAD_LETTER_DIR, RESUME, ENVELOPE = parse_args(parser, argv)
+
+    SHARED = shared is not None
+    if SHARED:
+        LIMITER = shared['LIMITER']
+        CONCURRENCY = shared['CONCURRENCY']
+        CACHE = shared['CACHE']
+        FETCHER = shared['FETCHER']
+        BROWSERS = shared['BROWSERS']
+        PARSER = shared['PARSER']
+        INDEX = shared['INDEX']
+        DEDUP = shared['DEDUP']
+        METRICS = shared['METRICS']
+    else:
+        METRICS = Metrics()
+        LIMITER = RateLimiter(RATE, BURST, HOST_RATES)
+        CONCURRENCY = AdaptiveConcurrency(maximum=MAX_CONCURRENCY,
+                                          overloaded=is_overloaded)
+        CACHE = HTTPCache(CACHE_DIR, max_bytes=CACHE_SIZE, ttls=CACHE_TTLS)
+        RETRY = RetryPolicy(RETRIES, BACKOFF, MAX_BACKOFF,
+                            retryable=is_retryable,
+                            breaker=CircuitBreaker(BREAKER_THRESHOLD,
+                                                   BREAKER_COOLDOWN))
+        FETCHER = Fetcher(LIMITER, CONCURRENCY, CACHE,
+                          timeout=PAGE_LOAD_TIMEOUT, retry=RETRY)
+        BROWSERS = BrowserPool(size=POOL_SIZE,
+                               page_load_timeout=PAGE_LOAD_TIMEOUT,
+                               max_pages=PAGES_PER_BROWSER,
+                               metrics=METRICS)
+        PARSER = ParserPool(PARSERS)
+        INDEX = URLIndex(URL_INDEX)
+        DEDUP = DuplicateIndex(DEDUP_INDEX, threshold=DUP_THRESHOLD)
+    # with the TTLs of the page cache, which scrape.py sets for all jobs
+    ARCHIVE = HTTPCache(ARCHIVE_DIR, max_bytes=None, ttls=CACHE.ttls)
+
+    # several jobs for a source may run in one process (see scrape.py)
+    PROFILER = Profiler(PROFILE, PROFILE_DIR,
+                        __name__ if SHARED else 'buzzfeed', PROFILE_SAMPLE)
+    DEAD_LETTERS = DeadLetters(os.path.join(
+        DEAD_LETTER_DIR, '{}_{}.tsv'.format('buzzfeed', today())))
+
+    CHECKPOINT = Checkpoint(
+        Checkpoint.run_key('buzzfeed', QUERIES, FROM_LAST, LINKS_FROM_FILE))
+
 
+if __name__ == "__main__":
+    configure()
     main()
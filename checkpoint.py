@@ -0,0 +1,184 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import collections
+
+
+class Checkpoint(object):
+    """
+    Durable progress for one scrape run, stored in `<root>/<key>/`:
+
+        state.json  -- the next search page to render (or the date windows
+                       searched so far), whether link collection has
+                       finished, the JSONL output path and the byte offset
+                       of the last completed article in it
+        links.txt   -- the link frontier collected so far
+        queries.txt -- on a run of several queries, the queries that found
+                       each link, one tab-separated `link query...` per line
+
+    `state.json` is replaced atomically after every search page and every
+    article, so a killed run can pick up exactly where it stopped. Search
+    pages that were given up on are kept in it too, and the checkpoint is
+    kept past the end of the run until they have been searched again. Completed
+    URLs are read back from the JSONL output up to the saved offset rather
+    than tracked separately, which keeps the two from ever disagreeing.
+    """
+    def __init__(self, key, root='./checkpoints'):
+        self.key = key
+        self.dir = os.path.join(root, key)
+        self.state_fp = os.path.join(self.dir, 'state.json')
+        self.links_fp = os.path.join(self.dir, 'links.txt')
+        self.queries_fp = os.path.join(self.dir, 'queries.txt')
+
+        self.state = {'jsonl_fp': None, 'offset': 0, 'next_query': 0,
+                      'next_page': None, 'prev_page_empty': False,
+                      'windows': {}, 'failed_pages': [],
+                      'links_done': False}
+        # link -> set of the queries that found it
+        self.link_queries = collections.OrderedDict()
+        # links are added (and date windows finished, on several threads)
+        # during discovery while articles are completed on the main thread
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def run_key(source, *params):
+        params = json.dumps(params, sort_keys=True)
+        return '{}_{}'.format(
+            source, hashlib.sha1(params.encode('utf-8')).hexdigest()[:16])
+
+    @property
+    def links(self):
+        if not os.path.exists(self.links_fp):
+            return []
+        with open(self.links_fp, 'r') as handle:
+            return [line.strip() for line in handle if line.strip() != '']
+
+    def load(self):
+        """Load a saved checkpoint. Returns False if there is none."""
+        if not os.path.exists(self.state_fp):
+            return False
+        with open(self.state_fp, 'r') as handle:
+            self.state.update(json.load(handle))
+
+        if os.path.exists(self.queries_fp):
+            with open(self.queries_fp, 'r') as handle:
+                for line in handle:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) > 1:
+                        self.link_queries.setdefault(fields[0], set())\
+                            .update(fields[1:])
+        return True
+
+    def start(self, jsonl_fp):
+        self.remove()
+        os.makedirs(self.dir)
+        self.state['jsonl_fp'] = jsonl_fp
+        self.save()
+
+    def save(self):
+        tmp_fp = self.state_fp + '.tmp'
+        # the state is only changed under the lock, so it is serialized in
+        # one piece
+        with self._lock:
+            with open(tmp_fp, 'w') as handle:
+                handle.write(json.dumps(self.state))
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(tmp_fp, self.state_fp)
+
+    def remove(self):
+        if os.path.exists(self.dir):
+            shutil.rmtree(self.dir)
+        self.link_queries.clear()
+
+    def add_links(self, links, next_page, prev_page_empty, queries=None):
+        """
+        Record the links found on a search page. `queries` optionally maps
+        each of them to the queries of the run that found it.
+        """
+        with self._lock:
+            self._append_links(links, queries)
+            self.state['next_page'] = next_page
+            self.state['prev_page_empty'] = prev_page_empty
+        self.save()
+
+    def _append_links(self, links, queries):
+        if len(links) > 0:
+            with open(self.links_fp, 'a') as handle:
+                handle.write('\n'.join(links) + '\n')
+        if queries:
+            with open(self.queries_fp, 'a') as handle:
+                for link, link_queries in queries.items():
+                    self.link_queries.setdefault(link, set())\
+                        .update(link_queries)
+                    handle.write('\t'.join([link] +
+                                           sorted(link_queries)) + '\n')
+
+    @property
+    def failed_pages(self):
+        """The (page, query) of the search pages given up on so far."""
+        with self._lock:
+            return [tuple(entry) for entry in self.state['failed_pages']]
+
+    def page_failed(self, page, query=None):
+        """
+        Record that a search page (or whatever a scraper searches in one go,
+        e.g., a date window) was given up on, so that --resume searches it
+        again. `page` has to survive a round trip through JSON.
+        """
+        with self._lock:
+            if [page, query] not in self.state['failed_pages']:
+                self.state['failed_pages'].append([page, query])
+        self.save()
+
+    def page_retried(self, page, query=None, links=(), queries=None):
+        """Record the links found by searching a failed page again."""
+        with self._lock:
+            self._append_links(list(links), queries)
+            if [page, query] in self.state['failed_pages']:
+                self.state['failed_pages'].remove([page, query])
+        self.save()
+
+    def finish_query(self):
+        """Move on to searching for the next query of the run."""
+        with self._lock:
+            self.state['next_query'] += 1
+            self.state['next_page'] = None
+            self.state['prev_page_empty'] = False
+            self.state['windows'] = {}
+        self.save()
+
+    def finish_window(self, window, status):
+        """Record that a date window was searched ('done') or 'split'."""
+        with self._lock:
+            self.state['windows'][window] = status
+        self.save()
+
+    def finish_links(self):
+        with self._lock:
+            self.state['links_done'] = True
+        self.save()
+
+    def article_done(self, offset):
+        with self._lock:
+            self.state['offset'] = offset
+        self.save()
+
+    def completed_urls(self):
+        completed = set()
+        jsonl_fp, offset = self.state['jsonl_fp'], self.state['offset']
+        if not jsonl_fp or not os.path.exists(jsonl_fp):
+            return completed
+
+        n_bytes = 0
+        with open(jsonl_fp, 'rb') as handle:
+            for line in handle:
+                n_bytes += len(line)
+                if n_bytes > offset:
+                    break
+                record = json.loads(line.decode('utf-8'))
+                if 'url' in record:
+                    completed.add(record['url'])
+        return completed
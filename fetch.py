@@ -0,0 +1,163 @@
+import hashlib
+import threading
+import contextlib
+from collections import namedtuple
+
+import requests
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from retry import RetryPolicy
+
+# a fetched page and the SHA-1 of its body
+Page = namedtuple('Page', ['text', 'digest'])
+
+USER_AGENT = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) "
+              "AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/54.0.2840.98 Safari/537.36")
+
+# number of hosts whose idle connections are kept open
+POOL_HOSTS = 32
+
+
+def is_overloaded(exc):
+    """
+    True if `exc` suggests the host is struggling (a timeout, a dropped
+    connection, or a 429/5xx response) rather than that the page is bad.
+    """
+    if isinstance(exc, (TimeoutException, requests.Timeout,
+                        requests.ConnectionError)):
+        return True
+
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+def is_retryable(exc):
+    """
+    True if a request that failed with `exc` is worth retrying: the host is
+    overloaded, or the browser crashed (the pool has already replaced it).
+    """
+    return is_overloaded(exc) or isinstance(exc, WebDriverException)
+
+
+class Fetcher(object):
+    """
+    The fetch layer shared by `render()` and `construct_article()`. Every
+    request is rate limited per host by `limiter` and has to hold one of the
+    host's `concurrency` slots while it is in flight. Pages found in `cache`
+    are returned without touching the network, and stale pages with an ETag
+    or Last-Modified validator are re-requested conditionally.
+
+    Search pages that are rendered server-side can be fetched with a plain
+    HTTP GET through `get_or_render()`, which only falls back to the browser
+    when the response lacks the expected results.
+
+    Failed requests are retried as `retry` (a `retry.RetryPolicy`) says;
+    scrapers use the same policy for the pages they load in a browser.
+    """
+    def __init__(self, limiter, concurrency, cache, timeout=30, retry=None):
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.cache = cache
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy(retries=0)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        # room for a connection per request a host may have in flight, so
+        # that none are dropped and reopened under load (requests keeps 10)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=POOL_HOSTS, pool_maxsize=concurrency.maximum)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.stats = {'http': 0, 'browser': 0}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def throttled(self, url):
+        self.limiter.wait(url)
+        with self.concurrency.slot(url):
+            yield
+
+    def get(self, url, kind='article'):
+        return self.fetch(url, kind).text
+
+    def get_or_render(self, url, accept, render, kind='search', store=True):
+        """
+        Fetch `url` with a plain HTTP GET and return the body if
+        `accept(body)` is true; otherwise load it with `render(url)`.
+        """
+        try:
+            page = self.fetch(url, kind, accept=accept, store=store)
+        except requests.RequestException:
+            page = None
+
+        path = 'http' if page is not None else 'browser'
+        with self._lock:
+            self.stats[path] += 1
+
+        return page.text if page is not None else render(url)
+
+    def fetch(self, url, kind='article', conditional=True, accept=None,
+              store=True):
+        """
+        Return the `Page` at `url`. If `accept` is given and `accept(body)` is
+        false, the body is not cached and None is returned instead. With
+        `store` false the body is never cached, for pages the caller keeps
+        in a form of its own.
+        """
+        page = self.cache.get_page(url, kind)
+        if page is not None:
+            page = Page(*page)
+            return page if accept is None or accept(page.text) else None
+
+        headers = {}
+        validators = self.cache.validators(url) if conditional else None
+        if validators is not None:
+            etag, last_modified = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        resp = self.retry.call(url, self._get, url, headers)
+
+        if resp.status_code == 304:
+            page = self.cache.revalidate(url)
+            if page is None:
+                # the cached body vanished since we sent the request
+                return self.fetch(url, kind, conditional=False, accept=accept,
+                                  store=store)
+            page = Page(*page)
+            return page if accept is None or accept(page.text) else None
+
+        if accept is not None and not accept(resp.text):
+            return None
+        if not store:
+            return Page(resp.text,
+                        hashlib.sha1(resp.text.encode('utf-8')).hexdigest())
+
+        digest = self.cache.put(url, kind, resp.text,
+                                etag=resp.headers.get('ETag'),
+                                last_modified=resp.headers.get('Last-Modified'))
+        return Page(resp.text, digest)
+
+    def _get(self, url, headers):
+        with self.throttled(url):
+            resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            if resp.status_code != 304:
+                resp.raise_for_status()
+        return resp
+
+    def close(self):
+        self.session.close()
+        self.cache.close()
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        return ('Search pages: {} via plain HTTP, {} via browser fallback'
+                .format(stats['http'], stats['browser']))
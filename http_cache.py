@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# how long (in seconds) a cached page of each kind stays fresh. Listings of
+# past archive days never change, so they never go stale
+DEFAULT_TTLS = {'search': 60 * 60, 'article': 30 * 24 * 60 * 60,
+                'archive': None}
+
+
+def normalize_url(url):
+    """
+    Normalize a URL for use as a cache key: lowercase the scheme and host,
+    drop default ports and sort the query parameters. The fragment is kept
+    since the NYT and WaPo search pages encode the query and page in it.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rpartition(':')[2]) in [('http', '80'), ('https', '443')]:
+        netloc = netloc.rpartition(':')[0]
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, parts.fragment))
+
+
+class HTTPCache(object):
+    """
+    An on-disk cache of fetched pages. Bodies are zlib-compressed and stored
+    under the SHA-1 of their contents, so identical pages reached through
+    different URLs are only stored once; a SQLite index maps each normalized
+    URL to its body, the kind of page it is ('search' or 'article') and when
+    it was fetched and last used.
+
+    Entries older than the TTL for their kind are treated as misses, but keep
+    their ETag / Last-Modified validators so the page can be re-requested
+    conditionally. The article dict extracted from a body can be stored next
+    to it, so an unchanged page never has to be parsed twice. Once the
+    compressed bodies take up more than `max_bytes`, the least recently used
+    entries are evicted. A `max_bytes` of None never evicts anything.
+    """
+    def __init__(self, root='./cache', max_bytes=1024 ** 3, ttls=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evicted': 0,
+                      'bytes_saved': 0, 'revalidated': 0, 'reused': 0}
+        self._lock = threading.Lock()
+
+        self.enabled = bool(root)
+        if not self.enabled:
+            return
+
+        if not os.path.exists(os.path.join(root, 'objects')):
+            os.makedirs(os.path.join(root, 'objects'))
+
+        self._db = sqlite3.connect(os.path.join(root, 'index.sqlite'),
+                                   check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, kind TEXT, digest TEXT, size INTEGER, '
+            'raw_size INTEGER, fetched_at REAL, last_access REAL, '
+            'etag TEXT, last_modified TEXT)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS extractions ('
+            'key TEXT PRIMARY KEY, digest TEXT, article TEXT)')
+
+        # caches created before validators were stored lack the last columns
+        columns = [row[1] for row in
+                   self._db.execute('PRAGMA table_info(entries)')]
+        for column in ['etag', 'last_modified']:
+            if column not in columns:
+                self._db.execute('ALTER TABLE entries ADD COLUMN {} TEXT'
+                                 .format(column))
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_lru '
+                         'ON entries (last_access)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_digest '
+                         'ON entries (digest)')
+        self._db.commit()
+
+        self._size = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size '
+            'FROM entries)').fetchone()[0]
+
+    def _blob_fp(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest + '.z')
+
+    def _read_blob(self, key, digest):
+        try:
+            with open(self._blob_fp(digest), 'rb') as handle:
+                return zlib.decompress(handle.read()).decode('utf-8')
+        except (IOError, zlib.error):
+            self._delete(key, digest)
+            return None
+
+    def get(self, url, kind):
+        page = self.get_page(url, kind)
+        return page[0] if page is not None else None
+
+    def get_page(self, url, kind):
+        """
+        Return the (body, digest) of a fresh cached page, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest, raw_size, fetched_at FROM entries '
+                'WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            digest, raw_size, fetched_at = row
+            ttl = self.ttls.get(kind, 0)
+            if ttl is not None and now - fetched_at > ttl:
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            body = self._read_blob(key, digest)
+            if body is None:
+                self.stats['misses'] += 1
+                return None
+
+            self._db.execute('UPDATE entries SET last_access = ? '
+                             'WHERE key = ?', (now, key))
+            self._db.commit()
+            self.stats['hits'] += 1
+            self.stats['bytes_saved'] += raw_size
+        return body, digest
+
+    def validators(self, url):
+        """
+        Return the (etag, last_modified) headers stored for a cached page,
+        fresh or not, or None if there are none to revalidate against.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest, etag, last_modified FROM entries '
+                'WHERE key = ?', (normalize_url(url),)).fetchone()
+
+        if row is None or not (row[1] or row[2]) or \
+                not os.path.exists(self._blob_fp(row[0])):
+            return None
+        return row[1], row[2]
+
+    def revalidate(self, url):
+        """
+        Mark a cached page as fresh again after the server answered a
+        conditional request with 304 Not Modified, and return its
+        (body, digest).
+        """
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest, raw_size FROM entries WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+
+            body = self._read_blob(key, row[0])
+            if body is None:
+                return None
+
+            self._db.execute('UPDATE entries SET fetched_at = ?, '
+                             'last_access = ? WHERE key = ?', (now, now, key))
+            self._db.commit()
+            self.stats['revalidated'] += 1
+            self.stats['bytes_saved'] += row[1]
+        return body, row[0]
+
+    def get_extraction(self, url, digest):
+        """
+        Return the article previously extracted from this exact version
+        (`digest`) of the page at `url`, or None.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT article FROM extractions WHERE key = ? AND digest = ?',
+                (normalize_url(url), digest)).fetchone()
+            if row is None:
+                return None
+            self.stats['reused'] += 1
+        return json.loads(row[0])
+
+    def put_extraction(self, url, digest, article):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO extractions VALUES (?, ?, ?)',
+                (normalize_url(url), digest, json.dumps(article)))
+            self._db.commit()
+
+    def put(self, url, kind, body, etag=None, last_modified=None):
+        """Store a page and return the digest of its body."""
+        raw = body.encode('utf-8')
+        digest = hashlib.sha1(raw).hexdigest()
+        if not self.enabled:
+            return digest
+
+        blob_fp = self._blob_fp(digest)
+        key = normalize_url(url)
+        now = time.time()
+
+        with self._lock:
+            size = self._blob_size(digest)
+            if size is None:
+                data = zlib.compress(raw)
+                if not os.path.exists(os.path.dirname(blob_fp)):
+                    os.makedirs(os.path.dirname(blob_fp))
+                with open(blob_fp + '.tmp', 'wb') as handle:
+                    handle.write(data)
+                os.replace(blob_fp + '.tmp', blob_fp)
+                size = len(data)
+                self._size += size
+
+            old = self._db.execute('SELECT digest FROM entries WHERE key = ?',
+                                   (key,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries (key, kind, digest, size, '
+                'raw_size, fetched_at, last_access, etag, last_modified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, kind, digest, size, len(raw), now, now,
+                 etag, last_modified))
+            if old is not None and old[0] != digest:
+                self._release_blob(old[0])
+
+            self._evict()
+            self._db.commit()
+        return digest
+
+    def _blob_size(self, digest):
+        row = self._db.execute('SELECT size FROM entries WHERE digest = ? '
+                               'LIMIT 1', (digest,)).fetchone()
+        if row is None or not os.path.exists(self._blob_fp(digest)):
+            return None
+        return row[0]
+
+    def _release_blob(self, digest):
+        """Delete a body once no entry refers to it anymore."""
+        in_use = self._db.execute('SELECT 1 FROM entries WHERE digest = ? '
+                                  'LIMIT 1', (digest,)).fetchone()
+        if in_use is None and os.path.exists(self._blob_fp(digest)):
+            self._size -= os.path.getsize(self._blob_fp(digest))
+            os.remove(self._blob_fp(digest))
+
+    def _delete(self, key, digest):
+        self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self._db.execute('DELETE FROM extractions WHERE key = ?', (key,))
+        self._release_blob(digest)
+        self._db.commit()
+
+    def _evict(self):
+        while self.max_bytes is not None and self._size > self.max_bytes:
+            rows = self._db.execute('SELECT key, digest FROM entries '
+                                    'ORDER BY last_access LIMIT 100').fetchall()
+            if len(rows) == 0:
+                break
+            for key, digest in rows:
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._db.execute('DELETE FROM extractions WHERE key = ?',
+                                 (key,))
+                self._release_blob(digest)
+                self.stats['evicted'] += 1
+                if self._size <= self.max_bytes:
+                    break
+
+    def close(self):
+        if self.enabled:
+            self._db.close()
+
+    def report(self):
+        if not self.enabled:
+            return 'HTTP cache: disabled'
+        with self._lock:
+            stats = dict(self.stats)
+        n_lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / float(n_lookups) if n_lookups else 0.
+        return ('HTTP cache: {} hits / {} misses ({:.1%} hit rate, {} stale), '
+                '{} not modified, {} extractions reused, {:.1f} MB saved, '
+                '{} evicted, {:.1f} MB on disk'
+                .format(stats['hits'], stats['misses'], hit_rate,
+                        stats['stale'], stats['revalidated'], stats['reused'],
+                        stats['bytes_saved'] / 1024. ** 2, stats['evicted'],
+                        self._size / 1024. ** 2))
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+
+from throttle import get_host
+
+# upper bounds (in seconds) of the buckets of the stage timing histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.,
+           30., 60.)
+
+
+class _Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and seen > 0:
+                return min(bound, self.max)
+        return 0.
+
+
+class Metrics(object):
+    """
+    Timing histograms and error counts for every stage of a scrape (page
+    load, link extraction, article download and parsing, output...) and
+    event counters, each broken down by source and host, so a slow run
+    shows where its time goes. Thread-safe; a single instance may be shared
+    by several scrapers (see scrape.py).
+    """
+    def __init__(self):
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, source, seconds, url=None, error=False):
+        """Record a run of `stage` that took `seconds`."""
+        labels = (stage, source, get_host(url) if url else '')
+        with self._lock:
+            hist = self._stages.setdefault(labels, _Histogram())
+            hist.observe(seconds)
+            if error:
+                hist.errors += 1
+
+    @contextlib.contextmanager
+    def time(self, stage, source, url=None):
+        """Time the body of the `with` block as one run of `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(stage, source, time.perf_counter() - start, url,
+                         error=True)
+            raise
+        self.observe(stage, source, time.perf_counter() - start, url)
+
+    def incr(self, event, source, url=None, n=1):
+        labels = (event, source, get_host(url) if url else '')
+        with self._lock:
+            self._counters[labels] = self._counters.get(labels, 0) + n
+
+    def snapshot(self):
+        """The current values, as a dict that serializes to JSON."""
+        with self._lock:
+            stages = [
+                {'stage': stage, 'source': source, 'host': host,
+                 'count': hist.count, 'errors': hist.errors,
+                 'sum': hist.sum, 'max': hist.max,
+                 'mean': hist.sum / hist.count if hist.count else 0.,
+                 'p50': hist.quantile(0.5), 'p99': hist.quantile(0.99),
+                 'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'],
+                                     hist.counts))}
+                for (stage, source, host), hist in sorted(self._stages.items())]
+            counters = [{'event': event, 'source': source, 'host': host,
+                         'count': count}
+                        for (event, source, host), count
+                        in sorted(self._counters.items())]
+        return {'updated': time.time(), 'stages': stages,
+                'counters': counters}
+
+    def to_prometheus(self):
+        """The current values in the Prometheus text exposition format."""
+        def labels(**kwargs):
+            return '{' + ','.join('{}="{}"'.format(k, v)
+                                  for k, v in kwargs.items()) + '}'
+
+        lines = ['# HELP scraper_stage_seconds Time spent in each stage',
+                 '# TYPE scraper_stage_seconds histogram']
+        with self._lock:
+            stages = sorted(self._stages.items())
+            counters = sorted(self._counters.items())
+        for (stage, source, host), hist in stages:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), hist.counts):
+                cumulative += count
+                lines.append('scraper_stage_seconds_bucket{} {}'.format(
+                    labels(stage=stage, source=source, host=host,
+                           le=bound), cumulative))
+            lines.append('scraper_stage_seconds_sum{} {}'.format(
+                labels(stage=stage, source=source, host=host), hist.sum))
+            lines.append('scraper_stage_seconds_count{} {}'.format(
+                labels(stage=stage, source=source, host=host), hist.count))
+
+        lines += ['# HELP scraper_stage_errors_total Stage runs that raised',
+                  '# TYPE scraper_stage_errors_total counter']
+        for (stage, source, host), hist in stages:
+            lines.append('scraper_stage_errors_total{} {}'.format(
+                labels(stage=stage, source=source, host=host), hist.errors))
+
+        lines += ['# HELP scraper_events_total Events counted during a run',
+                  '# TYPE scraper_events_total counter']
+        for (event, source, host), count in counters:
+            lines.append('scraper_events_total{} {}'.format(
+                labels(event=event, source=source, host=host), count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, fp):
+        """
+        Atomically replace `fp` with the current values, in the Prometheus
+        text format if it ends in .prom and as JSON otherwise.
+        """
+        if fp.endswith('.prom'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+        dirname = os.path.dirname(fp)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_fp = '{}.{}.tmp'.format(fp, threading.get_ident())
+        with open(tmp_fp, 'w') as handle:
+            handle.write(text)
+        os.replace(tmp_fp, fp)
+
+    @contextlib.contextmanager
+    def exporting(self, fp, interval=10.):
+        """
+        Rewrite `fp` every `interval` seconds while the `with` block runs,
+        and once more at the end. Does nothing if `fp` is empty.
+        """
+        if not fp:
+            yield
+            return
+
+        stopped = threading.Event()
+
+        def export():
+            while not stopped.wait(interval):
+                self.write(fp)
+
+        thread = threading.Thread(target=export)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+            self.write(fp)
+
+    def report(self):
+        totals = {}
+        with self._lock:
+            for (stage, _, _), hist in self._stages.items():
+                total = totals.setdefault(stage, [0, 0., 0])
+                total[0] += hist.count
+                total[1] += hist.sum
+                total[2] += hist.errors
+        return 'Stage timings: ' + ', '.join(
+            '{} {} x {:.3f}s ({:.1f}s total, {} errors)'
+            .format(stage, count, total / count if count else 0., total,
+                    errors)
+            for stage, (count, total, errors) in sorted(totals.items()))
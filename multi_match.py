@@ -0,0 +1,58 @@
+import collections
+
+
+class QueryMatcher(object):
+    """
+    Finds which of many queries occur as substrings of a text in one pass
+    over it, with an Aho-Corasick automaton, instead of one `in` test (and
+    one pass) per query. Matching is case-insensitive, and the '+' that
+    separate the words of a query (as in the search URLs) match spaces.
+    """
+    def __init__(self, queries):
+        self.queries = list(queries)
+
+        # trie of the normalized queries; outputs[node] holds the indices
+        # of the queries that end at node
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [set()]
+        for idx, query in enumerate(self.queries):
+            node = 0
+            for char in self.normalize(query):
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append(set())
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._outputs[node].add(idx)
+
+        # breadth-first, point each node at the longest proper suffix of its
+        # path that is also in the trie, and inherit that node's outputs
+        nodes = collections.deque(self._goto[0].values())
+        while len(nodes) > 0:
+            node = nodes.popleft()
+            for char, child in self._goto[node].items():
+                nodes.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._outputs[child] |= self._outputs[self._fail[child]]
+
+    @staticmethod
+    def normalize(text):
+        return text.replace('+', ' ').lower()
+
+    def find(self, *texts):
+        """Return the set of queries found in any of `texts`."""
+        found = set()
+        for text in texts:
+            node = 0
+            for char in text.lower():
+                while node and char not in self._goto[node]:
+                    node = self._fail[node]
+                node = self._goto[node].get(char, 0)
+                if self._outputs[node]:
+                    found |= self._outputs[node]
+        return set(self.queries[idx] for idx in found)
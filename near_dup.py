@@ -0,0 +1,207 @@
+import os
+import re
+import random
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+from url_index import url_key
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+MAX_HASH = (1 << 32) - 1
+EMPTY = MAX_HASH + 1
+# spreads the values an empty bin borrows from its neighbours (see
+# MinHasher.signature)
+GOLDEN = 0x9E3779B1
+
+# bumped whenever signatures stop being comparable with earlier ones
+SIGNATURE_VERSION = 2
+
+
+class MinHasher(object):
+    """
+    Computes `n_perms`-value MinHash signatures of the set of word
+    `shingle_size`-grams of a text. The fraction of positions at which two
+    signatures agree estimates the Jaccard similarity of the two texts.
+
+    Signatures are one-permutation MinHashes: every shingle is hashed once,
+    into one of `n_perms` bins, and each bin keeps its smallest hash. That is
+    one hash per shingle rather than `n_perms`, so a signature costs a few
+    milliseconds of pure Python instead of a hundred.
+    """
+    def __init__(self, n_perms=128, shingle_size=5, seed=1):
+        self.n_perms = n_perms
+        self.shingle_size = shingle_size
+        self.key = random.Random(seed).getrandbits(128).to_bytes(16, 'little')
+
+    def shingles(self, text):
+        words = WORD_RE.findall(text.lower())
+        k = min(self.shingle_size, len(words))
+        return set(' '.join(words[i:i + k])
+                   for i in range(len(words) - k + 1)) if k > 0 else set()
+
+    def signature(self, text):
+        """Return the signature of `text`, or None if it has no words."""
+        n, key = self.n_perms, self.key
+        bins = [EMPTY] * n
+        for shingle in self.shingles(text):
+            h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'),
+                                               digest_size=8,
+                                               key=key).digest(), 'little')
+            value, idx = divmod(h, n)
+            value &= MAX_HASH
+            if value < bins[idx]:
+                bins[idx] = value
+        if min(bins) == EMPTY:
+            return None
+
+        # short texts leave bins empty. Each borrows the value of the next
+        # non-empty bin, offset by the distance, so two texts still agree
+        # on it about as often as on a full bin
+        signature = array('I', bytes(4 * n))
+        for idx in range(n):
+            src, dist = idx, 0
+            while bins[src] == EMPTY:
+                src, dist = (src + 1) % n, dist + 1
+            signature[idx] = (bins[src] + dist * GOLDEN) & MAX_HASH
+        return signature
+
+
+def similarity(sig1, sig2):
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / float(len(sig1))
+
+
+class DuplicateIndex(object):
+    """
+    A persistent locality-sensitive hashing index of the MinHash signatures
+    of every article stored so far, used to spot the same story (typically
+    a wire story) published almost word for word under different URLs.
+
+    Each signature is cut into `bands` bands whose hashes go in an indexed
+    table, so `check()` only compares an article with those sharing at least
+    one band with it -- a few rows, however large the corpus -- rather than
+    with every article. With 128 permutations in 16 bands of 8, articles
+    with a Jaccard similarity above ~0.7 are almost always candidates; a
+    candidate counts as a duplicate if its estimated similarity is at least
+    `threshold`.
+    """
+    def __init__(self, fp='./near_dups.sqlite', threshold=0.8, n_perms=128,
+                 bands=16):
+        self.fp = fp
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = n_perms // bands
+        self.hasher = MinHasher(n_perms)
+        self.stats = {'checked': 0, 'duplicates': 0}
+        self._lock = threading.Lock()
+
+        self.enabled = bool(fp)
+        if not self.enabled:
+            return
+
+        dirname = os.path.dirname(fp)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self._db = sqlite3.connect(fp, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS signatures ('
+            'key BLOB PRIMARY KEY, url TEXT, signature BLOB) WITHOUT ROWID')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS bands (band INTEGER, hash INTEGER, '
+            'key BLOB, PRIMARY KEY (band, hash, key)) WITHOUT ROWID')
+        # signatures of an older version can never match new ones
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SIGNATURE_VERSION:
+            self._db.execute('DELETE FROM signatures')
+            self._db.execute('DELETE FROM bands')
+            self._db.execute('PRAGMA user_version = {}'
+                             .format(SIGNATURE_VERSION))
+        self._db.commit()
+
+    def signature(self, text):
+        """
+        Return the signature of an article's text. This is the expensive part
+        of a check (a few milliseconds for a long article) and is
+        thread-safe, so it can run on the worker threads.
+        """
+        if not self.enabled or not text:
+            return None
+        return self.hasher.signature(text)
+
+    def _band_hashes(self, signature):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(chunk.tobytes(), digest_size=8).digest()
+            yield band, int.from_bytes(digest, 'little', signed=True)
+
+    def check(self, url, signature):
+        """
+        Return the URL of a stored article that `signature` is a near
+        duplicate of, or None. Articles that are not duplicates are stored,
+        so later copies point at the first one seen.
+        """
+        if not self.enabled or signature is None:
+            return None
+
+        key = url_key(url)
+        band_hashes = list(self._band_hashes(signature))
+        with self._lock:
+            self.stats['checked'] += 1
+            candidates = set()
+            for band, band_hash in band_hashes:
+                candidates.update(row[0] for row in self._db.execute(
+                    'SELECT key FROM bands WHERE band = ? AND hash = ?',
+                    (band, band_hash)))
+            candidates.discard(key)
+
+            best, best_sim = None, self.threshold
+            for candidate in candidates:
+                row = self._db.execute(
+                    'SELECT url, signature FROM signatures WHERE key = ?',
+                    (candidate,)).fetchone()
+                if row is None:
+                    continue
+                sim = similarity(signature, array('I', row[1]))
+                if sim >= best_sim:
+                    best, best_sim = row[0], sim
+
+            if best is not None:
+                self.stats['duplicates'] += 1
+                return best
+
+            # a page scraped again replaces its old signature
+            old = self._db.execute(
+                'SELECT signature FROM signatures WHERE key = ?',
+                (key,)).fetchone()
+            if old is not None:
+                self._db.executemany(
+                    'DELETE FROM bands WHERE band = ? AND hash = ? '
+                    'AND key = ?',
+                    [(band, band_hash, key) for band, band_hash
+                     in self._band_hashes(array('I', old[0]))])
+            self._db.execute('INSERT OR REPLACE INTO signatures '
+                             'VALUES (?, ?, ?)',
+                             (key, url, signature.tobytes()))
+            self._db.executemany(
+                'INSERT OR IGNORE INTO bands VALUES (?, ?, ?)',
+                [(band, band_hash, key) for band, band_hash in band_hashes])
+            self._db.commit()
+        return None
+
+    def close(self):
+        if self.enabled:
+            self._db.close()
+
+    def report(self):
+        if not self.enabled:
+            return 'Near-duplicate index: disabled'
+        with self._lock:
+            stats = dict(self.stats)
+        return ('Near-duplicate index: {} of {} articles were near '
+                'duplicates of earlier ones'
+                .format(stats['duplicates'], stats['checked']))
@@ -1,24 +1,45 @@
 import os
 import json
 import datetime
-import time
 import argparse
+import contextlib
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import pytz
-from bs4 import BeautifulSoup
-from newspaper import Article
 
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
+from browser_pool import BrowserPool
+from checkpoint import Checkpoint
+from fetch import Fetcher, is_overloaded, is_retryable
+from http_cache import HTTPCache
+from metrics import Metrics
+from near_dup import DuplicateIndex
+from output import JSONLWriter, new_output_fp, jsonl_to_envelope, \
+    write_query_outputs
+from parse_pool import ParserPool
+from parsing import parse_html, css
+from pipeline import pipeline, prefetch
+from profiling import Profiler
+from retry import RetryPolicy, CircuitBreaker, DeadLetters, read_links
+from seen_set import make_seen_set
+from throttle import RateLimiter, AdaptiveConcurrency, parse_host_rates
+from url_index import URLIndex, canonicalize_url
+
+
+RESULT_LINKS = css('ol.searchResultsList.flush a')
 
 
 parser = argparse.ArgumentParser(
     description='A web scraper for New York Times articles.')
 
-requiredNamed = parser.add_argument_group('required arguments')
-requiredNamed.add_argument('-q', '--query', type=str, required=True,
-                           help="Query string")
-
+parser.add_argument('-q', '--query', type=str, default="",
+                    help="Query string. Required unless --query_file is "
+                         "given")
+parser.add_argument('--query_file', type=str, default="",
+                    help="Path to a newline-delimited file of queries to run "
+                         "in one batch, along with or instead of -q. Articles "
+                         "found by several queries are scraped once, and a "
+                         "JSONL file per query references those it found")
 parser.add_argument('-l', '--link_file', type=str, default="",
                     help="Path to a newline-delimited file of article links "
                          "to scrape")
@@ -33,11 +54,148 @@ parser.add_argument('-t', '--doc_type', type=str, default="article",
                          "'Multimedia', 'Blog', 'Interactive', 'Video' or "
                          "'allresults'")
 
+parser.add_argument('--resume', action='store_true',
+                    help="Continue the last interrupted run with the same "
+                         "arguments from its checkpoint instead of starting over")
+parser.add_argument('--envelope', action='store_true',
+                    help="In addition to the streamed JSONL file, save the "
+                         "articles in a single JSON document once the run "
+                         "finishes")
+
 parser.add_argument('--sleep_time', type=int, default=5,
-                    help="Time (in seconds) to wait between queries")
+                    help="Time (in seconds) to wait between queries to the "
+                         "same host. Ignored if --rate is given")
+parser.add_argument('--rate', type=float, default=None,
+                    help="Maximum number of requests per second to any single "
+                         "host. Defaults to 1 / sleep_time (no limit if "
+                         "sleep_time is 0)")
+parser.add_argument('--burst', type=int, default=1,
+                    help="Number of requests to a host that may be sent "
+                         "back-to-back before --rate applies")
+parser.add_argument('--host_rates', type=str, default="",
+                    help="A space separated string of per-host overrides of "
+                         "the form 'host=rate[:burst]', e.g. "
+                         "'query.nytimes.com=0.2 www.nytimes.com=2:5'")
+parser.add_argument('--max_concurrency', type=int, default=8,
+                    help="Upper bound on the number of requests in flight to a "
+                         "single host. The actual limit adapts to each host's "
+                         "latency and error rate")
+parser.add_argument('--cache_dir', type=str, default="./cache",
+                    help="Directory of the on-disk page cache. Pass an empty "
+                         "string to disable caching")
+parser.add_argument('--cache_size', type=int, default=1024,
+                    help="Disk budget (in MB) of the page cache. The least "
+                         "recently used pages are evicted beyond it")
+parser.add_argument('--search_ttl', type=int, default=60 * 60,
+                    help="Time (in seconds) a cached search page stays fresh")
+parser.add_argument('--article_ttl', type=int, default=30 * 24 * 60 * 60,
+                    help="Time (in seconds) a cached article page stays fresh")
+parser.add_argument('--url_index', type=str, default="./url_index.sqlite",
+                    help="Path of the index of articles scraped on earlier "
+                         "runs, which are skipped. Pass an empty string to "
+                         "disable it")
+parser.add_argument('--rescrape', action='store_true',
+                    help="Scrape articles again even if the URL index says "
+                         "they were scraped on an earlier run")
+parser.add_argument('--seen_set', type=str, default="set",
+                    choices=['set', 'bloom'],
+                    help="How to remember the links already queued. 'bloom' "
+                         "keeps a Bloom filter in memory and confirms its hits "
+                         "against a temporary on-disk set, so memory stays "
+                         "small on very large link frontiers")
+parser.add_argument('--seen_error', type=float, default=0.001,
+                    help="False-positive rate of the 'bloom' seen set. Each "
+                         "false positive costs one lookup on disk")
+parser.add_argument('--dedup_index', type=str, default="./near_dups.sqlite",
+                    help="Path of the index of article text signatures used "
+                         "to find near duplicates (e.g. the same wire story "
+                         "on several sites). Pass an empty string to disable "
+                         "it")
+parser.add_argument('--dup_threshold', type=float, default=0.8,
+                    help="Estimated Jaccard similarity of the word 5-grams of "
+                         "two articles above which they count as duplicates")
+parser.add_argument('--drop_duplicates', action='store_true',
+                    help="Leave near duplicates of earlier articles out of "
+                         "the output instead of saving them with a "
+                         "'duplicate_of' pointer")
+parser.add_argument('--metrics_file', type=str, default="",
+                    help="Path of a file kept up to date during the run with "
+                         "timings of each stage (page loads, link extraction, "
+                         "downloads, parsing, output) and event counts, by "
+                         "host. Written in the Prometheus text format if it "
+                         "ends in .prom and as JSON otherwise")
+parser.add_argument('--metrics_interval', type=float, default=10.,
+                    help="Time (in seconds) between updates of "
+                         "--metrics_file")
+parser.add_argument('--profile', type=str, default=None,
+                    choices=['cpu', 'mem'],
+                    help="Profile a sample of the search pages (link "
+                         "collection), of the articles (extraction) and of "
+                         "their output, each phase separately. 'cpu' dumps "
+                         "cProfile stats, 'mem' traces allocations with "
+                         "tracemalloc and reports the top allocation sites. "
+                         "Pages parsed by --parsers processes are not "
+                         "profiled")
+parser.add_argument('--profile_sample', type=float, default=0.05,
+                    help="Fraction of search pages and articles profiled "
+                         "with --profile. Only one is profiled at a time. "
+                         "Tracing allocations slows the whole process down "
+                         "while it runs, so keep this small with 'mem'")
+parser.add_argument('--profile_dir', type=str, default="./profiles",
+                    help="Directory the --profile output is written to")
 parser.add_argument('--page_timeout', type=int, default=30,
                     help="Time (in seconds) after which we stop trying to load "
                          "a page and retry")
+parser.add_argument('--retries', type=int, default=3,
+                    help="Number of times a page that timed out or was "
+                         "refused as overloaded is retried before it is "
+                         "given up on")
+parser.add_argument('--backoff', type=float, default=1.,
+                    help="Base delay (in seconds) between retries. The n-th "
+                         "retry waits a random time of up to backoff * 2^n "
+                         "seconds")
+parser.add_argument('--max_backoff', type=float, default=60.,
+                    help="Upper bound (in seconds) on the delay between "
+                         "retries")
+parser.add_argument('--breaker_threshold', type=int, default=5,
+                    help="Number of failed requests in a row after which "
+                         "requests to a host are paused. 0 never pauses")
+parser.add_argument('--breaker_cooldown', type=float, default=60.,
+                    help="Time (in seconds) requests to a failing host are "
+                         "paused for. Doubles while the host keeps failing")
+parser.add_argument('--dead_letter_dir', type=str, default="./dead_letters",
+                    help="Directory of the files listing the pages given up "
+                         "on, which can be passed to --link_file to retry "
+                         "their articles")
+parser.add_argument('--workers', type=int, default=1,
+                    help="Number of articles to download in parallel. "
+                         "Requests to the same host are still rate limited")
+parser.add_argument('--parsers', type=int, default=0,
+                    help="Number of processes that parse downloaded articles. "
+                         "Parsing is CPU-bound, so use up to one per core. "
+                         "0 parses in the download threads")
+parser.add_argument('--prefetch', type=int, default=1,
+                    help="Number of search result pages to render at once. "
+                         "Pages past the last result are cancelled. Needs as "
+                         "many --browsers to be effective")
+parser.add_argument('--window_days', type=int, default=0,
+                    help="Split --date_range into windows of this many days "
+                         "and search them concurrently instead of paging "
+                         "through the whole range. 0 searches the range as "
+                         "a whole")
+parser.add_argument('--window_pages', type=int, default=100,
+                    help="Number of result pages of a date window after which "
+                         "it is split in half and its halves are searched "
+                         "instead")
+parser.add_argument('--window_workers', type=int, default=4,
+                    help="Number of date windows searched at once. Needs as "
+                         "many --browsers to be effective")
+parser.add_argument('--browsers', type=int, default=1,
+                    help="Maximum number of headless browser sessions to keep "
+                         "open at once")
+parser.add_argument('--pages_per_browser', type=int, default=100,
+                    help="Number of pages a browser session renders before it "
+                         "is restarted")
 parser.add_argument('--sort_by', type=str, default="newest",
                     help="Metric for ordering search results. Valid arguments are "
                          "'newest', 'oldest', or 'relevance'")
@@ -47,20 +205,73 @@ parser.add_argument('--section', type=str, default="all",
                          "'Arts', 'Briefing', or 'Business Day'")
 
 
-def parse_args(parser):
-    args = parser.parse_args()
-    QUERY = args.query
-    QUERY = QUERY.replace(' ', '+')
+def date_window(start_date, end_date):
+    """The from_last segment of a search URL for a range of dates."""
+    return "from{:%Y%m%d}to{:%Y%m%d}".format(start_date, end_date)
+
 
+def parse_args(parser, argv=None):
+    args = parser.parse_args(argv)
+    QUERIES = []
+    if len(args.query) > 0:
+        QUERIES.append(args.query.replace(' ', '+'))
+    if len(args.query_file) > 0:
+        with open(args.query_file, 'r') as handle:
+            for line in handle:
+                query = line.strip().replace(' ', '+')
+                if len(query) > 0 and query not in QUERIES:
+                    QUERIES.append(query)
+    if len(QUERIES) == 0:
+        parser.error('one of -q/--query or --query_file is required')
+    QUERY = QUERIES[0]
+
+    RESUME = args.resume
+    ENVELOPE = args.envelope
     SLEEP_TIME = args.sleep_time
+    RATE = args.rate
+    if RATE is None and SLEEP_TIME > 0:
+        RATE = 1. / SLEEP_TIME
+    BURST = args.burst
+    HOST_RATES = parse_host_rates(args.host_rates)
     PAGE_LOAD_TIMEOUT = args.page_timeout
+    CACHE_DIR = args.cache_dir
+    CACHE_SIZE = args.cache_size * 1024 ** 2
+    CACHE_TTLS = {'search': args.search_ttl, 'article': args.article_ttl}
+    URL_INDEX = args.url_index
+    RESCRAPE = args.rescrape
+    SEEN_SET = args.seen_set
+    SEEN_ERROR = args.seen_error
+    DEDUP_INDEX = args.dedup_index
+    DUP_THRESHOLD = args.dup_threshold
+    DROP_DUPLICATES = args.drop_duplicates
+    METRICS_FILE = args.metrics_file
+    METRICS_INTERVAL = args.metrics_interval
+    PROFILE = args.profile
+    PROFILE_SAMPLE = args.profile_sample
+    PROFILE_DIR = args.profile_dir
+    RETRIES = args.retries
+    BACKOFF = args.backoff
+    MAX_BACKOFF = args.max_backoff
+    BREAKER_THRESHOLD = args.breaker_threshold
+    BREAKER_COOLDOWN = args.breaker_cooldown
+    DEAD_LETTER_DIR = args.dead_letter_dir
+    MAX_CONCURRENCY = args.max_concurrency
+    WORKERS = args.workers
+    PARSERS = args.parsers
+    PREFETCH = args.prefetch
+    POOL_SIZE = args.browsers
+    PAGES_PER_BROWSER = args.pages_per_browser
     SORT_BY = args.sort_by
+    WINDOW_DAYS = args.window_days
+    WINDOW_PAGES = args.window_pages
+    WINDOW_WORKERS = args.window_workers
 
     LINKS_FROM_FILE = False
     if len(args.link_file) > 0:
         LINKS_FROM_FILE = args.link_file
 
     dr = args.date_range
+    DATE_RANGE = None
     if len(dr) > 0:
         FROM_LAST = dr.split(' ')
 
@@ -69,14 +280,18 @@ def parse_args(parser):
         to_month, to_day, to_year = \
                 [int(i) for i in FROM_LAST[1].split('/')]
 
-        FROM_LAST = "from{}{:02}{:02}to{}{:02}{:02}"\
-            .format(from_year, from_month, from_day, to_year, to_month, to_day)
+        DATE_RANGE = (datetime.date(from_year, from_month, from_day),
+                      datetime.date(to_year, to_month, to_day))
+        FROM_LAST = date_window(*DATE_RANGE)
     else:
         if args.from_last == 24:
             FROM_LAST = "24hours"
         else:
             FROM_LAST = str(args.from_last) + "days"
 
+    if WINDOW_DAYS > 0 and DATE_RANGE is None:
+        parser.error('--window_days needs a --date_range')
+
     func = "document_type"
     DOCUMENT_TYPE = args.doc_type.lower()
     if DOCUMENT_TYPE != "allresults":
@@ -94,111 +309,387 @@ def parse_args(parser):
     else:
         SECTION = SECTION.replace(" ", "%20")
 
-    return QUERY, SLEEP_TIME, PAGE_LOAD_TIMEOUT, SORT_BY, LINKS_FROM_FILE, \
-        FROM_LAST, DOCUMENT_TYPE, SECTION
+    return QUERY, QUERIES, SLEEP_TIME, PAGE_LOAD_TIMEOUT, SORT_BY, \
+        LINKS_FROM_FILE, FROM_LAST, DOCUMENT_TYPE, SECTION, RATE, BURST, \
+        HOST_RATES, MAX_CONCURRENCY, WORKERS, PARSERS, PREFETCH, POOL_SIZE, \
+        PAGES_PER_BROWSER, DATE_RANGE, WINDOW_DAYS, WINDOW_PAGES, \
+        WINDOW_WORKERS, CACHE_DIR, CACHE_SIZE, CACHE_TTLS, URL_INDEX, \
+        RESCRAPE, SEEN_SET, SEEN_ERROR, DEDUP_INDEX, DUP_THRESHOLD, \
+        DROP_DUPLICATES, METRICS_FILE, METRICS_INTERVAL, PROFILE, \
+        PROFILE_SAMPLE, PROFILE_DIR, RETRIES, BACKOFF, MAX_BACKOFF, \
+        BREAKER_THRESHOLD, BREAKER_COOLDOWN, DEAD_LETTER_DIR, RESUME, \
+        ENVELOPE
 
 
 def render(query_url):
-    browser = webdriver.PhantomJS()
-    browser.implicitly_wait(PAGE_LOAD_TIMEOUT)
-    browser.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
-    browser.set_window_size(1120, 550)
-
-    try:
-        browser.get(query_url)
-        html_source = browser.page_source
-        browser.quit()
+    html_source = CACHE.get(query_url, 'search')
+    if html_source is not None:
         return html_source
 
-    except TimeoutException:
-        # retry
-        print("\t\tRetrying page load after {}s timeout".format(PAGE_LOAD_TIMEOUT))
-        return render(query_url)
+    # timeouts are retried with backoff, see --retries
+    html_source = FETCHER.retry.call(query_url, load_page, query_url)
+
+    CACHE.put(query_url, 'search', html_source)
+    return html_source
+
 
+def load_page(query_url):
+    # the host's concurrency slot only times the page load, not launching a
+    # browser or waiting for a free one
+    with BROWSERS.session() as browser:
+        with FETCHER.throttled(query_url), \
+                METRICS.time('page_load', 'nyt', query_url):
+            browser.get(query_url)
+        return browser.page_source
 
-def gen_query_url(page_num=1):
+
+def gen_query_url(query, page_num=1, from_last=None):
     base = "http://query.nytimes.com/search/sitesearch/#/"
     content = "{}/{}/{}/{}/allauthors/{}"\
-        .format(QUERY, FROM_LAST, DOCUMENT_TYPE, page_num, SORT_BY)
+        .format(query, from_last or FROM_LAST, DOCUMENT_TYPE, page_num,
+                SORT_BY)
     query_url = os.path.join(base, content)
     return query_url
 
 
 def search_nyt(query_url):
-    result = render(query_url)
-    soup = BeautifulSoup(result)
-    return soup
-
-
-def get_article_links(soup):
-    hits = soup.findAll("ol", class_="searchResultsList flush")
-    article_links = [hit.attrs["href"] for hit in hits[0].findAll("a")]
+    with PROFILER.profile('collect'):
+        try:
+            result = render(query_url)
+        except Exception as exc:
+            # skipped rather than ending the run, and not mistaken for a
+            # page without results either
+            print('\t\tGiving up on search page {}: {!r}'
+                  .format(query_url, exc))
+            DEAD_LETTERS.add(query_url, 'search', exc)
+            return None
+        with METRICS.time('search_parse', 'nyt', query_url):
+            tree = parse_html(result)
+    return tree
+
+
+def get_article_links(tree):
+    with PROFILER.profile('collect'):
+        with METRICS.time('link_extract', 'nyt'):
+            article_links = [a.get("href") for a in RESULT_LINKS(tree)
+                             if a.get("href")]
+        METRICS.incr('links', 'nyt', n=len(article_links))
     return article_links
 
 
-def collect_links():
-    links = []
-    prev_page_empty = False
-    links_fp = './links/nyt_links_{}_{}.txt'\
+def gen_links_fp(query):
+    return './links/nyt_links_{}_{}.txt'\
         .format(DOCUMENT_TYPE.replace("document_type", "")
                              .replace("%3A", "")
                              .replace("%22", ""),
-                QUERY)
+                query)
 
-    if not os.path.exists("./links"):
-        os.makedirs("./links")
 
-    for idx in range(*PAGE_RANGE):
-        query_url = gen_query_url(idx)
+def collect_links(query, emit=None):
+    prev_page_empty = CHECKPOINT.state['prev_page_empty']
+    links_fp = gen_links_fp(query)
 
-        time.sleep(SLEEP_TIME)
-        soup = search_nyt(query_url)
-        new_links = get_article_links(soup)
+    if not os.path.exists("./links"):
+        os.makedirs("./links")
 
-        print("\tFound {} article links on page {} of query results"
-              .format(len(new_links), idx))
-        links += new_links
+    if WINDOW_DAYS > 0:
+        collect_window_links(query, links_fp, emit)
+        return
+
+    first_page = CHECKPOINT.state['next_page'] or PAGE_RANGE[0]
+    pages = prefetch(lambda idx: search_nyt(gen_query_url(query, idx)),
+                     range(first_page, PAGE_RANGE[1]), window=PREFETCH)
+
+    # leaving the loop cancels the pages still being prefetched
+    with contextlib.closing(pages):
+        for idx, tree in pages:
+            # a page given up on says nothing about whether the results have
+            # run out. It is searched again on --resume
+            if tree is None:
+                CHECKPOINT.page_failed(gen_query_url(query, idx), query)
+                CHECKPOINT.add_links([], idx + 1, prev_page_empty)
+                continue
+            new_links = get_article_links(tree)
+
+            print("\tFound {} article links on page {} of query results"
+                  .format(len(new_links), idx))
+            if emit is not None:
+                emit(new_links)
+
+            # the most recent 2 pages are empty, we have run out of query pages!
+            if len(new_links) == 0:
+                if prev_page_empty:
+                    return
+                else:
+                    prev_page_empty = True
+            else:
+                prev_page_empty = False
+                with open(links_fp, 'a') as handle:
+                    handle.write('\n'.join(new_links) + "\n")
+            CHECKPOINT.add_links(new_links, idx + 1, prev_page_empty,
+                                 query_tags(query, new_links))
+
+
+def split_windows(start_date, end_date, days):
+    """Cut the dates from `start_date` to `end_date` into `days`-day windows."""
+    windows = []
+    while start_date <= end_date:
+        last = min(start_date + datetime.timedelta(days - 1), end_date)
+        windows.append((start_date, last))
+        start_date = last + datetime.timedelta(1)
+    return windows
+
+
+def halve_window(window):
+    start_date, end_date = window
+    middle = start_date + (end_date - start_date) // 2
+    return [(start_date, middle), (middle + datetime.timedelta(1), end_date)]
+
+
+def parse_window(page):
+    """The window of dates recorded as a failed page by `window_page()`."""
+    return tuple(datetime.datetime.strptime(date, '%Y-%m-%d').date()
+                 for date in page)
+
+
+def window_page(window):
+    return [date.isoformat() for date in window]
+
+
+def search_window(query, window):
+    """
+    Page through the results of `query` within a date window. Returns the
+    links found, whether there were still results at page --window_pages,
+    i.e., whether the window has to be split to be covered, and whether any
+    of its pages had to be given up on.
+    """
+    links, prev_page_empty, failed = [], False, False
+    for idx in range(1, WINDOW_PAGES + 1):
+        query_url = gen_query_url(query, idx, date_window(*window))
+        tree = search_nyt(query_url)
+        # a failed page says nothing about how many pages there are
+        if tree is None:
+            failed, prev_page_empty = True, False
+            if idx == WINDOW_PAGES:
+                return links, False, failed
+            continue
+        new_links = get_article_links(tree)
+        links.extend(new_links)
 
         # the most recent 2 pages are empty, we have run out of query pages!
         if len(new_links) == 0:
             if prev_page_empty:
-                return set(links)
-            else:
-                prev_page_empty = True
+                return links, False, failed
+            prev_page_empty = True
         else:
             prev_page_empty = False
-            with open(links_fp, 'a') as handle:
+    return links, not prev_page_empty, failed
+
+
+def collect_window_links(query, links_fp, emit=None):
+    """
+    Search --date_range in windows of --window_days, --window_workers
+    windows at a time, rather than paging through the whole range in order.
+    A window with more than --window_pages pages of results is split in
+    half and both halves are searched, so busy stretches end up in windows
+    small enough to be covered completely while quiet ones stay large. A
+    window with pages that had to be given up on is never split; it is left
+    unfinished, to be searched again on --resume.
+    """
+    # windows finished or split before an interrupted run stopped
+    status = CHECKPOINT.state['windows']
+
+    def pending_windows(window):
+        key = date_window(*window)
+        # failed windows are searched again by retry_failed_pages()
+        if status.get(key) in ['done', 'failed']:
+            return []
+        if status.get(key) == 'split':
+            return [w for half in halve_window(window)
+                    for w in pending_windows(half)]
+        return [window]
+
+    windows = [w for window in split_windows(DATE_RANGE[0], DATE_RANGE[1],
+                                             WINDOW_DAYS)
+               for w in pending_windows(window)]
+
+    executor = ThreadPoolExecutor(max_workers=WINDOW_WORKERS)
+    futures = dict((executor.submit(search_window, query, window), window)
+                   for window in windows)
+    try:
+        while len(futures) > 0:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                window = futures.pop(future)
+                new_links, capped, failed = future.result()
+                key = date_window(*window)
+
+                # the halves of a split window find its links again
+                if capped and window[0] < window[1]:
+                    print("\tWindow {} has more than {} pages of results, "
+                          "splitting it".format(key, WINDOW_PAGES))
+                    for half in halve_window(window):
+                        futures[executor.submit(search_window, query,
+                                                half)] = half
+                    CHECKPOINT.finish_window(key, 'split')
+                    continue
+
+                print("\tFound {} article links in window {}"
+                      .format(len(new_links), key))
+                if failed:
+                    print("\tSome search pages of window {} failed, it will "
+                          "be searched again on --resume".format(key))
+                    CHECKPOINT.page_failed(window_page(window), query)
+                elif capped:
+                    print("\tOnly the first {} pages of results for {} "
+                          "were collected".format(WINDOW_PAGES, key))
+                if emit is not None:
+                    emit(new_links)
+                if len(new_links) > 0:
+                    with open(links_fp, 'a') as handle:
+                        handle.write('\n'.join(new_links) + "\n")
+                CHECKPOINT.add_links(new_links, None, False,
+                                     query_tags(query, new_links))
+                CHECKPOINT.finish_window(key, 'failed' if failed else 'done')
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+
+
+def retry_failed_pages(emit=None):
+    """
+    Search the pages (or, with --window_days, the date windows) that the
+    run being resumed gave up on again. Those that fail again stay in the
+    checkpoint for the next --resume.
+    """
+    failed_pages = CHECKPOINT.failed_pages
+    if len(failed_pages) > 0:
+        print('\tSearching {} failed pages again'.format(len(failed_pages)))
+
+    # pages are failed in order, so once two of a query come back empty its
+    # results have run out, and its later failed pages are past their end
+    empty_pages = {}
+    while len(failed_pages) > 0:
+        page, query = failed_pages.pop(0)
+        if empty_pages.get(query, 0) >= 2:
+            CHECKPOINT.page_retried(page, query)
+            continue
+        if WINDOW_DAYS > 0:
+            window = parse_window(page)
+            new_links, capped, failed = search_window(query, window)
+            # the halves are searched instead, like in collect_window_links()
+            if capped and window[0] < window[1]:
+                for half in halve_window(window):
+                    CHECKPOINT.page_failed(window_page(half), query)
+                    failed_pages.append((window_page(half), query))
+                CHECKPOINT.page_retried(page, query)
+                continue
+            if failed:
+                continue
+        else:
+            tree = search_nyt(page)
+            if tree is None:
+                continue
+            new_links = get_article_links(tree)
+            if len(new_links) == 0:
+                empty_pages[query] = empty_pages.get(query, 0) + 1
+
+        print("\tFound {} article links searching {} again"
+              .format(len(new_links), page))
+        if emit is not None:
+            emit(new_links)
+        if len(new_links) > 0:
+            with open(gen_links_fp(query), 'a') as handle:
                 handle.write('\n'.join(new_links) + "\n")
+        CHECKPOINT.page_retried(page, query, new_links,
+                                query_tags(query, new_links))
+
 
-    return set(links)
+def query_tags(query, links):
+    """The queries to record for `links` on a run of several queries."""
+    if len(QUERIES) == 1:
+        return None
+    return dict((link, [query]) for link in links)
 
 
 def construct_article(link):
+    with METRICS.time('download', 'nyt', link):
+        page = FETCHER.fetch(link)
+
+    # an unchanged page has already been parsed on a previous run
+    article = CACHE.get_extraction(link, page.digest)
+    if article is not None:
+        METRICS.incr('extraction_cache_hits', 'nyt', link)
+        return article
+
     article = {"url": link}
 
-    article_obj = Article(url=link, language='en')
-    article_obj.download()
-    article_obj.parse()
+    # parsed in a separate process when --parsers is set
+    with METRICS.time('parse', 'nyt', link):
+        fields = PARSER.parse(link, page.text)
 
-    authors = article_obj.authors
-    article['text'] = article_obj.text
-    article['title'] = article_obj.title
+    authors = fields['authors']
+    article['text'] = fields['text']
+    article['title'] = fields['title']
     article['author'] = authors if len(authors) != 0 else None
     article['urlToImage'] = None
-    article['description'] = article_obj.summary
+    article['description'] = fields['summary']
 
     article['publishedAt'] = None
     article['before_election'] = None
 
-    if article_obj.publish_date:
-        date = tz.localize(article_obj.publish_date)
+    if fields['publish_date']:
+        date = tz.localize(fields['publish_date'])
         article['publishedAt'] = date.isoformat()
         article['before_election'] = True if date < ELECTION_DATE else False
+
+    CACHE.put_extraction(link, page.digest, article)
     return article
 
 
-def scrape_articles():
-    articles, links = [], []
+def discover_links(emit):
+    # links found before an interrupted run stopped
+    emit(CHECKPOINT.links)
+    if CHECKPOINT.state['links_done']:
+        return
+
+    if not LINKS_FROM_FILE:
+        retry_failed_pages(emit)
+        # the search phase of each query in turn, into one link frontier
+        for query in QUERIES[CHECKPOINT.state['next_query']:]:
+            collect_links(query, emit)
+            CHECKPOINT.finish_query()
+    else:
+        # a dead letter file can be passed to retry its articles
+        links = read_links(LINKS_FROM_FILE)
+        CHECKPOINT.add_links(links, None, False)
+        emit(links)
+
+    if len(CHECKPOINT.failed_pages) > 0:
+        print('\nCollected all links but those on {} failed search pages'
+              .format(len(CHECKPOINT.failed_pages)))
+        return
+    print('\nCollected all links')
+    CHECKPOINT.finish_links()
+
+
+def scrape_link(idx, link):
+    print('\t{}. Scraping {}'.format(idx + 1, link))
+    try:
+        with PROFILER.profile('extract'):
+            article = construct_article(link)
+    except Exception as exc:
+        # set aside for a later --link_file run rather than ending this one
+        print('\t\tGiving up on {}: {!r}'.format(link, exc))
+        DEAD_LETTERS.add(link, 'article', exc)
+        return None, None
+    # signatures are computed here, on the worker threads, and only looked
+    # up in order in scrape_articles()
+    return article, DEDUP.signature(article['text'])
+
+
+def scrape_articles(writer):
     dtype = DOCUMENT_TYPE.replace("document_type", "")\
                          .replace("%3A", "")\
                          .replace("%22", "")
@@ -207,30 +698,51 @@ def scrape_articles():
     print('\n####### New York Times Scraper #######')
     print('Running query:')
     print('Result pages {} - {} of {}s that contain "{}" from last {}\n'
-          .format(PAGE_RANGE[0], PAGE_RANGE[1], dtype, QUERY, froml))
-
-    if not LINKS_FROM_FILE:
-        links = collect_links()
-    else:
-        with open(LINKS_FROM_FILE, 'r') as handle:
-            for line in handle:
-                links.append(line.strip())
-
-    # de-dupe links
-    links = [i.strip() for i in set(links) if i.strip() != '']
-
-    print('\nCollected {} links'.format(len(links)))
-
-    for idx, link in enumerate(links):
-        print('\t{}. Scraping {}'.format(idx + 1, link))
-        time.sleep(SLEEP_TIME)  # for throttling
-        article = construct_article(link)
-        articles.append(article)
-
-    data = {'articles': articles,
-            'source': 'new-york-times',
+          .format(PAGE_RANGE[0], PAGE_RANGE[1], dtype, '", "'.join(QUERIES),
+                  froml))
+
+    completed = CHECKPOINT.completed_urls()
+    if len(completed) > 0:
+        print('Skipping {} links scraped before the run was interrupted'
+              .format(len(completed)))
+
+    # articles are scraped while later search pages are still being
+    # rendered. Those scraped on earlier runs are left out unless --rescrape
+    known = INDEX.known if not RESCRAPE else None
+    seen = make_seen_set(SEEN_SET, SEEN_ERROR)
+    articles = pipeline(discover_links, scrape_link, workers=WORKERS,
+                        skip=completed, key=canonicalize_url, known=known,
+                        seen=seen)
+    for article, signature in articles:
+        if article is None:
+            continue
+
+        # the output, index and deduplication work of each article
+        with PROFILER.profile('accumulate'):
+            # wire stories run almost word for word on several sites
+            article['duplicate_of'] = DEDUP.check(article['url'], signature)
+            if article['duplicate_of'] is not None:
+                METRICS.incr('duplicates', 'nyt', article['url'])
+                if DROP_DUPLICATES:
+                    INDEX.add(article['url'], None, None)
+                    continue
+
+            offset = writer.offset
+            with METRICS.time('write', 'nyt', article['url']):
+                writer.write(article)
+            METRICS.incr('articles', 'nyt', article['url'])
+            # checkpointed first: a resumed run truncates the output back to
+            # the checkpoint, and must not find the article in the index
+            CHECKPOINT.article_done(writer.offset)
+            INDEX.add(article['url'], writer.fp, offset)
+
+    if SEEN_SET == 'bloom':
+        print(seen.report())
+        seen.close()
+
+    data = {'source': 'new-york-times',
             'status': "ok",
-            'query': QUERY,
+            'query': QUERY if len(QUERIES) == 1 else QUERIES,
             'from_last': FROM_LAST,
             'pagerange': PAGE_RANGE}
     return data
@@ -251,18 +763,147 @@ def save_json(data, save_fp):
 
 def main():
     date = today()
-    data = scrape_articles()
-    n = len(data['articles'])
+    offset = None
 
-    save_fp = "./scraped_json/{}_{}_{}.json".format('nyt', date, n)
-    print('Saving scraped articles to {}'.format(save_fp))
-    save_json(data, save_fp)
+    if RESUME and CHECKPOINT.load():
+        jsonl_fp = CHECKPOINT.state['jsonl_fp']
+        offset = CHECKPOINT.state['offset']
+        print('Resuming interrupted run from {}'.format(CHECKPOINT.dir))
+    else:
+        # every run gets a file of its own, even for the same source and day
+        jsonl_fp = new_output_fp('./scraped_json/{}_{}'.format('nyt', date))
+        CHECKPOINT.start(jsonl_fp)
+    print('Streaming scraped articles to {}'.format(jsonl_fp))
+
+    # the metrics of jobs run by scrape.py are exported by scrape.py
+    metrics_fp = METRICS_FILE if not SHARED else ''
+    with METRICS.exporting(metrics_fp, METRICS_INTERVAL):
+        try:
+            with JSONLWriter(jsonl_fp, offset=offset) as writer:
+                data = scrape_articles(writer)
+                writer.write_metadata(data)
+            if len(QUERIES) > 1:
+                query_fps = write_query_outputs(jsonl_fp, QUERIES,
+                                                CHECKPOINT.link_queries, INDEX,
+                                                data)
+                for query, query_fp in zip(QUERIES, query_fps):
+                    print('Saved the articles found by "{}" to {}'
+                          .format(query, query_fp))
+            # kept for --resume to search the failed pages again
+            n_failed = len(CHECKPOINT.failed_pages)
+            if n_failed > 0:
+                print('{} search pages failed, run again with --resume to '
+                      'search them again'.format(n_failed))
+            else:
+                CHECKPOINT.remove()
+        finally:
+            # shared pools are closed by scrape.py once every job is done
+            if not SHARED:
+                BROWSERS.close()
+                PARSER.close()
+                FETCHER.close()
+                INDEX.close()
+                DEDUP.close()
+                print(BROWSERS.report())
+                print(PARSER.report())
+                print(CONCURRENCY.report())
+                print(CACHE.report())
+                print(INDEX.report())
+                print(DEDUP.report())
+                print(FETCHER.retry.report())
+                print(METRICS.report())
+            # profiles are per job, even when the pools are shared
+            for profile_fp in PROFILER.dump():
+                print('Saved profile to {}'.format(profile_fp))
+            print(DEAD_LETTERS.report())
+        n = writer.count
+        print('Scraped {} articles'.format(n))
+
+        if ENVELOPE:
+            save_fp = '{}_{}.json'.format(os.path.splitext(jsonl_fp)[0], n)
+            print('Saving scraped articles to {}'.format(save_fp))
+            with METRICS.time('save_json', 'nyt'):
+                save_json(jsonl_to_envelope(jsonl_fp), save_fp)
+
+
+def configure(argv=None, shared=None):
+    """
+    Parse `argv` (the command line by default) and set up the module state
+    of a run. `shared` maps the names of the rate limiter, concurrency
+    limiter, cache, fetcher, browser pool, parser pool, URL index and
+    near-duplicate index to objects owned by the caller (see scrape.py),
+    which are used instead of creating new ones and left open when the run
+    ends.
+    """
+    global tz, PAGE_RANGE, ELECTION_DATE, QUERY, QUERIES, SLEEP_TIME, \
+        PAGE_LOAD_TIMEOUT, SORT_BY, LINKS_FROM_FILE, FROM_LAST, \
+        DOCUMENT_TYPE, SECTION, RATE, BURST, HOST_RATES, MAX_CONCURRENCY, \
+        WORKERS, PARSERS, PREFETCH, POOL_SIZE, PAGES_PER_BROWSER, DATE_RANGE, \
+        WINDOW_DAYS, WINDOW_PAGES, WINDOW_WORKERS, CACHE_DIR, CACHE_SIZE, \
+        CACHE_TTLS, URL_INDEX, RESCRAPE, SEEN_SET, SEEN_ERROR, DEDUP_INDEX, \
+        DUP_THRESHOLD, DROP_DUPLICATES, METRICS_FILE, METRICS_INTERVAL, \
+        PROFILE, PROFILE_SAMPLE, PROFILE_DIR, RETRIES, BACKOFF, MAX_BACKOFF, \
+        BREAKER_THRESHOLD, BREAKER_COOLDOWN, DEAD_LETTER_DIR, RESUME, \
+        ENVELOPE, SHARED, LIMITER, CONCURRENCY, CACHE, FETCHER, BROWSERS, \
+        PARSER, INDEX, DEDUP, METRICS, PROFILER, DEAD_LETTERS, CHECKPOINT
 
-if __name__ == "__main__":
     tz = pytz.utc
     PAGE_RANGE = [1, 1000]
     ELECTION_DATE = datetime.datetime(2016, 11, 9, 11, tzinfo=tz)
-    QUERY, SLEEP_TIME, PAGE_LOAD_TIMEOUT, SORT_BY, LINKS_FROM_FILE, \
-        FROM_LAST, DOCUMENT_TYPE, SECTION = parse_args(parser)
+    QUERY, QUERIES, SLEEP_TIME, PAGE_LOAD_TIMEOUT, SORT_BY, LINKS_FROM_FILE, \
+        FROM_LAST, DOCUMENT_TYPE, SECTION, RATE, BURST, HOST_RATES, \
+        MAX_CONCURRENCY, WORKERS, PARSERS, PREFETCH, POOL_SIZE, \
+        PAGES_PER_BROWSER, DATE_RANGE, WINDOW_DAYS, WINDOW_PAGES, \
+        WINDOW_WORKERS, CACHE_DIR, CACHE_SIZE, CACHE_TTLS, URL_INDEX, \
+        RESCRAPE, SEEN_SET, SEEN_ERROR, DEDUP_INDEX, DUP_THRESHOLD, \
+        DROP_DUPLICATES, METRICS_FILE, METRICS_INTERVAL, PROFILE, \
+        PROFILE_SAMPLE, PROFILE_DIR, RETRIES, BACKOFF, MAX_BACKOFF, \
+        BREAKER_THRESHOLD, BREAKER_COOLDOWN, DEAD_LETTER_DIR, RESUME, \
+        ENVELOPE = parse_args(parser, argv)
+
+    SHARED = shared is not None
+    if SHARED:
+        LIMITER = shared['LIMITER']
+        CONCURRENCY = shared['CONCURRENCY']
+        CACHE = shared['CACHE']
+        FETCHER = shared['FETCHER']
+        BROWSERS = shared['BROWSERS']
+        PARSER = shared['PARSER']
+        INDEX = shared['INDEX']
+        DEDUP = shared['DEDUP']
+        METRICS = shared['METRICS']
+    else:
+        METRICS = Metrics()
+        LIMITER = RateLimiter(RATE, BURST, HOST_RATES)
+        CONCURRENCY = AdaptiveConcurrency(maximum=MAX_CONCURRENCY,
+                                          overloaded=is_overloaded)
+        CACHE = HTTPCache(CACHE_DIR, max_bytes=CACHE_SIZE, ttls=CACHE_TTLS)
+        RETRY = RetryPolicy(RETRIES, BACKOFF, MAX_BACKOFF,
+                            retryable=is_retryable,
+                            breaker=CircuitBreaker(BREAKER_THRESHOLD,
+                                                   BREAKER_COOLDOWN))
+        FETCHER = Fetcher(LIMITER, CONCURRENCY, CACHE,
+                          timeout=PAGE_LOAD_TIMEOUT, retry=RETRY)
+        BROWSERS = BrowserPool(size=POOL_SIZE,
+                               page_load_timeout=PAGE_LOAD_TIMEOUT,
+                               max_pages=PAGES_PER_BROWSER,
+                               metrics=METRICS)
+        PARSER = ParserPool(PARSERS)
+        INDEX = URLIndex(URL_INDEX)
+        DEDUP = DuplicateIndex(DEDUP_INDEX, threshold=DUP_THRESHOLD)
+
+    # several jobs for a source may run in one process (see scrape.py)
+    PROFILER = Profiler(PROFILE, PROFILE_DIR,
+                        __name__ if SHARED else 'nyt', PROFILE_SAMPLE)
+    DEAD_LETTERS = DeadLetters(os.path.join(
+        DEAD_LETTER_DIR, '{}_{}.tsv'.format('nyt', today())))
+
+    query_urls = [gen_query_url(query) for query in QUERIES]
+    CHECKPOINT = Checkpoint(
+        Checkpoint.run_key('nyt', query_urls, SECTION, LINKS_FROM_FILE,
+                           WINDOW_DAYS, WINDOW_PAGES))
+
 
+if __name__ == "__main__":
+    configure()
     main()
@@ -0,0 +1,224 @@
+import os
+import json
+import argparse
+import threading
+
+from url_index import canonicalize_url
+
+
+class JSONLWriter(object):
+    """
+    Streams articles to a newline-delimited JSON file as soon as they are
+    constructed, one compact record per line, so memory stays flat and
+    finished articles are on disk even if the run dies. The run metadata
+    (source, query, from_last, pagerange) is written as a final
+    `{"metadata": {...}}` record.
+
+    If `offset` is given, an existing file is truncated to `offset` bytes and
+    appended to, which is how an interrupted run resumes its output.
+    """
+    def __init__(self, fp, offset=None):
+        self.fp = fp
+        self.resume_offset = offset
+        self.count = 0
+        self.offset = 0
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        dirname = os.path.dirname(self.fp)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        if self.resume_offset is None or not os.path.exists(self.fp):
+            self._handle = open(self.fp, 'w')
+            return
+
+        # count the articles that survive the truncation
+        with open(self.fp, 'rb') as handle:
+            n_bytes = 0
+            for line in handle:
+                n_bytes += len(line)
+                if n_bytes > self.resume_offset:
+                    break
+                self.count += 1
+
+        self._handle = open(self.fp, 'a')
+        self._handle.truncate(self.resume_offset)
+        self.offset = self.resume_offset
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _write_line(self, record):
+        line = json.dumps(record, sort_keys=True, separators=(',', ':'))
+        with self._lock:
+            self._handle.write(line + '\n')
+            self._handle.flush()
+            self.offset = self._handle.tell()
+
+    def write(self, article):
+        self._write_line(article)
+        with self._lock:
+            self.count += 1
+
+    def write_metadata(self, metadata):
+        self._write_line({'metadata': metadata})
+
+
+def new_output_fp(prefix):
+    """
+    Create an empty `<prefix>.jsonl` for a new run and return its path. If
+    an earlier run already wrote there, `<prefix>.2.jsonl`, `<prefix>.3.jsonl`
+    and so on are tried instead, so a run never overwrites another's output.
+    """
+    dirname = os.path.dirname(prefix)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    n = 1
+    while True:
+        fp = '{}{}.jsonl'.format(prefix, '.{}'.format(n) if n > 1 else '')
+        try:
+            # 'x' fails if the file exists, even when another process
+            # creates it at the same time
+            with open(fp, 'x'):
+                return fp
+        except FileExistsError:
+            n += 1
+
+
+def is_metadata(record):
+    return len(record) == 1 and 'metadata' in record
+
+
+def read_jsonl(fp):
+    """
+    Yield every record in a JSONL file written by `JSONLWriter`. A partially
+    written last line (e.g., from a killed run) is skipped.
+    """
+    with open(fp, 'r') as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def is_reference(record):
+    return set(record) == {'url', 'output', 'offset'}
+
+
+def read_article(fp, offset):
+    """Read the record at byte `offset` of the JSONL file `fp`."""
+    with open(fp, 'rb') as handle:
+        handle.seek(offset)
+        return json.loads(handle.readline().decode('utf-8'))
+
+
+def jsonl_offsets(fp):
+    """Map the canonical URL of every article in a JSONL file to its offset."""
+    offsets = {}
+    if not os.path.exists(fp):
+        return offsets
+
+    offset = 0
+    with open(fp, 'rb') as handle:
+        for line in handle:
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+            if 'url' in record:
+                offsets[canonicalize_url(record['url'])] = offset
+            offset += len(line)
+    return offsets
+
+
+def write_query_outputs(fp, queries, link_queries, index, metadata):
+    """
+    Write, next to the JSONL file `fp` of a run over several queries, one
+    JSONL file per query holding a `{"url", "output", "offset"}` reference
+    to each article that query found, followed by the run metadata for that
+    query. Articles scraped by the run are referenced in `fp`; those skipped
+    because an earlier run scraped them are looked up in the URL `index`.
+    `link_queries` maps each link found to the set of queries that found it.
+    Returns the paths of the files written.
+    """
+    offsets = jsonl_offsets(fp)
+    output = os.path.abspath(fp)
+    query_fps = []
+    for query in queries:
+        query_fp = '{}_{}.jsonl'.format(os.path.splitext(fp)[0], query)
+        with JSONLWriter(query_fp) as writer:
+            written = set()
+            for link, found_by in link_queries.items():
+                url = canonicalize_url(link)
+                if query not in found_by or url in written:
+                    continue
+                written.add(url)
+
+                if url in offsets:
+                    writer.write({'url': link, 'output': output,
+                                  'offset': offsets[url]})
+                    continue
+                row = index.lookup(link)
+                if row is not None and row[2] is not None:
+                    writer.write({'url': row[0], 'output': row[2],
+                                  'offset': row[3]})
+
+            query_metadata = dict(metadata)
+            query_metadata['query'] = query
+            writer.write_metadata(query_metadata)
+        query_fps.append(query_fp)
+    return query_fps
+
+
+def jsonl_to_envelope(fp):
+    """
+    Collect a JSONL file into the original `{"articles": [...], "source": ..}`
+    envelope format. References to articles stored in another file (see
+    `write_query_outputs`) are replaced by the articles.
+    """
+    articles, metadata = [], {}
+    for record in read_jsonl(fp):
+        if is_metadata(record):
+            metadata = record['metadata']
+        elif is_reference(record):
+            articles.append(read_article(record['output'], record['offset']))
+        else:
+            articles.append(record)
+
+    data = dict(metadata)
+    data['articles'] = articles
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Convert a scraped JSONL file to the JSON envelope format.')
+    parser.add_argument('jsonl_file', type=str,
+                        help="Path to a JSONL file of scraped articles")
+    parser.add_argument('-o', '--output', type=str, default="",
+                        help="Path of the JSON file to write. Defaults to the "
+                             "input path with a .json extension")
+    args = parser.parse_args()
+
+    save_fp = args.output or os.path.splitext(args.jsonl_file)[0] + '.json'
+    data = jsonl_to_envelope(args.jsonl_file)
+    with open(save_fp, 'w') as handle:
+        json.dump(data, handle, indent=4,
+                  sort_keys=True, separators=(',', ':'))
+    print('Wrote {} articles to {}'.format(len(data['articles']), save_fp))
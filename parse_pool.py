@@ -0,0 +1,78 @@
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from newspaper import Article
+
+
+def parse_article(link, raw):
+    """
+    Run newspaper's extraction on the UTF-8 encoded body of an article page
+    and return the fields the scrapers keep.
+    """
+    article_obj = Article(url=link, language='en')
+    article_obj.download(raw.decode('utf-8'))
+    article_obj.parse()
+
+    return {'text': article_obj.text,
+            'title': article_obj.title,
+            'authors': article_obj.authors,
+            'summary': article_obj.summary,
+            'publish_date': article_obj.publish_date}
+
+
+class ParserPool(object):
+    """
+    Article extraction (lxml cleaning, text extraction, date and author
+    heuristics) is CPU-bound and holds the GIL, so it gets nothing out of the
+    threads that download articles. `ParserPool` hands the downloaded pages to
+    `size` worker processes instead; the calling thread blocks on the result
+    without holding the GIL, so downloads carry on while pages are parsed.
+
+    Pages cross the process boundary as a single UTF-8 `bytes` buffer, which
+    pickles as one contiguous copy, and are only decoded in the worker. With a
+    size of 0 pages are parsed in the calling thread.
+    """
+    def __init__(self, size=0):
+        self.size = size
+        self.stats = {'pages': 0, 'bytes': 0, 'parse_time': 0.}
+        self._lock = threading.Lock()
+
+        self._executor = None
+        if size > 0:
+            # forking a process that already runs browser and download
+            # threads can deadlock the children, so start them fresh
+            self._executor = ProcessPoolExecutor(
+                max_workers=size,
+                mp_context=multiprocessing.get_context('spawn'))
+
+    def parse(self, link, html_source):
+        raw = html_source.encode('utf-8')
+
+        start = time.time()
+        if self._executor is None:
+            fields = parse_article(link, raw)
+        else:
+            fields = self._executor.submit(parse_article, link, raw).result()
+
+        with self._lock:
+            self.stats['pages'] += 1
+            self.stats['bytes'] += len(raw)
+            self.stats['parse_time'] += time.time() - start
+        return fields
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        where = '{} processes'.format(self.size) if self.size > 0 \
+            else 'download threads'
+        avg = stats['parse_time'] / stats['pages'] if stats['pages'] else 0.
+        return ('Parser pool ({}): {} pages, {:.1f} MB parsed, '
+                '{:.2f}s per page'
+                .format(where, stats['pages'], stats['bytes'] / 1024. ** 2,
+                        avg))
@@ -0,0 +1,43 @@
+import threading
+
+import lxml.html
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+_local = threading.local()
+
+
+def _parser():
+    # lxml parsers must not be shared between threads
+    if not hasattr(_local, 'parser'):
+        _local.parser = lxml.html.HTMLParser(encoding='utf-8')
+    return _local.parser
+
+
+def parse_html(html_source):
+    """
+    Parse a page with lxml. Search result pages are only ever queried with
+    the compiled selectors below, which is much cheaper than building a
+    BeautifulSoup tree of the whole page.
+    """
+    if isinstance(html_source, str):
+        html_source = html_source.encode('utf-8')
+    return lxml.html.fromstring(html_source, parser=_parser())
+
+
+def css(selector):
+    """Compile a CSS selector once so it can be reused across pages."""
+    return CSSSelector(selector)
+
+
+# the href of the first link below an element
+FIRST_HREF = etree.XPath('(.//a[@href])[1]/@href')
+
+
+def first_hrefs(elements):
+    hrefs = []
+    for element in elements:
+        href = FIRST_HREF(element)
+        if len(href) > 0:
+            hrefs.append(str(href[0]))
+    return hrefs
@@ -0,0 +1,136 @@
+import queue
+import itertools
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+def pipeline(discover, scrape, workers=1, max_pending=None, skip=(),
+             key=None, known=None, seen=None):
+    """
+    Run link discovery and article extraction at the same time.
+
+    `discover(emit)` runs in a background thread and calls `emit(links)`
+    every time it finds new links (e.g., once per search page). Each unseen
+    link is handed to `scrape(idx, link)` on a pool of `workers` threads, and
+    the results are yielded in the order the links were discovered. Links in
+    `skip` are dropped, as are those in the set `known(links)` returns for
+    each batch. Two links are the same if they map to the same `key(link)`.
+    The keys seen so far are kept in `seen` (a new set by default), which
+    may be any container with `add()` and `in`, e.g. a `seen_set.SeenSet`.
+
+    At most `max_pending` links are queued or in flight at once; once that
+    many are waiting, `emit` blocks, so discovery never races ahead of
+    extraction.
+    """
+    max_pending = max_pending or 4 * workers
+    links = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+    key = key or (lambda link: link)
+    seen = seen if seen is not None else set()
+    for link in skip:
+        seen.add(key(link))
+    errors = []
+
+    def emit(new_links):
+        unseen = []
+        for link in new_links:
+            link = link.strip()
+            if link == '' or key(link) in seen:
+                continue
+            seen.add(key(link))
+            unseen.append(link)
+
+        # links found again (e.g., by another query) are not looked up again
+        dropped = known(unseen) if known is not None and unseen else ()
+        for link in unseen:
+            if link in dropped:
+                continue
+
+            while True:
+                if stopped.is_set():
+                    raise _Stopped()
+                try:
+                    links.put(link, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def produce():
+        try:
+            discover(emit)
+        except _Stopped:
+            pass
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            links.put(_DONE)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+
+    pending = collections.deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            idx = 0
+            while True:
+                while len(pending) > 0 and pending[0].done():
+                    yield pending.popleft().result()
+
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+                    continue
+
+                try:
+                    link = links.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if link is _DONE:
+                    break
+
+                pending.append(executor.submit(scrape, idx, link))
+                idx += 1
+
+            while len(pending) > 0:
+                yield pending.popleft().result()
+    finally:
+        stopped.set()
+        for future in pending:
+            future.cancel()
+
+    producer.join()
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def prefetch(fetch, keys, window=1):
+    """
+    Yield `(key, fetch(key))` for each of `keys` in order, while up to
+    `window - 1` of the following keys are already being fetched in the
+    background. Closing the generator early cancels the fetches that have
+    not started yet and discards the rest.
+    """
+    keys = iter(keys)
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=window)
+    try:
+        for key in itertools.islice(keys, window):
+            pending.append((key, executor.submit(fetch, key)))
+
+        while len(pending) > 0:
+            key, future = pending.popleft()
+            yield key, future.result()
+
+            for key in itertools.islice(keys, window - len(pending)):
+                pending.append((key, executor.submit(fetch, key)))
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,202 @@
+import os
+import io
+import dis
+import sys
+import random
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+
+# cProfile can only profile one block at a time on newer Pythons, and
+# tracemalloc traces the whole process, so only one block is profiled at a
+# time, even across the scrapers scrape.py runs in one process
+_LOCK = threading.Lock()
+
+# number of frames kept in each allocation traceback. Must be deep enough to
+# reach the profiled function from inside lxml and newspaper
+TRACE_FRAMES = 32
+TOP_SITES = 25
+
+
+class Profiler(object):
+    """
+    Per-phase CPU or allocation profiles of a run. Only a random `sample` of
+    the blocks run under `profile(phase)` (plus the first of each phase) are
+    profiled, one at a time, so it is cheap enough to leave on for a
+    full-size run.
+
+    With `mode` 'cpu', sampled blocks run under cProfile. The profiles of a
+    phase are merged and dumped to `<out_dir>/<name>_<phase>.pstats`, with a
+    summary of the top functions in a `.txt` next to it.
+
+    With `mode` 'mem', allocations are traced with tracemalloc while a
+    sampled block runs. The memory the block's function still holds at the
+    end of the block, by allocation site and by the line of the function it
+    was allocated from, and the peak memory traced during the block go to
+    `<out_dir>/<name>_<phase>.mem.txt`.
+
+    With no `mode`, `profile()` does nothing.
+    """
+    def __init__(self, mode=None, out_dir='./profiles', name='run',
+                 sample=0.05, seed=None):
+        self.mode = mode
+        self.out_dir = out_dir
+        self.name = name
+        self.sample = sample
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # phase -> [blocks, blocks profiled]
+        self._counts = {}
+        # phase -> merged pstats.Stats ('cpu'), or the sums of the memory
+        # held by site and by line, and the peaks of the blocks ('mem')
+        self._stats = {}
+
+    def _sampled(self, phase):
+        with self._lock:
+            count = self._counts.setdefault(phase, [0, 0])
+            count[0] += 1
+            if count[1] == 0 or self._rng.random() < self.sample:
+                count[1] += 1
+                return True
+            return False
+
+    @contextlib.contextmanager
+    def profile(self, phase):
+        """Profile the body of the `with` block if it is sampled."""
+        if self.mode is None or not self._sampled(phase):
+            yield
+            return
+
+        # a sampled block that finds another being profiled runs as is
+        if not _LOCK.acquire(False):
+            with self._lock:
+                self._counts[phase][1] -= 1
+            yield
+            return
+
+        try:
+            if self.mode == 'cpu':
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                    self._add_profile(phase, profile)
+            else:
+                # the function the `with` block is in, past contextlib's
+                # __enter__
+                code = sys._getframe(2).f_code
+                started = not tracemalloc.is_tracing()
+                if started:
+                    tracemalloc.start(TRACE_FRAMES)
+                tracemalloc.reset_peak()
+                try:
+                    yield
+                finally:
+                    snapshot = tracemalloc.take_snapshot()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    if started:
+                        tracemalloc.stop()
+                    self._add_snapshot(phase, code, snapshot, peak)
+        finally:
+            _LOCK.release()
+
+    def _add_profile(self, phase, profile):
+        with self._lock:
+            if phase in self._stats:
+                self._stats[phase].add(profile)
+            else:
+                self._stats[phase] = pstats.Stats(profile)
+
+    def _add_snapshot(self, phase, code, snapshot, peak):
+        lines = set((code.co_filename, lineno)
+                    for _, lineno in dis.findlinestarts(code))
+
+        # other threads allocate while the block runs; only the allocations
+        # made under the block's function count
+        sites, callers = {}, {}
+        for trace in snapshot.traces:
+            caller = None
+            for frame in trace.traceback:
+                if (frame.filename, frame.lineno) in lines:
+                    caller = frame
+            if caller is None:
+                continue
+            frame = trace.traceback[-1]
+            for by, key in [(sites, (frame.filename, frame.lineno)),
+                            (callers, (caller.filename, caller.lineno))]:
+                total = by.setdefault(key, [0, 0])
+                total[0] += trace.size
+                total[1] += 1
+
+        with self._lock:
+            stats = self._stats.setdefault(phase, ({}, {}, []))
+            for by, totals in zip(stats, [sites, callers]):
+                for key, (size, count) in totals.items():
+                    total = by.setdefault(key, [0, 0])
+                    total[0] += size
+                    total[1] += count
+            stats[2].append(peak)
+
+    def _dump_cpu(self, phase, stats):
+        fp = os.path.join(self.out_dir,
+                          '{}_{}.pstats'.format(self.name, phase))
+        stats.dump_stats(fp)
+
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(TOP_SITES)
+        stats.sort_stats('tottime').print_stats(TOP_SITES)
+        with open(fp[:-len('.pstats')] + '.txt', 'w') as handle:
+            count, sampled = self._counts[phase]
+            handle.write('{} of {} blocks profiled\n'.format(sampled, count))
+            handle.write(text.getvalue())
+        return fp
+
+    def _dump_mem(self, phase, stats):
+        sites, callers, peaks = stats
+        n = len(peaks)
+
+        fp = os.path.join(self.out_dir,
+                          '{}_{}.mem.txt'.format(self.name, phase))
+        with open(fp, 'w') as handle:
+            handle.write('{} of {} blocks traced\n'
+                         .format(n, self._counts[phase][0]))
+            handle.write('Peak memory traced during a block: {:.1f} KiB on '
+                         'average, {:.1f} KiB at most\n'
+                         .format(sum(peaks) / 1024. / n, max(peaks) / 1024.))
+            for title, totals in [('allocation site', sites),
+                                  ('line of the profiled function', callers)]:
+                handle.write('\nMemory still held at the end of a block, on '
+                             'average, by {}:\n'.format(title))
+                top = sorted(totals.items(), key=lambda item: -item[1][0])
+                for (filename, lineno), (size, count) in top[:TOP_SITES]:
+                    handle.write('{:>12.1f} KiB {:>9.1f} allocs  {}:{}\n'
+                                 .format(size / 1024. / n, count / float(n),
+                                         filename, lineno))
+        return fp
+
+    def dump(self):
+        """Write the profiles collected so far and return their paths."""
+        if self.mode is None:
+            return []
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+
+        with self._lock:
+            stats = dict(self._stats)
+        dump = self._dump_cpu if self.mode == 'cpu' else self._dump_mem
+        return [dump(phase, phase_stats)
+                for phase, phase_stats in sorted(stats.items())]
+
+    def report(self):
+        if self.mode is None:
+            return 'Profiler: disabled'
+        with self._lock:
+            counts = dict(self._counts)
+        return 'Profiler ({}): '.format(self.mode) + ', '.join(
+            '{} of {} {} blocks profiled'.format(sampled, count, phase)
+            for phase, (count, sampled) in sorted(counts.items()))
@@ -0,0 +1,188 @@
+import os
+import time
+import random
+import datetime
+import threading
+
+from throttle import get_host
+
+
+class CircuitBreaker(object):
+    """
+    Pauses requests to a host that keeps failing. After `threshold` failures
+    in a row, `wait()` holds every request to the host for `cooldown`
+    seconds, after which requests are let through again. A failure before
+    the next success re-opens the breaker for twice as long, up to
+    `max_cooldown`; a success closes it and resets the cooldown.
+    """
+    def __init__(self, threshold=5, cooldown=60., max_cooldown=600.,
+                 log=print):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.log = log
+
+        # host -> [failures in a row, open until, current cooldown]
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'paused_time': 0.}
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = [0, 0., self.cooldown]
+        return self._hosts[host]
+
+    def wait(self, url):
+        """Block until requests to the host of `url` may be sent."""
+        if not self.threshold:
+            return 0.
+        host = get_host(url)
+        with self._lock:
+            delay = self._host(host)[1] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+            with self._lock:
+                self.stats['paused_time'] += delay
+            return delay
+        return 0.
+
+    def record(self, url, ok):
+        if not self.threshold:
+            return
+        host = get_host(url)
+        with self._lock:
+            state = self._host(host)
+            if ok:
+                state[0], state[2] = 0, self.cooldown
+                return
+
+            state[0] += 1
+            # requests sent before the pause do not extend it
+            if state[0] < self.threshold or time.time() < state[1]:
+                return
+            # a failure right after a pause means the host is still down
+            if state[0] > self.threshold:
+                state[2] = min(self.max_cooldown, 2 * state[2])
+            state[1] = time.time() + state[2]
+            self.stats['opened'] += 1
+            failures, cooldown = state[0], state[2]
+        self.log('\t\t[{}] {} failures in a row, pausing requests for {:.0f}s'
+                 .format(host, failures, cooldown))
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        return ('Circuit breaker: opened {} times, {:.1f}s spent paused'
+                .format(stats['opened'], stats['paused_time']))
+
+
+class RetryPolicy(object):
+    """
+    Retries a request up to `retries` times when it fails in a way that
+    `retryable(exc)` says is worth retrying (e.g., a timeout or a 503),
+    waiting a random time of up to `backoff * 2 ** attempt` seconds (capped
+    at `max_backoff`) in between -- "full jitter", so clients that failed
+    together do not retry together. Every attempt first waits on `breaker`,
+    which sees the outcome of every attempt.
+    """
+    def __init__(self, retries=3, backoff=1., max_backoff=60.,
+                 retryable=None, breaker=None, log=print, seed=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retryable = retryable or (lambda exc: False)
+        self.breaker = breaker or CircuitBreaker(threshold=0)
+        self.log = log
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'retries': 0, 'failures': 0}
+
+    def delay(self, attempt):
+        with self._lock:
+            return self._rng.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, url, func, *args, **kwargs):
+        """Return `func(*args, **kwargs)`, a request to `url`."""
+        attempt = 0
+        while True:
+            self.breaker.wait(url)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                # a bad page (say, a 404) says nothing about the host
+                if not self.retryable(exc):
+                    raise
+                self.breaker.record(url, False)
+                if attempt >= self.retries:
+                    with self._lock:
+                        self.stats['failures'] += 1
+                    raise
+                error = type(exc).__name__
+            else:
+                self.breaker.record(url, True)
+                return result
+
+            delay = self.delay(attempt)
+            attempt += 1
+            with self._lock:
+                self.stats['retries'] += 1
+            self.log('\t\tRetrying {} in {:.1f}s after {} ({} of {})'
+                     .format(url, delay, error, attempt, self.retries))
+            time.sleep(delay)
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        return ('Retries: {} retried requests, {} given up on. {}'
+                .format(stats['retries'], stats['failures'],
+                        self.breaker.report()))
+
+
+class DeadLetters(object):
+    """
+    A tab-separated file of the URLs a run gave up on, with the stage that
+    failed ('article' or 'search'), the time and the error. It is only
+    created once something fails. Pass it to a scraper's --link_file to
+    retry its articles; see `read_links()`. Failed search pages are kept in
+    the run's checkpoint instead, and searched again with --resume.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, url, stage, exc):
+        line = '\t'.join([url, stage, datetime.datetime.now().isoformat(),
+                          repr(exc).replace('\t', ' ').replace('\n', ' ')])
+        with self._lock:
+            dirname = os.path.dirname(self.fp)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(self.fp, 'a') as handle:
+                handle.write(line + '\n')
+            self.count += 1
+
+    def report(self):
+        with self._lock:
+            if self.count == 0:
+                return 'Dead letters: none'
+            return 'Dead letters: {} URLs given up on, see {}'\
+                .format(self.count, self.fp)
+
+
+def read_links(fp):
+    """
+    Read the links of a --link_file: one URL per line, or a dead letter file,
+    of which only the articles are kept (a failed search page is searched
+    again by resuming its run).
+    """
+    links = []
+    with open(fp, 'r') as handle:
+        for line in handle:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) > 1 and fields[1] != 'article':
+                continue
+            links.append(fields[0].strip())
+    return links
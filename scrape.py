@@ -0,0 +1,280 @@
+import os
+import sys
+import shlex
+import argparse
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from browser_pool import BrowserPool
+from fetch import Fetcher, is_overloaded, is_retryable
+from http_cache import HTTPCache
+from metrics import Metrics
+from near_dup import DuplicateIndex
+from parse_pool import ParserPool
+from retry import RetryPolicy, CircuitBreaker
+from throttle import RateLimiter, AdaptiveConcurrency, parse_host_rates
+from url_index import URLIndex
+
+SOURCES = ['nyt', 'npr', 'wapo', 'buzzfeed']
+
+
+parser = argparse.ArgumentParser(
+    description='Run several scrapers at once in a single process, sharing '
+                'their browsers, HTTP connections and page cache.')
+
+parser.add_argument('-j', '--job', type=str, action='append', default=[],
+                    help="A source followed by that scraper's arguments, e.g. "
+                         "\"nyt -q trump -r '9/25/2016 11/23/2016'\". May be "
+                         "given several times")
+parser.add_argument('--job_file', type=str, default="",
+                    help="Path to a file with one job per line, in the same "
+                         "form as --job. Blank lines and lines starting with "
+                         "'#' are ignored")
+
+parser.add_argument('--sleep_time', type=int, default=5,
+                    help="Time (in seconds) to wait between queries to the "
+                         "same host. Ignored if --rate is given")
+parser.add_argument('--rate', type=float, default=None,
+                    help="Maximum number of requests per second to any single "
+                         "host. Defaults to 1 / sleep_time (no limit if "
+                         "sleep_time is 0)")
+parser.add_argument('--burst', type=int, default=1,
+                    help="Number of requests to a host that may be sent "
+                         "back-to-back before --rate applies")
+parser.add_argument('--host_rates', type=str, default="",
+                    help="A space separated string of per-host overrides of "
+                         "the form 'host=rate[:burst]'")
+parser.add_argument('--max_concurrency', type=int, default=8,
+                    help="Upper bound on the number of requests in flight to a "
+                         "single host")
+parser.add_argument('--cache_dir', type=str, default="./cache",
+                    help="Directory of the on-disk page cache. Pass an empty "
+                         "string to disable caching")
+parser.add_argument('--cache_size', type=int, default=1024,
+                    help="Disk budget (in MB) of the page cache")
+parser.add_argument('--search_ttl', type=int, default=60 * 60,
+                    help="Time (in seconds) a cached search page stays fresh")
+parser.add_argument('--article_ttl', type=int, default=30 * 24 * 60 * 60,
+                    help="Time (in seconds) a cached article page stays fresh")
+parser.add_argument('--url_index', type=str, default="./url_index.sqlite",
+                    help="Path of the index of articles scraped on earlier "
+                         "runs, which are skipped. Pass an empty string to "
+                         "disable it")
+parser.add_argument('--dedup_index', type=str, default="./near_dups.sqlite",
+                    help="Path of the index of article text signatures used "
+                         "to find near duplicates across all jobs. Pass an "
+                         "empty string to disable it")
+parser.add_argument('--dup_threshold', type=float, default=0.8,
+                    help="Estimated Jaccard similarity above which two "
+                         "articles count as duplicates")
+parser.add_argument('--page_timeout', type=int, default=30,
+                    help="Time (in seconds) after which we stop trying to load "
+                         "a page and retry")
+parser.add_argument('--retries', type=int, default=3,
+                    help="Number of times a page that timed out or was "
+                         "refused as overloaded is retried before it is "
+                         "given up on")
+parser.add_argument('--backoff', type=float, default=1.,
+                    help="Base delay (in seconds) between retries. The n-th "
+                         "retry waits a random time of up to backoff * 2^n "
+                         "seconds")
+parser.add_argument('--max_backoff', type=float, default=60.,
+                    help="Upper bound (in seconds) on the delay between "
+                         "retries")
+parser.add_argument('--breaker_threshold', type=int, default=5,
+                    help="Number of failed requests in a row after which "
+                         "requests to a host are paused, for all jobs. 0 "
+                         "never pauses")
+parser.add_argument('--breaker_cooldown', type=float, default=60.,
+                    help="Time (in seconds) requests to a failing host are "
+                         "paused for. Doubles while the host keeps failing")
+parser.add_argument('--browsers', type=int, default=None,
+                    help="Maximum number of headless browser sessions shared "
+                         "by all jobs. Defaults to one per source")
+parser.add_argument('--pages_per_browser', type=int, default=100,
+                    help="Number of pages a browser session renders before it "
+                         "is restarted")
+parser.add_argument('--parsers', type=int, default=0,
+                    help="Number of processes, shared by all jobs, that parse "
+                         "downloaded articles. 0 parses in the download "
+                         "threads")
+parser.add_argument('--metrics_file', type=str, default="",
+                    help="Path of a file kept up to date during the run with "
+                         "timings of each stage and event counts of all "
+                         "jobs, by source and host. Written in the "
+                         "Prometheus text format if it ends in .prom and as "
+                         "JSON otherwise")
+parser.add_argument('--metrics_interval', type=float, default=10.,
+                    help="Time (in seconds) between updates of "
+                         "--metrics_file")
+
+
+def parse_args(parser):
+    args = parser.parse_args()
+
+    JOBS = [shlex.split(job) for job in args.job]
+    if len(args.job_file) > 0:
+        with open(args.job_file, 'r') as handle:
+            JOBS += [shlex.split(line) for line in handle
+                     if line.strip() and not line.strip().startswith('#')]
+
+    if len(JOBS) == 0:
+        parser.error('no jobs given, use --job or --job_file')
+    for job in JOBS:
+        if len(job) == 0 or job[0] not in SOURCES:
+            parser.error('a job must start with one of {}'
+                         .format(', '.join(SOURCES)))
+        # checked before the shared cache and indexes are created
+        job_parser = load_scraper(job[0], '{}_options'.format(job[0])).parser
+        job_parser.prog = '{} {}'.format(parser.prog, job[0])
+        options = shared_options(job_parser, job[1:])
+        if len(options) > 0:
+            parser.error('job "{}" sets {}, which scrape.py sets for all '
+                         'jobs'.format(' '.join(job), ', '.join(options)))
+
+    SLEEP_TIME = args.sleep_time
+    RATE = args.rate
+    if RATE is None and SLEEP_TIME > 0:
+        RATE = 1. / SLEEP_TIME
+    BURST = args.burst
+    HOST_RATES = parse_host_rates(args.host_rates)
+    MAX_CONCURRENCY = args.max_concurrency
+    PAGE_LOAD_TIMEOUT = args.page_timeout
+    CACHE_DIR = args.cache_dir
+    CACHE_SIZE = args.cache_size * 1024 ** 2
+    CACHE_TTLS = {'search': args.search_ttl, 'article': args.article_ttl}
+    URL_INDEX = args.url_index
+    DEDUP_INDEX = args.dedup_index
+    DUP_THRESHOLD = args.dup_threshold
+    POOL_SIZE = args.browsers
+    if POOL_SIZE is None:
+        POOL_SIZE = len(set(job[0] for job in JOBS))
+    PAGES_PER_BROWSER = args.pages_per_browser
+    PARSERS = args.parsers
+    METRICS_FILE = args.metrics_file
+    METRICS_INTERVAL = args.metrics_interval
+    RETRIES = args.retries
+    BACKOFF = args.backoff
+    MAX_BACKOFF = args.max_backoff
+    BREAKER_THRESHOLD = args.breaker_threshold
+    BREAKER_COOLDOWN = args.breaker_cooldown
+
+    return JOBS, RATE, BURST, HOST_RATES, MAX_CONCURRENCY, PAGE_LOAD_TIMEOUT, \
+        CACHE_DIR, CACHE_SIZE, CACHE_TTLS, URL_INDEX, DEDUP_INDEX, \
+        DUP_THRESHOLD, POOL_SIZE, PAGES_PER_BROWSER, PARSERS, METRICS_FILE, \
+        METRICS_INTERVAL, RETRIES, BACKOFF, MAX_BACKOFF, BREAKER_THRESHOLD, \
+        BREAKER_COOLDOWN
+
+
+def load_scraper(source, name):
+    """
+    Load a fresh copy of a scraper module. Each scraper keeps the state of
+    its run in module globals, so every job needs a copy of its own.
+    """
+    fp = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      source + '.py')
+    spec = importlib.util.spec_from_file_location(name, fp)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def shared_options(job_parser, argv):
+    """
+    Return the options among a job's arguments `argv` that scrape.py sets
+    for all jobs. A job's own value would be silently ignored, since the
+    objects they configure are shared.
+    """
+    dests = [action.dest for action in parser._actions
+             if action.dest not in ['help', 'job', 'job_file']]
+    # options that are not given keep these values instead of their defaults
+    unset = object()
+    args = job_parser.parse_args(
+        argv, argparse.Namespace(**dict((dest, unset) for dest in dests)))
+    return ['--' + dest for dest in dests if getattr(args, dest) is not unset]
+
+
+def run_jobs(scrapers):
+    """Run the jobs of one source one after the other."""
+    failed = []
+    for desc, scraper in scrapers:
+        try:
+            scraper.main()
+        except Exception as exc:
+            print('Job "{}" failed: {!r}'.format(desc, exc))
+            failed.append(desc)
+    return failed
+
+
+def main():
+    shared = {'LIMITER': LIMITER, 'CONCURRENCY': CONCURRENCY, 'CACHE': CACHE,
+              'FETCHER': FETCHER, 'BROWSERS': BROWSERS, 'PARSER': PARSER,
+              'INDEX': INDEX, 'DEDUP': DEDUP, 'METRICS': METRICS}
+
+    # set every job up before starting any, so bad arguments fail early.
+    # Every job writes to an output file of its own. Jobs for the same
+    # source would compete for the same hosts' rate limits, so they run in
+    # turn while the different sources run concurrently
+    by_source = OrderedDict()
+    for idx, job in enumerate(JOBS):
+        scraper = load_scraper(job[0], '{}_job{}'.format(job[0], idx))
+        scraper.parser.prog = '{} {}'.format(parser.prog, job[0])
+        scraper.configure(job[1:], shared)
+        by_source.setdefault(job[0], []).append((' '.join(job), scraper))
+
+    print('Running {} jobs for {}'.format(len(JOBS), ', '.join(by_source)))
+    failed = []
+    try:
+        with METRICS.exporting(METRICS_FILE, METRICS_INTERVAL), \
+                ThreadPoolExecutor(max_workers=len(by_source)) as executor:
+            for result in executor.map(run_jobs, by_source.values()):
+                failed += result
+    finally:
+        BROWSERS.close()
+        PARSER.close()
+        FETCHER.close()
+        INDEX.close()
+        DEDUP.close()
+        print(BROWSERS.report())
+        print(PARSER.report())
+        print(CONCURRENCY.report())
+        print(CACHE.report())
+        print(FETCHER.report())
+        print(FETCHER.retry.report())
+        print(INDEX.report())
+        print(DEDUP.report())
+        print(METRICS.report())
+
+    if len(failed) > 0:
+        print('{} of {} jobs failed:\n\t{}'
+              .format(len(failed), len(JOBS), '\n\t'.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    JOBS, RATE, BURST, HOST_RATES, MAX_CONCURRENCY, PAGE_LOAD_TIMEOUT, \
+        CACHE_DIR, CACHE_SIZE, CACHE_TTLS, URL_INDEX, DEDUP_INDEX, \
+        DUP_THRESHOLD, POOL_SIZE, PAGES_PER_BROWSER, PARSERS, METRICS_FILE, \
+        METRICS_INTERVAL, RETRIES, BACKOFF, MAX_BACKOFF, BREAKER_THRESHOLD, \
+        BREAKER_COOLDOWN = parse_args(parser)
+
+    METRICS = Metrics()
+    LIMITER = RateLimiter(RATE, BURST, HOST_RATES)
+    CONCURRENCY = AdaptiveConcurrency(maximum=MAX_CONCURRENCY,
+                                      overloaded=is_overloaded)
+    CACHE = HTTPCache(CACHE_DIR, max_bytes=CACHE_SIZE, ttls=CACHE_TTLS)
+    RETRY = RetryPolicy(RETRIES, BACKOFF, MAX_BACKOFF, retryable=is_retryable,
+                        breaker=CircuitBreaker(BREAKER_THRESHOLD,
+                                               BREAKER_COOLDOWN))
+    FETCHER = Fetcher(LIMITER, CONCURRENCY, CACHE, timeout=PAGE_LOAD_TIMEOUT,
+                      retry=RETRY)
+    BROWSERS = BrowserPool(size=POOL_SIZE,
+                           page_load_timeout=PAGE_LOAD_TIMEOUT,
+                           max_pages=PAGES_PER_BROWSER,
+                           metrics=METRICS)
+    PARSER = ParserPool(PARSERS)
+    INDEX = URLIndex(URL_INDEX)
+    DEDUP = DuplicateIndex(DEDUP_INDEX, threshold=DUP_THRESHOLD)
+
+    main()
@@ -4,7 +4,8 @@ query="trump"
 doc_type="Blog"
 date_range="9/25/2016 11/23/2016"
 
-python wapo.py -q $query -t $doc_type
-python nyt.py -q $query -t $doc_type -r $date_range
-python buzzfeed.py -q $query -r $date_range
-python npr.py -q $query
+python scrape.py \
+    --job "wapo -q $query -t $doc_type" \
+    --job "nyt -q $query -t $doc_type -r '$date_range'" \
+    --job "buzzfeed -q $query -r '$date_range'" \
+    --job "npr -q $query"
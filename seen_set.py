@@ -0,0 +1,174 @@
+import math
+import sqlite3
+import hashlib
+
+
+def _digest(item):
+    return hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+
+
+class BloomFilter(object):
+    """
+    A fixed-size Bloom filter sized for `capacity` items at a false-positive
+    rate of `error_rate`. Uses double hashing over one 128-bit digest.
+    """
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.n_bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                    math.log(2) ** 2))
+        self.n_hashes = max(1, int(round(self.n_bits / float(capacity) *
+                                         math.log(2))))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def contains_digest(self, digest):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(digest))
+
+    def add_digest(self, digest):
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return self.contains_digest(_digest(item))
+
+    def add(self, item):
+        self.add_digest(_digest(item))
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+
+class ScalableBloomFilter(object):
+    """
+    A Bloom filter that grows with the number of items instead of having to
+    be sized up front: once the current filter is full, a new one with
+    `growth` times the capacity and `tightening` times the error rate is
+    added. The first filter gets `error_rate * (1 - tightening)`, so the
+    rates add up to at most `error_rate` however many filters there are,
+    while memory grows linearly with the number of items, at a roughly
+    fixed number of bits per item.
+    """
+    def __init__(self, error_rate=0.001, capacity=100000, growth=2,
+                 tightening=0.5):
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = [BloomFilter(capacity, error_rate * (1 - tightening))]
+
+    def contains_digest(self, digest):
+        return any(f.contains_digest(digest) for f in reversed(self.filters))
+
+    def add_digest(self, digest):
+        current = self.filters[-1]
+        if current.count >= current.capacity:
+            current = BloomFilter(current.capacity * self.growth,
+                                  current.error_rate * self.tightening)
+            self.filters.append(current)
+        current.add_digest(digest)
+
+    def __contains__(self, item):
+        return self.contains_digest(_digest(item))
+
+    def add(self, item):
+        self.add_digest(_digest(item))
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    @property
+    def nbytes(self):
+        return sum(f.nbytes for f in self.filters)
+
+
+class DiskSet(object):
+    """
+    An exact set of 128-bit item digests kept in a SQLite table. With the
+    default empty `fp`, SQLite uses a private temporary file that is deleted
+    when the set is closed.
+    """
+    def __init__(self, fp='', batch_size=10000):
+        self.batch_size = batch_size
+        self._pending = 0
+        self._db = sqlite3.connect(fp, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS seen '
+                         '(digest BLOB PRIMARY KEY) WITHOUT ROWID')
+
+    def contains_digest(self, digest):
+        return self._db.execute('SELECT 1 FROM seen WHERE digest = ?',
+                                (digest,)).fetchone() is not None
+
+    def add_digest(self, digest):
+        self._db.execute('INSERT OR IGNORE INTO seen VALUES (?)', (digest,))
+
+        # commit in batches to keep the rollback journal small
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+class SeenSet(object):
+    """
+    A set of the links seen so far whose memory use does not depend on the
+    length of the links: each one costs a few bytes of Bloom filter in
+    memory, and an exact copy of its digest goes to a `DiskSet`. A link the
+    filter has not seen is new for sure; one it reports as seen is confirmed
+    against the disk set, so a false positive of the filter (at a rate of
+    about `error_rate`) costs a disk lookup rather than a dropped link.
+    """
+    def __init__(self, error_rate=0.001, capacity=100000, fp=''):
+        self.filter = ScalableBloomFilter(error_rate, capacity)
+        self.exact = DiskSet(fp)
+        self.stats = {'added': 0, 'confirmed': 0, 'false_positives': 0}
+
+    def __contains__(self, item):
+        digest = _digest(item)
+        if not self.filter.contains_digest(digest):
+            return False
+
+        self.stats['confirmed'] += 1
+        if self.exact.contains_digest(digest):
+            return True
+        self.stats['false_positives'] += 1
+        return False
+
+    def add(self, item):
+        digest = _digest(item)
+        self.filter.add_digest(digest)
+        self.exact.add_digest(digest)
+        self.stats['added'] += 1
+
+    def __len__(self):
+        return self.stats['added']
+
+    def close(self):
+        self.exact.close()
+
+    def report(self):
+        return ('Seen set: {} links in {:.1f} KB of Bloom filter '
+                '({:.1f} bytes per link), {} disk lookups, '
+                '{} false positives'
+                .format(self.stats['added'], self.filter.nbytes / 1024.,
+                        self.filter.nbytes / float(max(1, len(self))),
+                        self.stats['confirmed'],
+                        self.stats['false_positives']))
+
+
+def make_seen_set(kind='set', error_rate=0.001):
+    """Return the container the scrapers track seen links with."""
+    if kind == 'bloom':
+        return SeenSet(error_rate)
+    return set()
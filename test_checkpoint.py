@@ -0,0 +1,90 @@
+import json
+import threading
+
+from checkpoint import Checkpoint
+from output import JSONLWriter, read_jsonl
+
+
+def saved_state(checkpoint):
+    with open(checkpoint.state_fp) as handle:
+        return json.load(handle)
+
+
+def test_updates_wait_for_a_save_in_progress(tmp_path):
+    checkpoint = Checkpoint('run', root=str(tmp_path))
+    checkpoint.start('out.jsonl')
+
+    # save() holds the lock while it serializes the state; a date window
+    # finished on another thread meanwhile must not change it under it
+    with checkpoint._lock:
+        thread = threading.Thread(target=checkpoint.finish_window,
+                                  args=('window', 'done'))
+        thread.start()
+        thread.join(0.1)
+        assert checkpoint.state['windows'] == {}
+    thread.join()
+
+    assert saved_state(checkpoint)['windows'] == {'window': 'done'}
+
+
+def test_resumes_from_a_saved_checkpoint(tmp_path):
+    checkpoint = Checkpoint('run', root=str(tmp_path))
+    checkpoint.start('out.jsonl')
+    checkpoint.add_links(['a', 'b'], 2, False, queries={'a': {'q1'}})
+    checkpoint.add_links(['c'], 3, True, queries={'a': {'q2'}, 'c': {'q2'}})
+    checkpoint.finish_window('2017-01', 'split')
+
+    resumed = Checkpoint('run', root=str(tmp_path))
+    assert resumed.load()
+    assert resumed.links == ['a', 'b', 'c']
+    assert resumed.link_queries == {'a': {'q1', 'q2'}, 'c': {'q2'}}
+    assert resumed.state['jsonl_fp'] == 'out.jsonl'
+    assert resumed.state['next_page'] == 3
+    assert resumed.state['prev_page_empty']
+    assert resumed.state['windows'] == {'2017-01': 'split'}
+    assert not resumed.state['links_done']
+
+    assert not Checkpoint('other', root=str(tmp_path)).load()
+
+
+def test_output_resumes_at_the_last_completed_article(tmp_path):
+    jsonl_fp = str(tmp_path / 'out' / 'run.jsonl')
+    checkpoint = Checkpoint('run', root=str(tmp_path / 'checkpoints'))
+    checkpoint.start(jsonl_fp)
+
+    with JSONLWriter(jsonl_fp) as writer:
+        for url in ['a', 'b']:
+            writer.write({'url': url, 'text': u'caf\xe9'})
+            checkpoint.article_done(writer.offset)
+        # killed after writing the next article, before checkpointing it
+        writer.write({'url': 'c'})
+
+    resumed = Checkpoint('run', root=str(tmp_path / 'checkpoints'))
+    resumed.load()
+    assert resumed.completed_urls() == {'a', 'b'}
+
+    with JSONLWriter(jsonl_fp, resumed.state['offset']) as writer:
+        assert writer.count == 2
+        writer.write({'url': 'd'})
+        writer.write_metadata({'query': 'q'})
+    assert [record.get('url') for record in read_jsonl(jsonl_fp)] == \
+        ['a', 'b', 'd', None]
+
+
+def test_failed_pages_stay_until_searched_again(tmp_path):
+    checkpoint = Checkpoint('run', root=str(tmp_path))
+    checkpoint.start('out.jsonl')
+    checkpoint.page_failed('https://a.com/search?p=2', 'q1')
+    checkpoint.page_failed(['2017-01-01', '2017-01-30'], 'q2')
+    checkpoint.page_failed('https://a.com/search?p=2', 'q1')
+
+    resumed = Checkpoint('run', root=str(tmp_path))
+    resumed.load()
+    assert resumed.failed_pages == [('https://a.com/search?p=2', 'q1'),
+                                    (['2017-01-01', '2017-01-30'], 'q2')]
+
+    resumed.page_retried(['2017-01-01', '2017-01-30'], 'q2', ['a', 'b'],
+                         {'a': ['q2'], 'b': ['q2']})
+    assert resumed.failed_pages == [('https://a.com/search?p=2', 'q1')]
+    assert resumed.links == ['a', 'b']
+    assert resumed.link_queries == {'a': {'q2'}, 'b': {'q2'}}
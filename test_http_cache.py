@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+import contextlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fetch import Fetcher
+from http_cache import HTTPCache, normalize_url
+from throttle import RateLimiter, AdaptiveConcurrency
+
+
+def random_body():
+    # hex digits compress to about half, so each body costs ~5000 bytes
+    return os.urandom(5000).hex()
+
+
+def test_normalize_url_keeps_the_fragment():
+    assert normalize_url('HTTP://Example.com:80?b=2&a=1#page=2') == \
+        'http://example.com/?a=1&b=2#page=2'
+
+
+def test_pages_go_stale_after_their_ttl(tmp_path):
+    cache = HTTPCache(str(tmp_path), ttls={'search': 0.1})
+    cache.put('https://a.com/search', 'search', 'results')
+    cache.put('https://a.com/story', 'article', 'story')
+    assert cache.get('https://A.com/search', 'search') == 'results'
+
+    time.sleep(0.2)
+    assert cache.get('https://a.com/search', 'search') is None
+    assert cache.get('https://a.com/story', 'article') == 'story'
+    assert cache.stats['stale'] == 1
+    cache.close()
+
+
+def test_identical_bodies_are_stored_once(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    body = random_body()
+    assert cache.put('https://a.com/1', 'article', body) == \
+        cache.put('https://a.com/2', 'article', body)
+    assert len(os.listdir(str(tmp_path / 'objects'))) == 1
+    assert cache.get('https://a.com/2', 'article') == body
+    cache.close()
+
+
+def test_least_recently_used_pages_are_evicted(tmp_path):
+    cache = HTTPCache(str(tmp_path), max_bytes=12000)
+    cache.put('https://a.com/1', 'article', random_body())
+    time.sleep(0.01)
+    cache.put('https://a.com/2', 'article', random_body())
+    time.sleep(0.01)
+    assert cache.get('https://a.com/1', 'article') is not None
+    time.sleep(0.01)
+    cache.put('https://a.com/3', 'article', random_body())
+
+    assert cache.stats['evicted'] == 1
+    assert cache.get('https://a.com/2', 'article') is None
+    assert cache.get('https://a.com/1', 'article') is not None
+    assert cache.get('https://a.com/3', 'article') is not None
+    cache.close()
+
+    # the size on disk is restored when the cache is reopened
+    cache = HTTPCache(str(tmp_path), max_bytes=12000)
+    cache.put('https://a.com/4', 'article', random_body())
+    assert cache.stats['evicted'] == 1
+    cache.close()
+
+
+def test_unbounded_cache_never_evicts(tmp_path):
+    cache = HTTPCache(str(tmp_path), max_bytes=None)
+    for i in range(10):
+        cache.put('https://a.com/{}'.format(i), 'archive', random_body())
+    assert cache.stats['evicted'] == 0
+    assert all(cache.get('https://a.com/{}'.format(i), 'archive') is not None
+               for i in range(10))
+    cache.close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = 'article {}'.format(self.etag).encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def article_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/story'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stale_pages_are_revalidated(tmp_path):
+    Handler.etag, Handler.requests = '"v1"', []
+    cache = HTTPCache(str(tmp_path), ttls={'article': 0})
+    fetcher = Fetcher(RateLimiter(None),
+                      AdaptiveConcurrency(log=lambda message: None), cache)
+
+    with article_server() as url:
+        first = fetcher.fetch(url)
+        # the page is stale at once, but unchanged on the server
+        time.sleep(0.01)
+        second = fetcher.fetch(url)
+        assert second == first
+        assert cache.stats['revalidated'] == 1
+
+        Handler.etag = '"v2"'
+        time.sleep(0.01)
+        third = fetcher.fetch(url)
+        assert third.text == 'article "v2"'
+        assert third.digest != first.digest
+
+    assert Handler.requests == [None, '"v1"', '"v1"']
+    fetcher.close()
@@ -0,0 +1,59 @@
+import random
+import sqlite3
+
+from near_dup import MinHasher, DuplicateIndex, similarity
+
+
+def random_text(rng, n_words):
+    return ' '.join('w{}'.format(rng.randrange(5000)) for _ in range(n_words))
+
+
+def test_signature_estimates_jaccard_similarity():
+    hasher = MinHasher()
+    rng = random.Random(0)
+    for n_words in [20, 300, 1500]:
+        words = random_text(rng, n_words).split()
+        edited = list(words)
+        for _ in range(n_words // 10):
+            edited[rng.randrange(n_words)] = 'x{}'.format(rng.randrange(5000))
+        text, other = ' '.join(words), ' '.join(edited)
+
+        a, b = hasher.shingles(text), hasher.shingles(other)
+        jaccard = len(a & b) / float(len(a | b))
+        estimate = similarity(hasher.signature(text), hasher.signature(other))
+        assert abs(estimate - jaccard) < 0.15
+
+
+def test_signature_of_empty_text():
+    assert MinHasher().signature('') is None
+    assert len(MinHasher().signature('one word')) == 128
+
+
+def test_index_finds_near_duplicates(tmp_path):
+    index = DuplicateIndex(str(tmp_path / 'dups.sqlite'))
+    text = random_text(random.Random(1), 500)
+    assert index.check('http://a.com/1', index.signature(text)) is None
+    assert index.check('http://b.com/2',
+                       index.signature(text + ' and one more line')) == \
+        'http://a.com/1'
+    assert index.check('http://c.com/3',
+                       index.signature(random_text(random.Random(2), 500))) \
+        is None
+    index.close()
+
+
+def test_index_drops_signatures_of_another_version(tmp_path):
+    fp = str(tmp_path / 'dups.sqlite')
+    index = DuplicateIndex(fp)
+    text = random_text(random.Random(1), 500)
+    index.check('http://a.com/1', index.signature(text))
+    index.close()
+
+    db = sqlite3.connect(fp)
+    db.execute('PRAGMA user_version = 1')
+    db.commit()
+    db.close()
+
+    index = DuplicateIndex(fp)
+    assert index.check('http://b.com/2', index.signature(text)) is None
+    index.close()
@@ -0,0 +1,98 @@
+import time
+import random
+import threading
+
+import pytest
+
+from pipeline import pipeline, prefetch
+
+
+def test_results_come_in_discovery_order():
+    rng = random.Random(0)
+    delays = dict(('link{}'.format(i), rng.uniform(0, 0.02))
+                  for i in range(40))
+
+    def discover(emit):
+        links = sorted(delays, key=lambda link: int(link[4:]))
+        for i in range(0, len(links), 7):
+            emit(links[i:i + 7])
+
+    def scrape(idx, link):
+        time.sleep(delays[link])
+        return idx, link
+
+    results = list(pipeline(discover, scrape, workers=8))
+    assert results == [(i, 'link{}'.format(i)) for i in range(40)]
+
+
+def test_seen_skipped_and_known_links_are_dropped():
+    def discover(emit):
+        emit(['a', 'b', ' c ', '', 'A'])
+        emit(['b', 'd', 'e'])
+
+    results = list(pipeline(discover, lambda idx, link: link, workers=2,
+                            skip=['d'], key=str.lower,
+                            known=lambda links: {'e'} & set(links)))
+    assert results == ['a', 'b', 'c']
+
+
+def test_discovery_waits_for_extraction():
+    emitted = []
+
+    def discover(emit):
+        for i in range(50):
+            emit(['link{}'.format(i)])
+            emitted.append(i)
+
+    results = pipeline(discover, lambda idx, link: link, workers=1,
+                       max_pending=2)
+    assert next(results) == 'link0'
+    # nothing is consumed meanwhile, so discovery has to stop once the
+    # queue and the pending results are full
+    time.sleep(0.3)
+    assert len(emitted) <= 2 * 2 + 2
+
+    assert list(results) == ['link{}'.format(i) for i in range(1, 50)]
+    assert len(emitted) == 50
+
+
+def test_discovery_errors_are_raised():
+    def discover(emit):
+        emit(['a'])
+        raise ValueError('search failed')
+
+    with pytest.raises(ValueError):
+        list(pipeline(discover, lambda idx, link: link))
+
+
+def test_closing_the_pipeline_stops_discovery():
+    stopped = threading.Event()
+
+    def discover(emit):
+        try:
+            for i in range(1000):
+                emit(['link{}'.format(i)])
+        finally:
+            stopped.set()
+
+    results = pipeline(discover, lambda idx, link: link, max_pending=2)
+    next(results)
+    results.close()
+    assert stopped.wait(1.)
+
+
+def test_prefetch_yields_in_order_and_cancels_on_close():
+    started = []
+
+    def fetch(key):
+        started.append(key)
+        time.sleep(0.01 * (5 - key % 5))
+        return key * 10
+
+    pages = prefetch(fetch, range(100), window=3)
+    assert [next(pages) for _ in range(5)] == \
+        [(i, i * 10) for i in range(5)]
+    pages.close()
+    time.sleep(0.1)
+    # only the window ahead of what was consumed was ever fetched
+    assert len(started) <= 5 + 3
@@ -0,0 +1,125 @@
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'benchmarks'))
+
+import bench_scrape
+from output import read_jsonl, read_article, is_metadata
+from scrape import load_scraper, run_jobs, shared_options
+from url_index import URLIndex
+
+
+def server_args(error_rate=0.):
+    return argparse.Namespace(latency=0., jitter=0., error_rate=error_rate,
+                              pages=2, seed=0, rate=None, max_concurrency=8,
+                              browsers=1, parsers=0, retries=0, backoff=0.,
+                              breaker_threshold=0, breaker_cooldown=0.)
+
+
+def test_same_source_jobs_keep_their_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = server_args()
+
+    with bench_scrape.news_server(args) as server_url:
+        shared = bench_scrape.make_shared(args, server_url,
+                                          bench_scrape.Recorder())
+        shared['INDEX'] = URLIndex(str(tmp_path / 'url_index.sqlite'))
+        scrapers = []
+        for idx, query in enumerate(['election', 'trump']):
+            scraper = load_scraper('nyt', 'nyt_job{}'.format(idx))
+            scraper.configure(['-q', query, '--workers', '4'], shared)
+            scrapers.append((query, scraper))
+        try:
+            assert run_jobs(scrapers) == []
+        finally:
+            bench_scrape.close_shared(shared)
+
+    queries, urls = [], []
+    for fp in glob.glob('scraped_json/*.jsonl'):
+        records = list(read_jsonl(fp))
+        queries.append(records[-1]['metadata']['query'])
+        articles = [record for record in records if not is_metadata(record)]
+        assert len(articles) > 0
+        urls += [article['url'] for article in articles]
+    assert sorted(queries) == ['election', 'trump']
+
+    # every article the index knows of is still where it says it is
+    index = shared['INDEX']
+    for url in urls:
+        _, _, output, offset = index.lookup(url)
+        assert os.path.isabs(output)
+        assert read_article(output, offset)['url'] == url
+    index.close()
+
+
+def run_nyt(args, argv, name):
+    with bench_scrape.news_server(args) as server_url:
+        recorder = bench_scrape.Recorder()
+        shared = bench_scrape.make_shared(args, server_url, recorder)
+        scraper = load_scraper('nyt', name)
+        scraper.configure(argv, shared)
+        try:
+            assert run_jobs([(name, scraper)]) == []
+        finally:
+            bench_scrape.close_shared(shared)
+    return scraper, len(recorder.take())
+
+
+def test_failed_windows_are_searched_again_on_resume(tmp_path, monkeypatch,
+                                                     capsys):
+    monkeypatch.chdir(tmp_path)
+    argv = ['-q', 'election', '-r', '01/01/2016 02/29/2016',
+            '--window_days', '30', '--window_pages', '5']
+
+    # every search page fails: the windows are neither split nor finished
+    scraper, n_requests = run_nyt(server_args(error_rate=1.), argv, 'nyt_a')
+    assert 'splitting' not in capsys.readouterr().out
+    assert n_requests == 2 * 5
+    assert sorted(scraper.CHECKPOINT.failed_pages) == [
+        (['2016-01-01', '2016-01-30'], 'election'),
+        (['2016-01-31', '2016-02-29'], 'election')]
+
+    scraper, _ = run_nyt(server_args(), argv + ['--resume'], 'nyt_b')
+    assert 'Searching 2 failed pages again' in capsys.readouterr().out
+    assert not os.path.exists(scraper.CHECKPOINT.dir)
+
+    records = list(read_jsonl(glob.glob('scraped_json/*.jsonl')[0]))
+    assert len([record for record in records if not is_metadata(record)]) > 0
+
+
+class SlowLaunchPool(bench_scrape.LocalBrowserPool):
+    def _launch(self):
+        time.sleep(0.3)
+        return bench_scrape.LocalBrowserPool._launch(self)
+
+
+def test_browser_launch_is_not_host_latency(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = server_args()
+    with bench_scrape.news_server(args) as server_url:
+        shared = bench_scrape.make_shared(args, server_url,
+                                          bench_scrape.Recorder())
+        shared['BROWSERS'].close()
+        shared['BROWSERS'] = SlowLaunchPool(server_url,
+                                            bench_scrape.Recorder(), size=1)
+        scraper = load_scraper('nyt', 'nyt_launch')
+        scraper.configure(['-q', 'election'], shared)
+        try:
+            scraper.load_page(scraper.gen_query_url('election'))
+        finally:
+            bench_scrape.close_shared(shared)
+
+    (_, latency), = shared['CONCURRENCY'].limits().values()
+    assert latency < 0.3
+
+
+def test_jobs_may_not_set_shared_options():
+    job_parser = load_scraper('nyt', 'nyt_options').parser
+    assert shared_options(job_parser, ['-q', 'trump', '--workers', '4']) == []
+    argv = ['-q', 'trump', '--rate=2', '--cache_dir', '', '--max_conc', '4']
+    assert shared_options(job_parser, argv) == \
+        ['--rate', '--max_concurrency', '--cache_dir']
@@ -0,0 +1,112 @@
+import time
+import threading
+
+import pytest
+
+from throttle import AdaptiveConcurrency, RateLimiter, parse_host_rates
+
+URL = 'https://www.nytimes.com/story'
+
+
+class Overloaded(Exception):
+    pass
+
+
+def limiter(**kwargs):
+    return AdaptiveConcurrency(overloaded=lambda exc:
+                               isinstance(exc, Overloaded),
+                               log=lambda message: None, **kwargs)
+
+
+def request(concurrency, seconds=0., exc=None):
+    with concurrency.slot(URL):
+        time.sleep(seconds)
+        if exc is not None:
+            raise exc
+
+
+def limit(concurrency):
+    return concurrency.limits()['www.nytimes.com'][0]
+
+
+def test_limit_grows_by_one_per_window_of_requests():
+    # requests this short are all noise in their latency
+    concurrency = limiter(initial=1, maximum=8, tolerance=float('inf'))
+    request(concurrency)
+    assert limit(concurrency) == 2
+    for _ in range(2):
+        request(concurrency)
+        assert limit(concurrency) == 2
+    request(concurrency)
+    assert limit(concurrency) == 3
+
+    for _ in range(100):
+        request(concurrency)
+    assert limit(concurrency) == 8
+
+
+def test_limit_halves_when_the_host_is_overloaded():
+    concurrency = limiter(initial=8, maximum=8)
+    with pytest.raises(Overloaded):
+        request(concurrency, exc=Overloaded())
+    assert limit(concurrency) == 4
+
+    # other errors say nothing about the host's load
+    with pytest.raises(ValueError):
+        request(concurrency, exc=ValueError())
+    assert limit(concurrency) == 4
+
+    for _ in range(5):
+        with pytest.raises(Overloaded):
+            request(concurrency, exc=Overloaded())
+    assert limit(concurrency) == 1
+
+
+def test_limit_shrinks_when_latency_jumps():
+    concurrency = limiter(initial=4, maximum=8, tolerance=2.)
+    request(concurrency, 0.01)
+    assert limit(concurrency) == 4
+    request(concurrency, 0.1)
+    assert limit(concurrency) == 2
+
+
+def test_requests_wait_for_a_free_slot():
+    concurrency = limiter(initial=2, maximum=2)
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow_request():
+        with concurrency.slot(URL):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+
+    threads = [threading.Thread(target=slow_request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+
+
+def test_rate_limiter_spaces_requests_per_host():
+    rate_limiter = RateLimiter(20, host_rates={'slow.com': (5, None)})
+    start = time.time()
+    for _ in range(3):
+        rate_limiter.wait('https://fast.com/a')
+    assert time.time() - start < 0.2
+
+    start = time.time()
+    for _ in range(3):
+        rate_limiter.wait('https://slow.com/a')
+    assert time.time() - start >= 0.35
+
+
+def test_parse_host_rates():
+    assert parse_host_rates('query.nytimes.com=0.2 WWW.nytimes.com=2:5') == \
+        {'query.nytimes.com': (0.2, None), 'www.nytimes.com': (2., 5)}
+    with pytest.raises(ValueError):
+        parse_host_rates('www.nytimes.com')
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from url_index import canonicalize_url, URLIndex
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ('http://www.nytimes.com/2017/01/01/us/story.html',
+     'https://www.nytimes.com/2017/01/01/us/story.html'),
+    ('https://WWW.NYTimes.com:443/2017/01/01/us/story.html/',
+     'https://www.nytimes.com/2017/01/01/us/story.html'),
+    ('http://www.npr.org:80/story?b=2&a=1#comments',
+     'https://www.npr.org/story?a=1&b=2'),
+    ('https://www.buzzfeed.com/post?utm_source=fb&utm_medium=x&ref=hp&id=7',
+     'https://www.buzzfeed.com/post?id=7'),
+    ('https://www.washingtonpost.com/story?WPISRC=nl&Tid=a',
+     'https://www.washingtonpost.com/story'),
+    ('  https://www.npr.org  ', 'https://www.npr.org/'),
+    ('https://www.npr.org./story?empty=', 'https://www.npr.org/story?empty='),
+])
+def test_canonicalize_url(url, canonical):
+    assert canonicalize_url(url) == canonical
+
+
+def test_index_finds_urls_in_any_form(tmp_path):
+    index = URLIndex(str(tmp_path / 'index' / 'url_index.sqlite'))
+    index.add('https://www.npr.org/story?utm_source=rss', 'out.jsonl', 120)
+
+    urls = ['http://www.npr.org/story/', 'https://www.npr.org/other']
+    assert index.known(urls) == {'http://www.npr.org/story/'}
+
+    url, _, output, offset = index.lookup('http://WWW.npr.org/story')
+    assert url == 'https://www.npr.org/story?utm_source=rss'
+    assert output == os.path.abspath('out.jsonl')
+    assert offset == 120
+    assert index.lookup('https://www.npr.org/other') is None
+    index.close()
+
+    # and still does on the next run
+    index = URLIndex(str(tmp_path / 'index' / 'url_index.sqlite'))
+    assert index.known(urls) == {'http://www.npr.org/story/'}
+    index.close()
+
+
+def test_disabled_index_knows_nothing():
+    index = URLIndex('')
+    index.add('https://www.npr.org/story', 'out.jsonl', 0)
+    assert index.known(['https://www.npr.org/story']) == set()
+    assert index.lookup('https://www.npr.org/story') is None
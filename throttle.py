@@ -0,0 +1,179 @@
+import time
+import threading
+import contextlib
+
+from urllib.parse import urlparse
+
+
+def get_host(url):
+    return urlparse(url).netloc.lower()
+
+
+def parse_host_rates(spec):
+    """
+    Parse a space separated string of `host=rate[:burst]` entries, e.g.
+    'query.nytimes.com=0.2 www.nytimes.com=2:5', into a dict mapping each
+    host to a (rate, burst) tuple. Hosts given without a burst get None.
+    """
+    host_rates = {}
+    for entry in spec.split():
+        host, _, limit = entry.partition('=')
+        rate, _, burst = limit.partition(':')
+        if not host or not rate:
+            raise ValueError('Could not parse host rate limit {}'.format(entry))
+        host_rates[host.lower()] = \
+            (float(rate), int(burst) if burst else None)
+    return host_rates
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.time()
+
+    def reserve(self, now):
+        """
+        Take a token and return how long the caller has to wait before it may
+        use it. The balance is allowed to go negative so that concurrent
+        callers queue up behind each other instead of racing for refills.
+        """
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.
+        return -self.tokens / self.rate
+
+
+class RateLimiter(object):
+    """
+    A token bucket per host. Requests to the same host share a bucket of
+    `burst` tokens refilled at `rate` requests per second; requests to
+    different hosts never wait on each other.
+    """
+    def __init__(self, rate, burst=1, host_rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = host_rates or {}
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host):
+        if host not in self._buckets:
+            rate, burst = self.host_rates.get(host, (self.rate, self.burst))
+            # a rate of None means requests to this host are not limited
+            self._buckets[host] = \
+                TokenBucket(rate, burst or self.burst) if rate else None
+        return self._buckets[host]
+
+    def wait(self, url):
+        host = get_host(url)
+        with self._lock:
+            bucket = self._bucket(host)
+            delay = bucket.reserve(time.time()) if bucket else 0.
+
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class _HostWindow(object):
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.latency = None
+        self.cond = threading.Condition()
+
+
+class AdaptiveConcurrency(object):
+    """
+    AIMD control of the number of requests in flight to each host. Every
+    request that completes without trouble grows the host's limit by
+    `increase / limit` (i.e., by `increase` per window of requests); a
+    request that times out, is refused as overloaded (see `overloaded`), or
+    takes more than `tolerance` times the host's smoothed latency shrinks the
+    limit by a factor of `decrease`.
+    """
+    def __init__(self, initial=1, minimum=1, maximum=8, increase=1.,
+                 decrease=0.5, tolerance=2., smoothing=0.2, overloaded=None,
+                 log=print):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.overloaded = overloaded or (lambda exc: False)
+        self.log = log
+
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _window(self, host):
+        with self._lock:
+            if host not in self._windows:
+                self._windows[host] = _HostWindow(
+                    min(max(self.initial, self.minimum), self.maximum))
+            return self._windows[host]
+
+    @contextlib.contextmanager
+    def slot(self, url):
+        host = get_host(url)
+        win = self._window(host)
+        with win.cond:
+            while win.in_flight >= int(win.limit):
+                win.cond.wait()
+            win.in_flight += 1
+
+        start = time.time()
+        failed = False
+        try:
+            yield
+        except Exception as exc:
+            failed = self.overloaded(exc)
+            raise
+        finally:
+            self._update(host, win, time.time() - start, failed)
+
+    def _update(self, host, win, elapsed, failed):
+        with win.cond:
+            win.in_flight -= 1
+            old_limit = int(win.limit)
+
+            congested = failed or (win.latency is not None and
+                                   elapsed > self.tolerance * win.latency)
+
+            if congested:
+                win.limit = max(self.minimum, win.limit * self.decrease)
+            else:
+                win.limit = min(self.maximum,
+                                win.limit + self.increase / win.limit)
+
+            # timed out requests say nothing about the host's normal latency
+            if not failed and win.latency is None:
+                win.latency = elapsed
+            elif not failed:
+                win.latency += self.smoothing * (elapsed - win.latency)
+
+            new_limit = int(win.limit)
+            win.cond.notify_all()
+
+        if new_limit != old_limit:
+            self.log("\t\t[{}] concurrency limit {} -> {} ({:.2f}s latency)"
+                     .format(host, old_limit, new_limit, win.latency or 0.))
+
+    def limits(self):
+        with self._lock:
+            return {host: (int(win.limit), win.latency)
+                    for host, win in self._windows.items()}
+
+    def report(self):
+        limits = self.limits()
+        return 'Concurrency limits: ' + ', '.join(
+            '{}={} ({:.2f}s)'.format(host, limit, latency or 0.)
+            for host, (limit, latency) in sorted(limits.items()))
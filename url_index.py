@@ -0,0 +1,139 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# query parameters that only track where a click came from
+TRACKING_PARAMS = {'_r', 'action', 'bffbmain', 'bftw', 'cmpid',
+                   'contentcollection', 'emc', 'f', 'fbclid', 'ft', 'gclid',
+                   'hp', 'mc_cid', 'mc_eid', 'module', 'partner', 'pgtype',
+                   'ref', 'region', 'smid', 'smtyp', 'src', 'tid', 'wpisrc',
+                   'wpmm', 'wprss', 'wt.nav'}
+
+# number of URLs looked up per SQL query
+BATCH_SIZE = 500
+
+
+def canonicalize_url(url):
+    """
+    Reduce an article URL to the form used as its identity: http and https
+    are treated alike, the host is lowercased and loses its default port,
+    tracking parameters and the fragment are dropped, the remaining query
+    parameters are sorted and a trailing slash is removed from the path.
+    """
+    parts = urlsplit(url.strip())
+    netloc = parts.netloc.lower().rstrip('.')
+    if netloc.rpartition(':')[2] in ['80', '443']:
+        netloc = netloc.rpartition(':')[0]
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k.lower() not in TRACKING_PARAMS and
+             not k.lower().startswith('utm_')]
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https', netloc, path, urlencode(sorted(query)), ''))
+
+
+def url_key(url):
+    return hashlib.sha1(canonicalize_url(url).encode('utf-8')).digest()[:16]
+
+
+class URLIndex(object):
+    """
+    A persistent record of every article URL scraped so far, across runs and
+    sources, so that an article reached again (over http instead of https,
+    with different tracking parameters or through another query) is not
+    downloaded twice. Each canonical URL maps to when it was scraped and to
+    the JSONL file and byte offset its record was written to.
+
+    URLs are keyed by a 16-byte hash of their canonical form in a
+    WITHOUT ROWID table, so the index stays a single compact B-tree and a
+    lookup costs a handful of page reads even with tens of millions of URLs.
+    """
+    def __init__(self, fp='./url_index.sqlite'):
+        self.fp = fp
+        self.stats = {'known': 0, 'added': 0}
+        self._lock = threading.Lock()
+
+        self.enabled = bool(fp)
+        if not self.enabled:
+            return
+
+        dirname = os.path.dirname(fp)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self._db = sqlite3.connect(fp, check_same_thread=False)
+        # several scrapers may share the file; WAL lets readers carry on
+        # while another run records an article
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS urls ('
+            'key BLOB PRIMARY KEY, url TEXT, scraped_at REAL, '
+            'output TEXT, offset INTEGER) WITHOUT ROWID')
+        self._db.commit()
+
+    def known(self, urls):
+        """Return the subset of `urls` that were scraped before."""
+        if not self.enabled:
+            return set()
+
+        keys = {}
+        for url in urls:
+            keys.setdefault(url_key(url), []).append(url)
+
+        found = set()
+        key_list = list(keys)
+        with self._lock:
+            for i in range(0, len(key_list), BATCH_SIZE):
+                batch = key_list[i:i + BATCH_SIZE]
+                rows = self._db.execute(
+                    'SELECT key FROM urls WHERE key IN ({})'
+                    .format(', '.join('?' * len(batch))), batch)
+                for row in rows:
+                    found.update(keys[row[0]])
+            self.stats['known'] += len(found)
+        return found
+
+    def lookup(self, url):
+        """
+        Return the (url, scraped_at, output, offset) recorded for `url`, or
+        None if it has not been scraped.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            return self._db.execute(
+                'SELECT url, scraped_at, output, offset FROM urls '
+                'WHERE key = ?', (url_key(url),)).fetchone()
+
+    def add(self, url, output, offset):
+        """Record that `url` was scraped to byte `offset` of `output`."""
+        if not self.enabled:
+            return
+
+        # the index outlives the working directory of the run
+        if output is not None:
+            output = os.path.abspath(output)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?)',
+                (url_key(url), url, time.time(), output, offset))
+            self._db.commit()
+            self.stats['added'] += 1
+
+    def close(self):
+        if self.enabled:
+            self._db.close()
+
+    def report(self):
+        if not self.enabled:
+            return 'URL index: disabled'
+        with self._lock:
+            stats = dict(self.stats)
+        return ('URL index: skipped {} articles scraped on earlier runs, '
+                'recorded {} new'.format(stats['known'], stats['added']))